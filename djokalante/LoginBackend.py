@@ -1,16 +1,53 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
 from django.core.exceptions import ObjectDoesNotExist
 
+from djokalante.hachage import hachage_factice, verifier_mot_de_passe
+from djokalante.limitation import connexion_bloquee, connexion_echouee, connexion_reussie
+
 
 class LoginBackend(ModelBackend):
-    def authenticate(self, username=None, password=None, **kwargs):
+    """
+    Authentification par identifiant et mot de passe, limitee par identifiant et par echecs de l'adresse IP.
+
+    Une tentative bloquee est refusee sans hachage ; un identifiant inconnu coute un hachage factice, comme un
+    identifiant connu. aauthenticate() fait le hachage hors de la boucle d'evenements sous ASGI.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None or connexion_bloquee(request, username):
+            return None
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except ObjectDoesNotExist:
+            hachage_factice(password)
+            connexion_echouee(request)
+            return None
+        correct, nouveau = verifier_mot_de_passe(password, user.password)
+        return self._conclure(request, user, username, correct, nouveau)
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None or await sync_to_async(connexion_bloquee)(request, username):
+            return None
         UserModel = get_user_model()
         try:
-            user = UserModel.objects.get(username=username)
+            user = await UserModel._default_manager.aget(**{UserModel.USERNAME_FIELD: username})
         except ObjectDoesNotExist:
+            await sync_to_async(hachage_factice, thread_sensitive=False)(password)
+            await sync_to_async(connexion_echouee)(request)
+            return None
+        correct, nouveau = await sync_to_async(verifier_mot_de_passe, thread_sensitive=False)(password,
+                                                                                               user.password)
+        return await sync_to_async(self._conclure)(request, user, username, correct, nouveau)
+
+    def _conclure(self, request, user, username, correct, nouveau):
+        if not correct or not self.user_can_authenticate(user):
+            connexion_echouee(request)
             return None
-        else:
-            if user.check_password(password):
-                return user
-        return None
+        if nouveau:
+            user.password = nouveau
+            user.save(update_fields=['password'])
+        connexion_reussie(username)
+        return user
@@ -0,0 +1,27 @@
+from django.contrib.auth.backends import BaseBackend
+from django.core.exceptions import PermissionDenied
+
+from djokalante.habilitations import habilitations
+
+
+class ProfilBackend(BaseBackend):
+    """
+    Autorise les codes d'action (Action.action_code) a partir des habilitations precalculees du profil.
+
+    Les permissions Django ("app.codename") sont laissees aux autres backends. Pour un code d'action refuse, le
+    backend leve PermissionDenied afin que les backends suivants ne fassent pas de requete inutile.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return habilitations.actions(user_obj.profil_id)
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if '.' in perm:
+            return False
+        if user_obj.is_active and user_obj.is_superuser:
+            return True
+        if perm in self.get_all_permissions(user_obj, obj):
+            return True
+        raise PermissionDenied
@@ -1,3 +1,312 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin
 
-# Register your models here.
+from djokalante.models import (Action, Banque, Commercant, Compte, CumulJournalier, CumulTransfertJournalier, Devise,
+                               Ecriture, Employeur, Guichet, HistoriqueFichierVirement, Journalisation, LigneReleve,
+                               LigneVirement, Motif, NomRecherche, ParametreApplication, Pays, Profil, Programme,
+                               Promotion, ReleveBancaire, SequenceCode, Transfert, TrigrammeNom, TypePiece,
+                               Utilisateur)
+from djokalante.pagination import KeysetAdminMixin
+from djokalante.transferts import TransfertError, annuler_transfert
+
+# Regles communes aux listes et formulaires de l'admin :
+# - les cles vers Utilisateur sont saisies par identifiant (raw_id_fields) et jointes dans les listes
+#   (list_select_related) : ni liste deroulante de tous les utilisateurs, ni une requete par ligne affichee ;
+# - les cles vers les tables de reference passent par l'autocompletion, qui ne charge que les choix cherches ;
+# - filtres, recherches et hierarchies de dates ne portent que sur des colonnes en tete d'un index ;
+# - les grandes tables paginent par curseur (KeysetAdminMixin), sans COUNT(*) ni OFFSET.
+AUDIT = ('user_creator', 'user_modificator')
+
+
+class AuditAdmin(admin.ModelAdmin):
+    list_select_related = AUDIT
+    raw_id_fields = AUDIT
+    readonly_fields = ('date_creation', 'date_modification')
+    # Soldes tenus par grand_livre.py (UPDATE solde = solde + x et Ecriture) : en lecture seule, a zero a la creation
+    soldes = ()
+
+    def get_readonly_fields(self, request, obj=None):
+        return (*super().get_readonly_fields(request, obj), *self.soldes)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            for champ in self.soldes:
+                setattr(obj, champ, 0)
+            obj.save()
+            return
+        # Les colonnes en lecture seule ne sont pas reecrites avec la valeur lue a l'ouverture du formulaire : un
+        # solde ou un etat modifie entre-temps par l'application serait ecrase
+        lecture_seule = set(self.get_readonly_fields(request, obj))
+        obj.save(update_fields=[champ.name for champ in obj._meta.concrete_fields if not champ.primary_key and (
+            champ.name not in lecture_seule or getattr(champ, 'auto_now', False))])
+
+    # Suppression logique : statut DELETE en un UPDATE, les lignes restent pour l'historique et les soldes
+    def delete_model(self, request, obj):
+        obj.soft_delete(request.user)
+
+    def delete_queryset(self, request, queryset):
+        queryset.soft_delete(request.user)
+
+
+class LectureSeuleAdmin(admin.ModelAdmin):
+    """Tables tenues par l'application (cumuls, ecritures, index) : consultation seulement."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# Referentiel
+
+@admin.register(Action)
+class ActionAdmin(admin.ModelAdmin):
+    list_display = ('action_code', 'name', 'nivel', 'action_parent')
+    list_select_related = ('action_parent',)
+    search_fields = ('action_code', 'name')
+    autocomplete_fields = ('action_parent',)
+
+
+@admin.register(Banque)
+class BanqueAdmin(AuditAdmin):
+    list_display = ('name', 'account_number', 'phone', 'bank_rate', 'statut', *AUDIT)
+    search_fields = ('name',)
+
+
+@admin.register(Commercant)
+class CommercantAdmin(AuditAdmin):
+    list_display = ('mercahnd_code', 'social_reson', 'phone', 'status', 'statut', *AUDIT)
+    search_fields = ('mercahnd_code__exact', 'social_reson')
+
+
+@admin.register(Devise)
+class DeviseAdmin(AuditAdmin):
+    list_display = ('code', 'name', 'statut', *AUDIT)
+    search_fields = ('code', 'name')
+
+
+@admin.register(Employeur)
+class EmployeurAdmin(AuditAdmin):
+    list_display = ('social_reson', 'account_number', 'phone', 'account', 'statut', *AUDIT)
+    search_fields = ('social_reson', 'account_number')
+    soldes = ('account',)
+
+
+@admin.register(Guichet)
+class GuichetAdmin(AuditAdmin):
+    list_display = ('name', 'pays_guichet', 'phone', 'account', 'statut', *AUDIT)
+    list_select_related = ('pays_guichet', *AUDIT)
+    search_fields = ('name', 'account_number')
+    autocomplete_fields = ('pays_guichet',)
+    soldes = ('account',)
+
+
+@admin.register(Motif)
+class MotifAdmin(AuditAdmin):
+    list_display = ('libelle', 'statut', *AUDIT)
+    search_fields = ('libelle',)
+
+
+@admin.register(ParametreApplication)
+class ParametreApplicationAdmin(admin.ModelAdmin):
+    list_display = ('name', 'version_number', 'seuil_solde', 'plafond_journalier', 'statut')
+    readonly_fields = ('date_creation', 'date_modification')
+
+
+@admin.register(Pays)
+class PaysAdmin(AuditAdmin):
+    list_display = ('code', 'name', 'devise_pays', 'statut', *AUDIT)
+    list_select_related = ('devise_pays', *AUDIT)
+    search_fields = ('code', 'name')
+    autocomplete_fields = ('devise_pays',)
+
+
+@admin.register(Profil)
+class ProfilAdmin(AuditAdmin):
+    list_display = ('name', 'statut', *AUDIT)
+    search_fields = ('name',)
+    autocomplete_fields = ('actions',)
+
+
+@admin.register(Programme)
+class ProgrammeAdmin(AuditAdmin):
+    list_display = ('name', 'promotor_name', 'start_date', 'end_date', 'account', 'statut', *AUDIT)
+    search_fields = ('name', 'promotor_name')
+    soldes = ('account',)
+
+
+@admin.register(Promotion)
+class PromotionAdmin(AuditAdmin):
+    list_display = ('libelle', 'date_debut', 'date_fin', 'porcentage', 'statut', *AUDIT)
+    search_fields = ('libelle',)
+
+
+@admin.register(TypePiece)
+class TypePieceAdmin(AuditAdmin):
+    list_display = ('name', 'statut', *AUDIT)
+    search_fields = ('name',)
+
+
+@admin.register(Utilisateur)
+class UtilisateurAdmin(UserAdmin):
+    list_display = ('username', 'last_name', 'first_name', 'telephone', 'profil', 'statut', 'is_active')
+    list_select_related = ('profil',)
+    # Un seul COUNT(*) par page : pas de second comptage de la table entiere a cote du nombre filtre
+    show_full_result_count = False
+    search_fields = ('username', 'last_name', 'first_name', 'telephone__exact', 'email')
+    raw_id_fields = AUDIT
+    autocomplete_fields = ('user_pays', 'profil')
+    readonly_fields = ('date_creation', 'date_modification')
+    fieldsets = UserAdmin.fieldsets + (
+        ("Khaliss", {'fields': ('telephone', 'adresse', 'user_pays', 'profil', 'statut', *AUDIT,
+                                'date_creation', 'date_modification')}),
+    )
+    add_fieldsets = UserAdmin.add_fieldsets + (
+        ("Khaliss", {'fields': ('last_name', 'first_name', 'email', 'telephone', 'adresse', 'statut')}),
+    )
+
+
+# Operations
+
+@admin.register(Transfert)
+class TransfertAdmin(KeysetAdminMixin, AuditAdmin):
+    cles_pagination = ('-send_date', '-id')
+    estimer_total = True
+    list_display = ('operation_number', 'send_date', 'expeditor_last_name', 'beneficiaire_last_name', 'account',
+                    'state', 'guichet', 'user_creator')
+    list_select_related = ('guichet', 'user_creator')
+    # transfert_etat_idx et transfert_envoi_idx ; la hierarchie filtre send_date par intervalle
+    list_filter = ('state',)
+    date_hierarchy = 'send_date'
+    search_fields = ('operation_number__exact', 'expeditor_phone__exact')
+    # Seuls les noms et le telephone du beneficiaire se corrigent ici (l'index de recherche suit post_save) :
+    # montants, etat, guichet, promotion et pieces passent par transferts.py, qui tient soldes, cumuls et velocite
+    modifiables = ('expeditor_first_name', 'expeditor_last_name', 'beneficiaire_first_name',
+                   'beneficiaire_last_name', 'beneficiaire_phone')
+    actions = ('annuler',)
+
+    def get_readonly_fields(self, request, obj=None):
+        return [champ.name for champ in self.model._meta.concrete_fields if champ.name not in self.modifiables]
+
+    # Pas d'ajout ni de suppression : un transfert s'envoie et s'annule par transferts.py
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Annuler les transferts selectionnes", permissions=('change',))
+    def annuler(self, request, queryset):
+        annules = 0
+        for transfert in queryset.only('pk'):
+            try:
+                annuler_transfert(transfert, request.user)
+            except TransfertError as erreur:
+                self.message_user(request, str(erreur), messages.WARNING)
+            else:
+                annules += 1
+        self.message_user(request, f"{annules} transfert(s) annule(s)", messages.SUCCESS)
+
+
+@admin.register(Compte)
+class CompteAdmin(KeysetAdminMixin, AuditAdmin):
+    list_display = ('card_number', 'phone', 'last_name', 'first_name', 'solde', 'account_status')
+    list_select_related = ()
+    search_fields = ('card_number__exact', 'phone__exact')
+    autocomplete_fields = ('piece_type',)
+    soldes = ('solde',)
+
+
+@admin.register(HistoriqueFichierVirement)
+class HistoriqueFichierVirementAdmin(AuditAdmin):
+    list_display = ('file_name', 'employe', 'etat', 'lignes_traitees', 'lignes_rejetees', 'montant_total',
+                    'date_creation', 'user_creator')
+    list_select_related = ('employe', 'user_creator')
+    autocomplete_fields = ('employe',)
+    # Avancement et totaux tenus par virements.py
+    readonly_fields = (*AuditAdmin.readonly_fields, 'etat', 'dernier_lot', 'derniere_ligne', 'lignes_traitees',
+                       'lignes_rejetees', 'montant_total', 'message_erreur')
+
+
+@admin.register(LigneVirement)
+class LigneVirementAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    # Lignes ecrites par virements.py
+    list_display = ('historique', 'numero_ligne', 'phone', 'montant', 'compte', 'etat', 'motif_rejet')
+    list_select_related = ('historique', 'compte')
+
+
+@admin.register(ReleveBancaire)
+class ReleveBancaireAdmin(AuditAdmin):
+    list_display = ('file_name', 'banque', 'etat', 'lignes_traitees', 'lignes_rapprochees', 'lignes_rejetees',
+                    'date_creation', 'user_creator')
+    list_select_related = ('banque', 'user_creator')
+    autocomplete_fields = ('banque',)
+    # Avancement et totaux tenus par rapprochement.py
+    readonly_fields = (*AuditAdmin.readonly_fields, 'etat', 'lignes_traitees', 'lignes_rapprochees',
+                       'lignes_rejetees', 'message_erreur')
+
+
+@admin.register(LigneReleve)
+class LigneReleveAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    # Lignes ecrites par rapprochement.py
+    list_display = ('releve', 'numero_ligne', 'date_operation', 'montant', 'reference', 'transfert', 'etat')
+    list_select_related = ('releve', 'transfert')
+
+
+# Tables tenues par l'application
+
+@admin.register(Journalisation)
+class JournalisationAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    cles_pagination = ('-date_event', '-id')
+    estimer_total = True
+    list_display = ('date_event', 'event', 'description')
+    # journal_date_idx
+    date_hierarchy = 'date_event'
+
+
+@admin.register(Ecriture)
+class EcritureAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    list_display = ('date_event', 'nature', 'titulaire_id', 'montant', 'libelle', 'reference', 'consolidee')
+    # ecriture_titulaire_idx, ecriture_consolidee_idx et ecriture_reference_idx
+    list_filter = ('nature', 'consolidee')
+    search_fields = ('reference__exact',)
+
+
+@admin.register(CumulJournalier)
+class CumulJournalierAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    list_display = ('expeditor_phone', 'jour', 'montant', 'nombre')
+    # cumul_journalier_unique
+    search_fields = ('expeditor_phone__exact',)
+
+
+@admin.register(CumulTransfertJournalier)
+class CumulTransfertJournalierAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    cles_pagination = ('-jour', '-id')
+    list_display = ('jour', 'guichet_id', 'pays_id', 'devise_id', 'motif_id', 'state', 'nombre', 'montant',
+                    'commission')
+    # cumul_transfert_unique
+    date_hierarchy = 'jour'
+
+
+@admin.register(NomRecherche)
+class NomRechercheAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    list_display = ('nature', 'objet_id', 'texte')
+    # nom_recherche_unique
+    list_filter = ('nature',)
+
+
+@admin.register(TrigrammeNom)
+class TrigrammeNomAdmin(KeysetAdminMixin, LectureSeuleAdmin):
+    list_display = ('trigramme', 'nature', 'nom')
+    list_select_related = ('nom',)
+    # trigramme_nom_idx
+    search_fields = ('trigramme__exact',)
+
+
+@admin.register(SequenceCode)
+class SequenceCodeAdmin(LectureSeuleAdmin):
+    list_display = ('nom', 'prochain')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DjokalanteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'djokalante'
+
+    def ready(self):
+        from djokalante import habilitations, journal, mesures, parametres, recherche, referentiel  # noqa: F401
@@ -0,0 +1,148 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from djokalante.models import Journalisation
+
+MAGIQUE = b'KJA1'
+FIN = struct.Struct('<Q4s')
+FORMAT_DATE = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def horodatage(date):
+    """Date UTC a largeur fixe : les comparaisons de chaines suivent l'ordre chronologique."""
+    return date.astimezone(dt_timezone.utc).strftime(FORMAT_DATE)
+
+
+def partition(date):
+    return date.astimezone(dt_timezone.utc).strftime('%Y-%m')
+
+
+def repertoire_archives():
+    return Path(getattr(settings, 'KHALISS_ARCHIVES_JOURNAL', Path(settings.BASE_DIR) / 'var' / 'archives'))
+
+
+class EcrivainArchive:
+    """
+    Ecrit une archive de journal : des blocs JSONL compresses par zlib puis un index JSON des blocs (position,
+    taille, premiere et derniere date). Les lignes doivent arriver dans l'ordre chronologique.
+    """
+
+    def __init__(self, chemin, lignes_par_bloc=2000):
+        self.chemin = Path(chemin)
+        self.temporaire = self.chemin.with_suffix('.tmp')
+        self.lignes_par_bloc = lignes_par_bloc
+        self.fichier = open(self.temporaire, 'wb')
+        self.blocs = []
+        self.tampon = []
+        self.nombre = 0
+
+    def ecrire(self, ligne):
+        self.tampon.append(ligne)
+        if len(self.tampon) >= self.lignes_par_bloc:
+            self._vider()
+
+    def _vider(self):
+        if not self.tampon:
+            return
+        donnees = zlib.compress(''.join(json.dumps(ligne) + '\n' for ligne in self.tampon).encode(), 6)
+        self.blocs.append({'position': self.fichier.tell(), 'taille': len(donnees), 'nombre': len(self.tampon),
+                           'debut': self.tampon[0]['date_event'], 'fin': self.tampon[-1]['date_event']})
+        self.fichier.write(donnees)
+        self.nombre += len(self.tampon)
+        self.tampon = []
+
+    def fermer(self):
+        self._vider()
+        index = json.dumps({'blocs': self.blocs, 'nombre': self.nombre}).encode()
+        self.fichier.write(index)
+        self.fichier.write(FIN.pack(len(index), MAGIQUE))
+        self.fichier.flush()
+        os.fsync(self.fichier.fileno())
+        self.fichier.close()
+        os.replace(self.temporaire, self.chemin)
+
+    def abandonner(self):
+        self.fichier.close()
+        self.temporaire.unlink(missing_ok=True)
+
+
+class Archive:
+    """Lecture d'une archive par mmap : seuls les blocs qui recouvrent l'intervalle demande sont decompresses."""
+
+    def __init__(self, chemin):
+        self.chemin = Path(chemin)
+        with open(self.chemin, 'rb') as fichier:
+            self.donnees = mmap.mmap(fichier.fileno(), 0, access=mmap.ACCESS_READ)
+        taille_index, magique = FIN.unpack(self.donnees[-FIN.size:])
+        if magique != MAGIQUE:
+            raise ValueError(f"{self.chemin} n'est pas une archive de journal")
+        fin_index = len(self.donnees) - FIN.size
+        self.index = json.loads(self.donnees[fin_index - taille_index:fin_index])
+
+    def lignes(self, debut=None, fin=None):
+        for bloc in self.index['blocs']:
+            if (debut and bloc['fin'] < debut) or (fin and bloc['debut'] >= fin):
+                continue
+            contenu = zlib.decompress(self.donnees[bloc['position']:bloc['position'] + bloc['taille']])
+            for brut in contenu.splitlines():
+                ligne = json.loads(brut)
+                if (debut and ligne['date_event'] < debut) or (fin and ligne['date_event'] >= fin):
+                    continue
+                yield ligne
+
+    def fermer(self):
+        self.donnees.close()
+
+
+def fichiers_partition(mois, repertoire=None):
+    return sorted((repertoire or repertoire_archives()).glob(f"journal-{mois}.*.jka"))
+
+
+def partitions_archivees(repertoire=None):
+    return sorted({chemin.name.split('.')[0][len('journal-'):]
+                   for chemin in (repertoire or repertoire_archives()).glob('journal-*.jka')})
+
+
+def _mois_entre(debut, fin):
+    annee, mois = debut.year, debut.month
+    while (annee, mois) <= (fin.year, fin.month):
+        yield f"{annee:04d}-{mois:02d}"
+        annee, mois = (annee + 1, 1) if mois == 12 else (annee, mois + 1)
+
+
+def rechercher(debut, fin, event=None, contient=None, repertoire=None):
+    """
+    Parcourt le journal entre debut (inclus) et fin (exclu), archives comprises.
+
+    Seules les partitions mensuelles archivees qui recouvrent l'intervalle sont ouvertes ; la table chaude est
+    interrogee sur l'index (date_event, id). Retourne des dictionnaires id, event, description, date_event.
+    """
+    debut_utc, fin_utc = debut.astimezone(dt_timezone.utc), fin.astimezone(dt_timezone.utc)
+    borne_debut, borne_fin = horodatage(debut), horodatage(fin)
+    for mois in _mois_entre(debut_utc, fin_utc):
+        for chemin in fichiers_partition(mois, repertoire):
+            archive = Archive(chemin)
+            try:
+                for ligne in archive.lignes(borne_debut, borne_fin):
+                    if (event is None or ligne['event'] == event) and \
+                            (contient is None or contient in ligne['description']):
+                        ligne['date_event'] = datetime.strptime(ligne['date_event'], FORMAT_DATE) \
+                            .replace(tzinfo=dt_timezone.utc)
+                        yield ligne
+            finally:
+                archive.fermer()
+
+    chaud = Journalisation.objects.filter(date_event__gte=debut, date_event__lt=fin)
+    if event is not None:
+        chaud = chaud.filter(event=event)
+    if contient is not None:
+        chaud = chaud.filter(description__contains=contient)
+    yield from chaud.order_by('date_event', 'id').values('id', 'event', 'description', 'date_event') \
+        .iterator(chunk_size=2000)
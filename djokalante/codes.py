@@ -0,0 +1,138 @@
+import secrets
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections
+from django.utils import timezone
+
+from djokalante.models import EtatTransfert, SequenceCode, Transfert
+
+PARAMETRES_PAR_DEFAUT = {
+    'taille_bloc': 1000,
+    'chiffres_sequence': 8,
+    'chiffres_aleatoires': 4,
+}
+
+
+class CodeError(Exception):
+    pass
+
+
+class CodeInvalide(CodeError):
+    pass
+
+
+class CodeExpire(CodeError):
+    pass
+
+
+def chiffre_controle(chiffres):
+    """Chiffre de Luhn de la chaine de chiffres : une faute de frappe est detectee sans lecture en base."""
+    total = 0
+    for rang, chiffre in enumerate(reversed(chiffres)):
+        valeur = int(chiffre)
+        if rang % 2 == 0:
+            valeur = valeur * 2 - 9 if valeur > 4 else valeur * 2
+        total += valeur
+    return str(-total % 10)
+
+
+def controle_valide(code):
+    return len(code) > 1 and code.isdigit() and chiffre_controle(code[:-1]) == code[-1]
+
+
+def reserver_bloc(nom, taille, base=DEFAULT_DB_ALIAS):
+    """
+    Reserve les valeurs [debut, debut + taille) de la sequence nom.
+
+    La reservation est validee sur une connexion a part : elle reste acquise meme si la transaction de
+    l'appelant est annulee, et ne garde pas la ligne de la sequence verrouillee jusqu'a sa fin.
+    """
+    connexion = connections.create_connection(base)
+    table = connexion.ops.quote_name(SequenceCode._meta.db_table)
+    try:
+        connexion.set_autocommit(False)
+        for _ in range(2):
+            with connexion.cursor() as curseur:
+                curseur.execute(f"UPDATE {table} SET prochain = prochain + %s WHERE nom = %s", [taille, nom])
+                if curseur.rowcount:
+                    curseur.execute(f"SELECT prochain FROM {table} WHERE nom = %s", [nom])
+                    fin = curseur.fetchone()[0]
+                    connexion.commit()
+                    return fin - taille
+                try:
+                    curseur.execute(f"INSERT INTO {table} (nom, prochain) VALUES (%s, %s)", [nom, taille + 1])
+                    connexion.commit()
+                    return 1
+                except IntegrityError:
+                    # Sequence creee en meme temps par un autre processus
+                    connexion.rollback()
+        raise CodeError(f"Impossible de reserver un bloc de la sequence {nom}")
+    finally:
+        connexion.close()
+
+
+class Allocateur:
+    """
+    Distribue les valeurs d'une sequence depuis un bloc reserve par processus : une seule ecriture en base par
+    taille_bloc valeurs. Des valeurs sont perdues a l'arret du processus ; elles ne sont jamais reutilisees.
+    """
+
+    def __init__(self, nom):
+        self.nom = nom
+        self._verrou = threading.Lock()
+        self._prochain = 0
+        self._fin = 0
+
+    def suivant(self):
+        with self._verrou:
+            if self._prochain >= self._fin:
+                taille = configuration()['taille_bloc']
+                self._prochain = reserver_bloc(self.nom, taille)
+                self._fin = self._prochain + taille
+            valeur = self._prochain
+            self._prochain += 1
+            return valeur
+
+
+def configuration():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'KHALISS_CODES', {})}
+
+
+codes = Allocateur('operation_code')
+numeros = Allocateur('operation_number')
+
+
+def nouveau_code():
+    """
+    Code de retrait : numero de sequence (unicite), chiffres aleatoires (le code ne se devine pas a partir
+    d'un autre) et chiffre de controle.
+    """
+    parametres = configuration()
+    aleatoire = ''.join(secrets.choice('0123456789') for _ in range(parametres['chiffres_aleatoires']))
+    corps = f"{codes.suivant():0{parametres['chiffres_sequence']}d}{aleatoire}"
+    return corps + chiffre_controle(corps)
+
+
+def nouveau_numero():
+    corps = f"{numeros.suivant():012d}"
+    return corps + chiffre_controle(corps)
+
+
+def verifier_code(code, duree_validite):
+    """
+    Retourne le transfert envoye dont le code de retrait est code.
+
+    Le chiffre de controle est verifie avant toute lecture ; la recherche est une seule requete sur l'index
+    (operation_code, state, send_date). duree_validite est en jours.
+    """
+    code = code.strip()
+    if not controle_valide(code):
+        raise CodeInvalide(f"Code {code} invalide")
+    transfert = Transfert.objects.filter(operation_code=code, state=EtatTransfert.ENVOYE).order_by('-send_date').first()
+    if transfert is None:
+        raise CodeInvalide(f"Aucun transfert a payer pour le code {code}")
+    if transfert.send_date < timezone.now().date() - timedelta(days=int(duree_validite)):
+        raise CodeExpire(f"Le code {code} a expire")
+    return transfert
@@ -0,0 +1,147 @@
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from djokalante.models import CumulTransfertJournalier, EtatTransfert, Guichet, Pays, Transfert
+from djokalante.referentiel import referentiel
+from djokalante.routage import lecture_replique
+
+DIMENSIONS = ('jour', 'guichet_id', 'pays_id', 'devise_id', 'motif_id', 'state')
+VALEURS = ('nombre', 'montant', 'commission')
+
+Cle = namedtuple('Cle', DIMENSIONS)
+
+
+class Variation:
+    __slots__ = VALEURS
+
+    def __init__(self, nombre=0, montant=Decimal('0'), commission=Decimal('0')):
+        self.nombre = nombre
+        self.montant = montant
+        self.commission = commission
+
+    def __bool__(self):
+        return bool(self.nombre or self.montant or self.commission)
+
+
+def zones(guichet_ids):
+    """
+    Pays et devise de chaque guichet : {guichet_id: (pays_id, devise_id)}. La devise vient du referentiel, ou de
+    la table pour un pays supprime depuis (absent du referentiel) : la meme zone que calculer().
+    """
+    guichets = dict(Guichet.all_objects.filter(pk__in=set(guichet_ids) - {None}).values_list('pk', 'pays_guichet_id'))
+    devises = {}
+    for pays_id in set(guichets.values()):
+        pays = referentiel.pays.get(pays_id)
+        if pays is not None:
+            devises[pays_id] = pays.devise_pays_id
+    supprimes = set(guichets.values()) - devises.keys()
+    if supprimes:
+        devises.update(Pays.all_objects.filter(pk__in=supprimes).values_list('pk', 'devise_pays_id'))
+    return {pk: (pays_id, devises.get(pays_id, 0)) for pk, pays_id in guichets.items()}
+
+
+def cle(transfert, zones_guichets, state=None):
+    pays, devise = zones_guichets.get(transfert.guichet_id, (0, 0))
+    return Cle(transfert.send_date, transfert.guichet_id or 0, pays, devise, transfert.motif_id,
+               state or transfert.state)
+
+
+def _ajouter(cle_cumul, variation):
+    filtre = cle_cumul._asdict()
+    increments = {champ: F(champ) + getattr(variation, champ) for champ in VALEURS}
+    for _ in range(2):
+        if CumulTransfertJournalier.objects.filter(**filtre).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                CumulTransfertJournalier.objects.create(
+                    **filtre, **{champ: getattr(variation, champ) for champ in VALEURS})
+            return
+        except IntegrityError:
+            # Ligne creee entre-temps par une autre transaction : on repasse par la mise a jour
+            continue
+    raise IntegrityError(f"Impossible de cumuler {cle_cumul}")
+
+
+def appliquer_variations(variations):
+    """Reporte un dictionnaire {Cle: Variation} dans les cumuls, dans un ordre fixe pour eviter les interblocages."""
+    with transaction.atomic():
+        for cle_cumul in sorted(variations):
+            if variations[cle_cumul]:
+                _ajouter(cle_cumul, variations[cle_cumul])
+
+
+def enregistrer(transferts, ancien_etat=None, anciennes_commissions=None):
+    """
+    Met a jour les cumuls apres creation ou modification de transferts, dans la transaction de l'appelant.
+
+    Sans ancien_etat ni anciennes_commissions, les transferts sont nouveaux. Sinon leur ancienne contribution
+    (ancien_etat, anciennes_commissions[pk]) est retiree avant d'ajouter la nouvelle.
+    """
+    nouveaux = ancien_etat is None and anciennes_commissions is None
+    zones_guichets = zones(transfert.guichet_id for transfert in transferts)
+    variations = defaultdict(Variation)
+    for transfert in transferts:
+        if not nouveaux:
+            ancienne = variations[cle(transfert, zones_guichets, ancien_etat)]
+            ancienne.nombre -= 1
+            ancienne.montant -= transfert.account
+            ancienne.commission -= (transfert.commission_account if anciennes_commissions is None
+                                    else anciennes_commissions[transfert.pk])
+        nouvelle = variations[cle(transfert, zones_guichets)]
+        nouvelle.nombre += 1
+        nouvelle.montant += transfert.account
+        nouvelle.commission += transfert.commission_account
+    appliquer_variations(variations)
+
+
+def totaux(debut, fin, par=('jour',), etats=(EtatTransfert.ENVOYE, EtatTransfert.PAYE), **filtres):
+    """
+    Totaux des transferts envoyes entre debut et fin (inclus), regroupes par les dimensions de par.
+
+    La requete ne lit que les cumuls : son cout depend du nombre de jours et de guichets, pas du nombre de
+    transferts. Elle peut etre servie par une replique. filtres restreint les dimensions, par exemple
+    guichet_id=3 ou devise_id__in=[1, 2].
+    """
+    inconnues = set(par) - set(DIMENSIONS)
+    if inconnues:
+        raise ValueError(f"Dimensions inconnues : {', '.join(sorted(inconnues))}")
+    with lecture_replique():
+        return list(CumulTransfertJournalier.objects
+                    .filter(jour__gte=debut, jour__lte=fin, state__in=etats, **filtres)
+                    .values(*par).annotate(nombre=Sum('nombre'), montant=Sum('montant'), commission=Sum('commission'))
+                    .order_by(*par))
+
+
+def calculer(debut, fin):
+    """Cumuls recalcules depuis la table Transfert : {Cle: (nombre, montant, commission)}."""
+    # all_objects : les cumuls comptent chaque transfert a l'envoi, y compris ceux passes depuis a DELETE
+    lignes = Transfert.all_objects.filter(send_date__gte=debut, send_date__lte=fin).order_by() \
+        .values_list('send_date', 'guichet_id', 'guichet__pays_guichet_id', 'guichet__pays_guichet__devise_pays_id',
+                     'motif_id', 'state') \
+        .annotate(nombre=Count('id'), montant=Sum('account'), commission=Sum('commission_account'))
+    return {Cle(jour, guichet or 0, pays or 0, devise or 0, motif, state): (nombre, montant, commission)
+            for jour, guichet, pays, devise, motif, state, nombre, montant, commission in lignes}
+
+
+def ecarts(debut, fin):
+    """Compare les cumuls a la table Transfert et retourne les cles en ecart : {Cle: (attendu, enregistre)}."""
+    attendus = calculer(debut, fin)
+    enregistres = {Cle(*valeurs[:6]): tuple(valeurs[6:]) for valeurs in CumulTransfertJournalier.objects
+                   .filter(jour__gte=debut, jour__lte=fin).values_list(*DIMENSIONS, *VALEURS)}
+    vide = (0, Decimal('0'), Decimal('0'))
+    return {cle_cumul: (attendus.get(cle_cumul, vide), enregistres.get(cle_cumul, vide))
+            for cle_cumul in attendus.keys() | enregistres.keys()
+            if attendus.get(cle_cumul, vide) != enregistres.get(cle_cumul, vide)}
+
+
+def reconstruire(debut, fin):
+    """Remplace les cumuls de debut a fin (inclus) par ceux recalcules depuis Transfert."""
+    with transaction.atomic():
+        CumulTransfertJournalier.objects.filter(jour__gte=debut, jour__lte=fin).delete()
+        CumulTransfertJournalier.objects.bulk_create(
+            [CumulTransfertJournalier(**cle_cumul._asdict(), nombre=nombre, montant=montant, commission=commission)
+             for cle_cumul, (nombre, montant, commission) in calculer(debut, fin).items()], batch_size=1000)
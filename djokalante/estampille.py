@@ -0,0 +1,119 @@
+import os
+import time
+from functools import cached_property
+from pathlib import Path
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import transaction
+
+
+class Estampille:
+    """
+    Numero de version partage entre les workers d'une meme machine, porte par la date de modification d'un
+    fichier local : le lire coute un stat(), l'incrementer un utime().
+    """
+
+    def __init__(self, nom):
+        self.nom = nom
+
+    @property
+    def chemin(self):
+        return Path(settings.KHALISS_ESTAMPILLES_DIR) / f"{self.nom}.stamp"
+
+    def lire(self):
+        try:
+            return os.stat(self.chemin).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def incrementer(self):
+        chemin = self.chemin
+        chemin.parent.mkdir(parents=True, exist_ok=True)
+        chemin.touch()
+        maintenant = time.time_ns()
+        # Garantit une valeur strictement croissante meme si l'horloge du systeme de fichiers est grossiere
+        version = max(maintenant, self.lire() + 1)
+        os.utime(chemin, ns=(version, version))
+        return version
+
+
+class valeur_cache(cached_property):
+    """
+    cached_property d'un CacheLocal. Tant qu'une publication de la connexion n'est pas validee, la valeur lue voit
+    les lignes non validees : elle n'est gardee que pour cette transaction, jamais dans le cache du worker.
+    """
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        publications = instance.publications_en_attente()
+        if not publications:
+            return super().__get__(instance, owner)
+        return instance.valeur_transaction(self.attrname, publications, self.func)
+
+
+class CacheLocal:
+    """
+    Base des caches propres a un worker : les valeurs sont des valeur_cache (lecture = recherche d'attribut)
+    videes quand l'estampille partagee change.
+    """
+
+    nom = None
+    caches = ()
+
+    def __init__(self):
+        self.estampille = Estampille(self.nom)
+        self.version = self.estampille.lire()
+        # Publications non validees et valeurs lues depuis, par connexion (thread ou contexte asynchrone, comme
+        # django.db.connections)
+        self._transaction = Local()
+
+    def invalider(self):
+        for nom in self.caches:
+            self.__dict__.pop(nom, None)
+        self._transaction.valeurs = {}
+
+    def verifier(self, **kwargs):
+        version = self.estampille.lire()
+        if version != self.version:
+            self.version = version
+            self.invalider()
+
+    def publications_en_attente(self):
+        """
+        Rappels on_commit des publications de la connexion encore en attente. Django retire ceux d'un savepoint
+        annule et tous ceux d'une transaction annulee : une publication absente de run_on_commit a ete annulee.
+        """
+        publications = getattr(self._transaction, 'publications', None)
+        if not publications:
+            return ()
+        connexion = transaction.get_connection()
+        enregistres = {id(entree[1]) for entree in connexion.run_on_commit} if connexion.in_atomic_block else set()
+        publications = self._transaction.publications = [rappel for rappel in publications
+                                                          if id(rappel) in enregistres]
+        return tuple(publications)
+
+    def valeur_transaction(self, nom, publications, calculer):
+        valeurs = getattr(self._transaction, 'valeurs', None)
+        if valeurs is None:
+            valeurs = self._transaction.valeurs = {}
+        # Gardee tant que les memes publications sont en attente : un savepoint annule depuis la rend perimee
+        garde = valeurs.get(nom)
+        if garde is None or garde[0] != publications:
+            garde = valeurs[nom] = (publications, calculer(self))
+        return garde[1]
+
+    def publier(self, **kwargs):
+        self.invalider()
+        # Un rappel par publication, pour la retrouver dans run_on_commit
+        def rappel():
+            self._apres_commit()
+
+        self._transaction.publications = [*getattr(self._transaction, 'publications', ()), rappel]
+        transaction.on_commit(rappel)
+
+    def _apres_commit(self):
+        self._transaction.publications = []
+        self.version = self.estampille.incrementer()
+        self.invalider()
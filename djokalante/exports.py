@@ -0,0 +1,186 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_all_start_methods, get_context
+from pathlib import Path
+
+import django
+from django.db import connections, models
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from djokalante.models import Compte, Transfert
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Modeles exportables et colonnes jamais exportees
+MODELES = {
+    'transfert': (Transfert, ()),
+    'compte': (Compte, ('secret_code',)),
+}
+FORMATS = {'csv': 'csv', 'arrow': 'arrow', 'parquet': 'parquet'}
+FICHIER_ETAT = 'etat-exports.json'
+# Recouvrement des exports incrementaux : une ligne datee avant la borne haute d'un export mais validee apres sa
+# lecture (transaction plus longue que l'export) est reprise par le suivant, tant que sa transaction dure moins
+MARGE = timedelta(minutes=5)
+
+
+class ExportError(Exception):
+    pass
+
+
+def colonnes(modele):
+    classe, exclues = MODELES[modele]
+    return [champ for champ in classe._meta.concrete_fields if champ.name not in exclues]
+
+
+def _type_arrow(champ):
+    if isinstance(champ, (models.ForeignKey, models.AutoField, models.IntegerField)):
+        return pyarrow.int64()
+    if isinstance(champ, models.DecimalField):
+        return pyarrow.decimal128(champ.max_digits, champ.decimal_places)
+    if isinstance(champ, models.DateTimeField):
+        return pyarrow.timestamp('us', tz='UTC')
+    if isinstance(champ, models.DateField):
+        return pyarrow.date32()
+    if isinstance(champ, models.BooleanField):
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+class _EcrivainCsv:
+    def __init__(self, chemin, champs):
+        self.fichier = open(chemin, 'w', newline='', encoding='utf-8')
+        self.csv = csv.writer(self.fichier)
+        self.csv.writerow([champ.attname for champ in champs])
+
+    def ecrire(self, lignes):
+        self.csv.writerows(lignes)
+
+    def fermer(self):
+        self.fichier.close()
+
+
+class _EcrivainArrow:
+    def __init__(self, chemin, champs, format_):
+        self.schema = pyarrow.schema([(champ.attname, _type_arrow(champ), champ.null) for champ in champs])
+        if format_ == 'parquet':
+            self.ecrivain = pyarrow.parquet.ParquetWriter(chemin, self.schema, compression='zstd')
+        else:
+            self.ecrivain = pyarrow.ipc.new_file(str(chemin), self.schema)
+
+    def ecrire(self, lignes):
+        # Un lot de lignes devient un lot de colonnes
+        colonnes_lot = list(zip(*lignes))
+        self.ecrivain.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(valeurs, type=champ.type) for valeurs, champ in zip(colonnes_lot, self.schema)],
+            schema=self.schema))
+
+    def fermer(self):
+        self.ecrivain.close()
+
+
+def _initialiser_processus():
+    django.setup()
+
+
+def exporter_tranche(modele, format_, chemin, debut, fin, depuis, jusqua, taille_lot):
+    """Ecrit dans chemin les lignes d'identifiant debut <= id < fin et retourne leur nombre."""
+    champs = colonnes(modele)
+    queryset = MODELES[modele][0].all_objects.filter(pk__gte=debut, pk__lt=fin)
+    if depuis is not None:
+        queryset = queryset.filter(date_modification__gt=depuis)
+    if jusqua is not None:
+        queryset = queryset.filter(date_modification__lte=jusqua)
+    lignes = queryset.order_by('pk').values_list(*(champ.attname for champ in champs)).iterator(chunk_size=taille_lot)
+
+    ecrivain = _EcrivainCsv(chemin, champs) if format_ == 'csv' else _EcrivainArrow(chemin, champs, format_)
+    total = 0
+    lot = []
+    try:
+        for ligne in lignes:
+            lot.append(ligne)
+            if len(lot) >= taille_lot:
+                ecrivain.ecrire(lot)
+                total += len(lot)
+                lot = []
+        if lot:
+            ecrivain.ecrire(lot)
+            total += len(lot)
+    finally:
+        ecrivain.fermer()
+        connections.close_all()
+    return total
+
+
+def lire_etat(repertoire):
+    chemin = Path(repertoire) / FICHIER_ETAT
+    if not chemin.exists():
+        return {}
+    return json.loads(chemin.read_text(encoding='utf-8'))
+
+
+def ecrire_etat(repertoire, etat):
+    chemin = Path(repertoire) / FICHIER_ETAT
+    temporaire = chemin.with_suffix('.tmp')
+    temporaire.write_text(json.dumps(etat, indent=2), encoding='utf-8')
+    temporaire.replace(chemin)
+
+
+def exporter(modele, repertoire, format_='csv', processus=1, taille_lot=5000, incremental=False, marge=MARGE):
+    """
+    Exporte un modele dans repertoire, en un fichier par tranche d'identifiants et par processus.
+
+    Les lignes sont lues par values_list().iterator() sans instancier de modele, lignes supprimees comprises
+    (colonne statut a DELETE). En mode incremental, seules les lignes modifiees depuis le dernier export
+    (etat-exports.json), moins la marge, sont ecrites : deux exports successifs se recouvrent et une ligne peut
+    revenir, le destinataire la remplace par son id. Retourne la liste des fichiers, le nombre de lignes et la
+    duree en secondes.
+    """
+    if modele not in MODELES:
+        raise ExportError(f"Modele inconnu : {modele}")
+    if format_ not in FORMATS:
+        raise ExportError(f"Format inconnu : {format_}")
+    if format_ != 'csv' and pyarrow is None:
+        raise ExportError(f"Le format {format_} demande pyarrow (pip install pyarrow)")
+
+    repertoire = Path(repertoire)
+    repertoire.mkdir(parents=True, exist_ok=True)
+    etat = lire_etat(repertoire)
+    depuis = datetime.fromisoformat(etat[modele]) if incremental and modele in etat else None
+    # Borne haute fixee au depart : une ligne modifiee pendant l'export sera prise par le suivant
+    jusqua = timezone.now()
+
+    depart = time.perf_counter()
+    queryset = MODELES[modele][0].all_objects.all()
+    if depuis is not None:
+        queryset = queryset.filter(date_modification__gt=depuis)
+    bornes = queryset.aggregate(debut=Min('pk'), fin=Max('pk'))
+    fichiers, total = [], 0
+    if bornes['debut'] is not None:
+        pas = (bornes['fin'] - bornes['debut']) // processus + 1
+        horodatage = jusqua.strftime('%Y%m%d%H%M%S')
+        taches = [(modele, format_, repertoire / f"{modele}-{horodatage}-{numero:03d}.{FORMATS[format_]}",
+                   bornes['debut'] + numero * pas, bornes['debut'] + (numero + 1) * pas, depuis, jusqua, taille_lot)
+                  for numero in range(processus)]
+        if processus == 1:
+            totaux = [exporter_tranche(*taches[0])]
+        else:
+            # Aucune connexion ouverte ne doit etre heritee par les processus fils
+            connections.close_all()
+            contexte = get_context('fork' if 'fork' in get_all_start_methods() else 'spawn')
+            with ProcessPoolExecutor(processus, mp_context=contexte, initializer=_initialiser_processus) as pool:
+                totaux = list(pool.map(exporter_tranche, *zip(*taches)))
+        fichiers = [tache[2] for tache in taches]
+        total = sum(totaux)
+
+    etat[modele] = (jusqua - marge).isoformat()
+    ecrire_etat(repertoire, etat)
+    return fichiers, total, time.perf_counter() - depart
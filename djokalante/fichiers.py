@@ -0,0 +1,26 @@
+import io
+from contextlib import contextmanager
+from decimal import Decimal
+
+
+@contextmanager
+def ouvrir(fichier, encodage):
+    """Flux texte d'un fichier importe : chemin, flux texte ou fichier binaire (UploadedFile, BytesIO...)."""
+    if isinstance(fichier, (str, bytes)) or hasattr(fichier, '__fspath__'):
+        with open(fichier, encoding=encodage, newline='') as flux:
+            yield flux
+    elif isinstance(fichier, io.TextIOBase):
+        yield fichier
+    else:
+        # Fichier binaire : decodage a la volee, sans lecture complete
+        flux = io.TextIOWrapper(fichier, encoding=encodage, newline='')
+        try:
+            yield flux
+        finally:
+            flux.detach()
+
+
+def montant_max(modele, champ='montant'):
+    """Premier montant que le DecimalField champ du modele ne peut plus enregistrer (10 ** chiffres entiers)."""
+    champ = modele._meta.get_field(champ)
+    return Decimal(10) ** (champ.max_digits - champ.decimal_places)
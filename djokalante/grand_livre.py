@@ -0,0 +1,160 @@
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from djokalante.models import Compte, Ecriture, Employeur, Guichet, NatureTitulaire, Programme
+
+# Colonne de solde de chaque modele porteur d'argent
+SOLDES = {
+    NatureTitulaire.COMPTE: (Compte, 'solde'),
+    NatureTitulaire.EMPLOYEUR: (Employeur, 'account'),
+    NatureTitulaire.GUICHET: (Guichet, 'account'),
+    NatureTitulaire.PROGRAMME: (Programme, 'account'),
+}
+NATURES = {modele: nature for nature, (modele, _) in SOLDES.items()}
+
+Mouvement = namedtuple('Mouvement', ['titulaire', 'montant', 'libelle'], defaults=[""])
+
+
+class SoldeInsuffisant(Exception):
+    pass
+
+
+class TitulaireIntrouvable(Exception):
+    pass
+
+
+def _cle(titulaire):
+    try:
+        return NATURES[type(titulaire)], titulaire.pk
+    except KeyError:
+        raise TypeError(f"{type(titulaire).__name__} ne porte pas de solde") from None
+
+
+def _verifier_titulaires(nature, pks, operation):
+    modele, _ = SOLDES[nature]
+    trouves = set(modele.all_objects.filter(pk__in=pks).values_list('pk', flat=True))
+    absents = sorted(pk for pk in pks if pk not in trouves)
+    if absents:
+        raise TitulaireIntrouvable(f"{operation} impossible, {nature} introuvable : {absents}")
+
+
+def _debiter(nature, pk, montant, maintenant, plancher):
+    modele, champ = SOLDES[nature]
+    # Controle et debit en une seule instruction : pas de lecture prealable, pas de mise a jour perdue
+    if not modele.all_objects.filter(pk=pk, **{f'{champ}__gte': montant + plancher}).update(
+            **{champ: F(champ) - montant, 'date_modification': maintenant}):
+        _verifier_titulaires(nature, [pk], "Debit")
+        raise SoldeInsuffisant(f"Solde insuffisant pour debiter {montant} du {nature} {pk}")
+
+
+def _crediter(nature, credits, maintenant):
+    modele, champ = SOLDES[nature]
+    titulaires = []
+    for pk, montant in credits:
+        titulaire = modele(pk=pk, date_modification=maintenant)
+        setattr(titulaire, champ, F(champ) + montant)
+        titulaires.append(titulaire)
+    # bulk_update ignore un identifiant absent : le credit serait perdu en silence
+    if modele.all_objects.bulk_update(titulaires, [champ, 'date_modification'], batch_size=500) != len(titulaires):
+        _verifier_titulaires(nature, [pk for pk, _ in credits], "Credit")
+
+
+def appliquer(mouvements, reference="", differe=False, plancher=0):
+    """
+    Applique un ensemble de debits et credits dans une seule transaction.
+
+    Les soldes sont modifies par des expressions F(), dans l'ordre fixe (nature, identifiant) pour eviter les
+    interblocages. Avec differe=True, les credits nets sont seulement ajoutes au grand livre et reportes plus
+    tard par consolider() : un guichet tres sollicite n'est alors plus verrouille a chaque encaissement.
+    Un debit echoue (SoldeInsuffisant) si le solde restant passe sous le plancher.
+    """
+    maintenant = timezone.now()
+    nets = defaultdict(Decimal)
+    ecritures = []
+    for mouvement in mouvements:
+        nature, pk = _cle(mouvement.titulaire)
+        nets[nature, pk] += mouvement.montant
+        ecritures.append(Ecriture(nature=nature, titulaire_id=pk, montant=mouvement.montant,
+                                  libelle=mouvement.libelle, reference=reference, date_event=maintenant))
+
+    differes = set()
+    with transaction.atomic():
+        for nature, cles in groupby(sorted(nets.items()), key=lambda item: item[0][0]):
+            credits = []
+            reportes = []
+            for (_, pk), net in cles:
+                if net > 0 and differe:
+                    reportes.append(pk)
+                elif net > 0:
+                    credits.append((pk, net))
+                elif net < 0:
+                    if credits:
+                        _crediter(nature, credits, maintenant)
+                        credits = []
+                    _debiter(nature, pk, -net, maintenant, plancher)
+            if credits:
+                _crediter(nature, credits, maintenant)
+            if reportes:
+                # Sans mise a jour du solde, rien ne signalerait un titulaire absent avant consolider()
+                _verifier_titulaires(nature, reportes, "Credit differe")
+                differes.update((nature, pk) for pk in reportes)
+
+        for ecriture in ecritures:
+            ecriture.consolidee = (ecriture.nature, ecriture.titulaire_id) not in differes
+        return Ecriture.objects.bulk_create(ecritures, batch_size=1000)
+
+
+def crediter(titulaire, montant, libelle="", reference="", differe=False):
+    return appliquer([Mouvement(titulaire, montant, libelle)], reference=reference, differe=differe)
+
+
+def debiter(titulaire, montant, libelle="", reference="", plancher=0):
+    return appliquer([Mouvement(titulaire, -montant, libelle)], reference=reference, plancher=plancher)
+
+
+def virer(source, destination, montant, libelle="", reference="", differe=False):
+    return appliquer([Mouvement(source, -montant, libelle), Mouvement(destination, montant, libelle)],
+                     reference=reference, differe=differe)
+
+
+def solde(titulaire):
+    """Solde comptable : colonne du titulaire plus les ecritures pas encore consolidees."""
+    nature, pk = _cle(titulaire)
+    modele, champ = SOLDES[nature]
+    courant = modele.all_objects.filter(pk=pk).values_list(champ, flat=True).get()
+    en_attente = Ecriture.objects.filter(nature=nature, titulaire_id=pk, consolidee=False) \
+        .aggregate(total=Sum('montant'))['total']
+    return courant + (en_attente or 0)
+
+
+def consolider(taille_lot=5000):
+    """
+    Reporte un lot d'ecritures non consolidees dans les soldes et retourne le nombre d'ecritures traitees.
+
+    Les ecritures sont prises avec select_for_update(skip_locked=True) : plusieurs consolidateurs peuvent
+    tourner en parallele sans traiter deux fois la meme ecriture ni s'attendre.
+    """
+    maintenant = timezone.now()
+    with transaction.atomic():
+        lot = list(Ecriture.objects.select_for_update(skip_locked=True).filter(consolidee=False)
+                   .order_by('pk').values_list('pk', 'nature', 'titulaire_id', 'montant')[:taille_lot])
+        if not lot:
+            return 0
+
+        nets = defaultdict(Decimal)
+        for _, nature, pk, montant in lot:
+            nets[nature, pk] += montant
+        for nature, cles in groupby(sorted(nets.items()), key=lambda item: item[0][0]):
+            modele, champ = SOLDES[nature]
+            for (_, pk), net in cles:
+                if not modele.all_objects.filter(pk=pk).update(**{champ: F(champ) + net,
+                                                                  'date_modification': maintenant}):
+                    raise TitulaireIntrouvable(f"Consolidation impossible, {nature} introuvable : {pk}")
+
+        Ecriture.objects.filter(pk__in=[ligne[0] for ligne in lot]).update(consolidee=True)
+    return len(lot)
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.core.signals import request_started
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from djokalante.estampille import CacheLocal, valeur_cache
+from djokalante.models import Action, Profil, StatutObjet, lignes_supprimees
+
+AUCUNE = frozenset()
+
+
+def fermeture(parents):
+    """Associe a chaque action l'ensemble forme par elle-meme et tous ses ancetres (parents : id -> parent_id)."""
+    ensembles = {}
+    for depart in parents:
+        chemin = []
+        courant = depart
+        # Remonte jusqu'a une action deja calculee, une racine ou un cycle (racine parente d'elle-meme)
+        while courant is not None and courant not in ensembles and courant not in chemin:
+            chemin.append(courant)
+            courant = parents.get(courant)
+        heritage = ensembles.get(courant, AUCUNE)
+        for action in reversed(chemin):
+            heritage = heritage | {action}
+            ensembles[action] = heritage
+    return ensembles
+
+
+class Habilitations(CacheLocal):
+    """
+    Actions effectives de chaque profil (actions attribuees et leurs ancetres), precalculees en deux requetes
+    pour tous les profils puis servies sans requete jusqu'a la prochaine modification d'une action ou d'un profil.
+    """
+
+    nom = 'habilitations'
+    caches = ('par_profil',)
+
+    @valeur_cache
+    def par_profil(self):
+        codes = {}
+        parents = {}
+        for pk, parent, code in Action.objects.order_by().values_list('id', 'action_parent_id', 'action_code'):
+            codes[pk] = code
+            parents[pk] = parent
+        ensembles = fermeture(parents)
+
+        actions = defaultdict(set)
+        # Un profil supprime (statut DELETE) n'accorde plus rien
+        liens = Profil.actions.through.objects.exclude(profil__statut=StatutObjet.DELETE)
+        for profil, action in liens.values_list('profil_id', 'action_id'):
+            actions[profil].update(codes[ancetre] for ancetre in ensembles.get(action, ()) if ancetre in codes)
+        return {profil: frozenset(codes_profil) for profil, codes_profil in actions.items()}
+
+    def actions(self, profil_id):
+        return self.par_profil.get(profil_id, AUCUNE)
+
+
+habilitations = Habilitations()
+
+request_started.connect(habilitations.verifier, dispatch_uid='habilitations_verifier')
+
+
+def _apres_m2m(sender, action, **kwargs):
+    # m2m_changed est envoye avant (pre_*) et apres (post_*) chaque modification : seul post_* suit l'ecriture
+    if action.startswith('post_'):
+        habilitations.publier()
+
+
+m2m_changed.connect(_apres_m2m, sender=Profil.actions.through, dispatch_uid='habilitations_m2m')
+post_save.connect(habilitations.publier, sender=Action, dispatch_uid='habilitations_action_save')
+post_delete.connect(habilitations.publier, sender=Action, dispatch_uid='habilitations_action_delete')
+post_save.connect(habilitations.publier, sender=Profil, dispatch_uid='habilitations_profil_save')
+post_delete.connect(habilitations.publier, sender=Profil, dispatch_uid='habilitations_profil_delete')
+lignes_supprimees.connect(habilitations.publier, sender=Profil, dispatch_uid='habilitations_profil_suppression')
@@ -0,0 +1,33 @@
+import secrets
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+
+
+class PBKDF2AjustableHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 dont le nombre d'iterations vient de KHALISS_PBKDF2_ITERATIONS (voir la commande
+    calibrer_hachage). Les mots de passe haches avec un autre cout sont rehaches a la connexion suivante.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'KHALISS_PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+@lru_cache(maxsize=1)
+def _hachage_factice():
+    return make_password(secrets.token_urlsafe(16))
+
+
+def hachage_factice(password):
+    """Fait le meme travail qu'une verification reelle pour qu'un identifiant inconnu coute autant qu'un connu."""
+    check_password(password, _hachage_factice())
+
+
+def verifier_mot_de_passe(password, encoded):
+    """Retourne (mot de passe correct, nouveau hachage si le cout ou l'algorithme a change sinon None)."""
+    nouveau = []
+    correct = check_password(password, encoded, setter=lambda brut: nouveau.append(make_password(brut)))
+    return correct, (nouveau[0] if nouveau else None)
@@ -0,0 +1,276 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from djokalante.models import Journalisation
+
+logger = logging.getLogger(__name__)
+
+PARAMETRES_PAR_DEFAUT = {
+    'taille_max': 10000,
+    'taille_lot': 500,
+    'delai_ms': 200,
+    'attente_max_ms': 50,
+}
+
+
+def _processus_vivant(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Journal:
+    """
+    Ecriture differee de Journalisation.
+
+    journaliser() ajoute l'evenement au segment WAL courant (fichier local, ecriture sequentielle synchronisee par
+    fsync) et au tampon memoire borne, puis rend la main. Un thread ecrit le tampon par bulk_create tous les
+    taille_lot evenements ou toutes les delai_ms millisecondes, puis supprime le segment. Au demarrage, les
+    segments laisses par un processus arrete sont rejoues : un evenement accepte n'est pas perdu en cas d'arret
+    brutal.
+
+    taille_max borne les evenements gardes en memoire : tampon courant et lots confies au thread mais pas encore
+    ecrits. Quand la borne est atteinte (base lente ou indisponible), l'appelant attend au plus attente_max_ms que
+    le thread libere de la place ; au-dela l'evenement n'est garde que dans le WAL et le segment entier sera relu
+    depuis le disque.
+    """
+
+    def __init__(self, repertoire=None, **parametres):
+        self.repertoire = repertoire
+        self.parametres = parametres
+        self._condition = threading.Condition()
+        self._thread = None
+        self._arret = False
+        self._tampon = []
+        self._deborde = False
+        self._forcer = False
+        self._wal = None
+        self._segment = None
+        self._numero = 0
+        self._en_attente = []
+        # Evenements des lots de _en_attente encore en memoire
+        self._en_memoire = 0
+        self.recus = 0
+        self.ecrits = 0
+        self.saturations = 0
+        self.debordements = 0
+        self.echecs = 0
+        self.attente_totale = 0.0
+        self.profondeur_max = 0
+
+    def _configurer(self):
+        configuration = {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'KHALISS_JOURNAL', {}), **self.parametres}
+        self.repertoire = Path(self.repertoire or configuration.get('repertoire')
+                               or Path(settings.BASE_DIR) / 'var' / 'journal')
+        self.taille_max = configuration['taille_max']
+        self.taille_lot = configuration['taille_lot']
+        self.delai = configuration['delai_ms'] / 1000
+        self.attente_max = configuration['attente_max_ms'] / 1000
+
+    def _demarrer(self):
+        self._configurer()
+        self.repertoire.mkdir(parents=True, exist_ok=True)
+        for segment in sorted(self.repertoire.glob('*.wal')):
+            pid = int(segment.name.split('-', 1)[0])
+            if pid != os.getpid() and _processus_vivant(pid):
+                continue
+            # Le renommage reserve le segment : deux workers qui demarrent ensemble ne le rejouent pas deux fois
+            repris = segment.with_name(f"{os.getpid()}-{segment.name.split('-', 1)[1]}")
+            try:
+                os.rename(segment, repris)
+            except FileNotFoundError:
+                continue
+            self._en_attente.append(repris)
+        self._ouvrir_segment()
+        self._thread = threading.Thread(target=self._boucle, name='journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.arreter)
+
+    def _ouvrir_segment(self):
+        self._numero += 1
+        self._segment = self.repertoire / f"{os.getpid()}-{time.time_ns()}-{self._numero:08d}.wal"
+        self._wal = open(self._segment, 'a', encoding='utf-8')
+
+    def journaliser(self, event, description):
+        evenement = {'event': event[:200], 'description': description[:1000], 'date_event': timezone.now()}
+        ligne = json.dumps({**evenement, 'date_event': evenement['date_event'].isoformat()}) + '\n'
+        with self._condition:
+            if self._arret:
+                # Evenement emis apres l'arret du thread (fin de processus) : ecriture directe
+                Journalisation.objects.create(**evenement)
+                return
+            if self._thread is None:
+                self._demarrer()
+            self.recus += 1
+            if self._profondeur() >= self.taille_max:
+                self.saturations += 1
+                debut = time.monotonic()
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._profondeur() < self.taille_max, timeout=self.attente_max)
+                self.attente_totale += time.monotonic() - debut
+            self._wal.write(ligne)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            if self._profondeur() < self.taille_max:
+                self._tampon.append(evenement)
+                self.profondeur_max = max(self.profondeur_max, self._profondeur())
+            else:
+                self.debordements += 1
+                self._deborde = True
+            if len(self._tampon) >= self.taille_lot:
+                self._condition.notify_all()
+
+    def _profondeur(self):
+        return len(self._tampon) + self._en_memoire
+
+    def _rotation(self):
+        segment, evenements, deborde = self._segment, self._tampon, self._deborde
+        self._wal.close()
+        self._tampon, self._deborde = [], False
+        self._ouvrir_segment()
+        if deborde:
+            # Lot incomplet en memoire : relu depuis le WAL
+            return segment, None
+        self._en_memoire += len(evenements)
+        return segment, evenements
+
+    def _liberer(self, evenements):
+        if evenements is not None:
+            with self._condition:
+                self._en_memoire -= len(evenements)
+                self._condition.notify_all()
+
+    @staticmethod
+    def _lire(segment):
+        evenements = []
+        with open(segment, encoding='utf-8') as fichier:
+            for ligne in fichier:
+                try:
+                    evenement = json.loads(ligne)
+                except ValueError:
+                    # Derniere ligne tronquee par un arret brutal
+                    continue
+                evenement['date_event'] = datetime.fromisoformat(evenement['date_event'])
+                evenements.append(evenement)
+        return evenements
+
+    def _ecrire(self, segment, evenements=None):
+        try:
+            close_old_connections()
+            if evenements is None:
+                evenements = self._lire(segment)
+            Journalisation.objects.bulk_create([Journalisation(**evenement) for evenement in evenements],
+                                               batch_size=self.taille_lot)
+        except Exception:
+            self.echecs += 1
+            logger.exception("Ecriture du journal impossible, le segment %s sera rejoue", segment)
+            return False
+        os.remove(segment)
+        self.ecrits += len(evenements)
+        return True
+
+    def _boucle(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._tampon) >= self.taille_lot or self._arret or self._forcer,
+                                         timeout=self.delai)
+                arret = self._arret
+                self._forcer = False
+                # Ajoute sous le verrou : vider() ne voit jamais le tampon vide avant que le lot soit en attente
+                if self._tampon or self._deborde:
+                    self._en_attente.append(self._rotation())
+            # Segments rejoues ou en echec d'abord, dans l'ordre : on s'arrete au premier echec
+            while self._en_attente:
+                segment = self._en_attente[0]
+                segment, evenements = segment if isinstance(segment, tuple) else (segment, None)
+                ecrit = self._ecrire(segment, evenements)
+                # En echec, le lot quitte la memoire et sera relu depuis son segment
+                self._liberer(evenements)
+                if not ecrit:
+                    self._en_attente[0] = segment
+                    break
+                self._en_attente.pop(0)
+            if arret:
+                with self._condition:
+                    self._wal.close()
+                    if not self._tampon and not self._deborde:
+                        os.remove(self._segment)
+                return
+
+    def vider(self, delai=5):
+        """Demande l'ecriture immediate du tampon et attend qu'il soit vide (commandes, tests)."""
+        if self._thread is None:
+            return
+        fin = time.monotonic() + delai
+        with self._condition:
+            self._forcer = True
+            self._condition.notify_all()
+        while (self._tampon or self._en_attente) and time.monotonic() < fin:
+            time.sleep(0.01)
+
+    def arreter(self):
+        if self._thread is None or self._arret:
+            return
+        with self._condition:
+            self._arret = True
+            self._condition.notify_all()
+        self._thread.join(timeout=10)
+
+    def metriques(self):
+        return {
+            'profondeur': self._profondeur(),
+            'profondeur_max': self.profondeur_max,
+            'capacite': getattr(self, 'taille_max', None),
+            'recus': self.recus,
+            'ecrits': self.ecrits,
+            'saturations': self.saturations,
+            'debordements': self.debordements,
+            'echecs': self.echecs,
+            'attente_totale_s': round(self.attente_totale, 6),
+            'segments_en_attente': len(self._en_attente),
+        }
+
+
+journal = Journal()
+
+
+def journaliser(event, description):
+    journal.journaliser(event, description)
+
+
+async def ajournaliser(event, description):
+    """
+    journaliser() pour les vues asynchrones : l'ecriture du WAL, le demarrage du thread, l'attente quand le tampon
+    est plein et l'ecriture directe apres l'arret se font hors de la boucle d'evenements.
+    """
+    await sync_to_async(journaliser)(event, description)
+
+
+def _journaliser_admin(sender, instance, created, **kwargs):
+    if created:
+        description = (f"{instance.get_action_flag_display()} {instance.object_repr} (type {instance.content_type_id}, "
+                       f"id {instance.object_id}) par l'utilisateur {instance.user_id}")
+        transaction.on_commit(lambda: journaliser("ADMIN", description))
+
+
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib.admin.models import LogEntry
+
+    post_save.connect(_journaliser_admin, sender=LogEntry, dispatch_uid='journal_admin')
@@ -0,0 +1,89 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+LIMITES_PAR_DEFAUT = {
+    'ip': (30, 300),
+    'username': (5, 300),
+}
+
+
+class Limiteur:
+    """Compteur de tentatives par fenetre fixe, tenu dans un cache local au worker."""
+
+    def __init__(self, nom, maximum, fenetre):
+        self.nom = nom
+        self.maximum = maximum
+        self.fenetre = fenetre
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'KHALISS_LIMITES_CACHE', 'default')]
+
+    def _cle(self, identifiant, maintenant=None):
+        tranche = int((maintenant or time.time()) // self.fenetre)
+        empreinte = hashlib.blake2b(str(identifiant).encode(), digest_size=16).hexdigest()
+        return f"limite:{self.nom}:{empreinte}:{tranche}"
+
+    def incrementer(self, identifiant):
+        cle = self._cle(identifiant)
+        if self.cache.add(cle, 1, self.fenetre):
+            return 1
+        try:
+            return self.cache.incr(cle)
+        except ValueError:
+            # La cle a expire entre add() et incr()
+            self.cache.set(cle, 1, self.fenetre)
+            return 1
+
+    def depasse(self, identifiant):
+        return self.incrementer(identifiant) > self.maximum
+
+    def atteint(self, identifiant):
+        """Limite atteinte, sans compter de tentative."""
+        return (self.cache.get(self._cle(identifiant)) or 0) >= self.maximum
+
+    def reinitialiser(self, identifiant):
+        self.cache.delete(self._cle(identifiant))
+
+
+def limiteurs():
+    limites = {**LIMITES_PAR_DEFAUT, **getattr(settings, 'KHALISS_LIMITES_CONNEXION', {})}
+    return {nom: Limiteur(nom, maximum, fenetre) for nom, (maximum, fenetre) in limites.items()}
+
+
+def adresse_ip(request):
+    if request is None:
+        return None
+    if getattr(settings, 'KHALISS_PROXY_DE_CONFIANCE', False):
+        transmise = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if transmise:
+            # Derniere entree : celle ajoutee par le proxy de confiance. Les precedentes viennent du client
+            return transmise.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def connexion_bloquee(request, username):
+    """
+    Compte la tentative pour l'identifiant et indique si l'identifiant ou l'adresse IP a depasse sa limite.
+    L'adresse IP ne compte que les echecs (connexion_echouee) : une agence derriere une seule adresse NAT n'est pas
+    bloquee par les connexions reussies de ses agents.
+    """
+    limites = limiteurs()
+    bloquee = limites['username'].depasse(username.casefold())
+    ip = adresse_ip(request)
+    if ip:
+        bloquee = limites['ip'].atteint(ip) or bloquee
+    return bloquee
+
+
+def connexion_echouee(request):
+    ip = adresse_ip(request)
+    if ip:
+        limiteurs()['ip'].incrementer(ip)
+
+
+def connexion_reussie(username):
+    limiteurs()['username'].reinitialiser(username.casefold())
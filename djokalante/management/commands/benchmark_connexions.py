@@ -0,0 +1,167 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from djokalante.models import Utilisateur
+from djokalante.views import LOGIN_BACKEND
+
+# Scenario : variables d'environnement donnees au profil de mesure (voir base_de_donnees dans khaliss.settings)
+SCENARIOS = {
+    'sans': {'KHALISS_DB_RESERVE': '0', 'KHALISS_DB_CONN_MAX_AGE': '0'},
+    'persistantes': {'KHALISS_DB_RESERVE': '0', 'KHALISS_DB_CONN_MAX_AGE': '60'},
+    'reserve': {'KHALISS_DB_RESERVE': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = ("Mesure les requetes par seconde d'une page authentifiee sans connexion persistante, avec CONN_MAX_AGE "
+            "et avec la reserve de connexions. Chaque scenario tourne dans un processus lance avec le profil "
+            "bench et l'environnement courant (KHALISS_DB_* : MySQL local ou SQLite).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requetes', type=int, default=2000)
+        parser.add_argument('--concurrence', type=int, default=16, help="Requetes en cours en meme temps")
+        parser.add_argument('--chemin', default='/transferts?taille=20')
+        parser.add_argument('--wsgi', action='store_true', help="Passe par le gestionnaire WSGI et des threads")
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--profil', default='bench', help="Profil de reglages des scenarios (KHALISS_PROFIL)")
+        parser.add_argument('--interne', action='store_true', help="Execute un seul scenario (usage interne)")
+
+    def handle(self, *args, **options):
+        if options['interne']:
+            self.stdout.write(json.dumps(self.mesurer(options)))
+            return
+
+        scenarios = [nom.strip() for nom in options['scenarios'].split(',') if nom.strip()]
+        inconnus = set(scenarios) - set(SCENARIOS)
+        if inconnus:
+            raise CommandError(f"Scenarios inconnus : {', '.join(sorted(inconnus))}")
+
+        self.stdout.write(f"{'scenario':<16}{'req/s':>10}{'connexions':>12}{'erreurs':>10}")
+        for nom in scenarios:
+            resultat = self.lancer(nom, options)
+            self.stdout.write(f"{nom:<16}{resultat['req_s']:>10.0f}{resultat['connexions']:>12}"
+                              f"{resultat['erreurs']:>10}")
+
+    def lancer(self, nom, options):
+        environnement = {**os.environ, **SCENARIOS[nom], 'KHALISS_PROFIL': options['profil'],
+                         'DJANGO_SETTINGS_MODULE': 'khaliss.settings'}
+        commande = [sys.executable, sys.argv[0], 'benchmark_connexions', '--interne',
+                    '--requetes', str(options['requetes']), '--concurrence', str(options['concurrence']),
+                    '--chemin', options['chemin']]
+        if options['wsgi']:
+            commande.append('--wsgi')
+        execution = subprocess.run(commande, env=environnement, capture_output=True, text=True)
+        if execution.returncode:
+            raise CommandError(f"Scenario {nom} en echec :\n{execution.stderr}")
+        return json.loads(execution.stdout.strip().splitlines()[-1])
+
+    def mesurer(self, options):
+        utilisateur = Utilisateur.objects.filter(is_active=True).order_by('pk').first()
+        if utilisateur is None:
+            raise CommandError("Il faut au moins un Utilisateur actif dans la base de benchmark")
+        client = Client()
+        client.force_login(utilisateur, backend=LOGIN_BACKEND)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        hote = next((hote for hote in settings.ALLOWED_HOSTS if hote != '*' and not hote.startswith('.')),
+                    'localhost')
+
+        ouvertures = []
+        verrou = threading.Lock()
+
+        def compter(sender, connection, **kwargs):
+            # Une connexion reprise dans la reserve n'est pas une nouvelle connexion au serveur
+            if getattr(connection, '_reprise', False):
+                return
+            with verrou:
+                ouvertures.append(connection.alias)
+
+        connection_created.connect(compter, weak=False)
+        chemin, _, requete = options['chemin'].partition('?')
+        appel = (_appel_wsgi if options['wsgi'] else _appel_asgi)(chemin, requete, hote, cookie)
+        # Une requete de chauffe charge les middlewares et le referentiel avant la mesure
+        appel(1, 1)
+        ouvertures.clear()
+
+        depart = time.perf_counter()
+        statuts = appel(options['requetes'], options['concurrence'])
+        duree = time.perf_counter() - depart
+        return {
+            'requetes': len(statuts),
+            'secondes': round(duree, 3),
+            'req_s': len(statuts) / duree,
+            'connexions': len(ouvertures),
+            'erreurs': sum(1 for statut in statuts if statut != 200),
+        }
+
+
+def _appel_asgi(chemin, requete, hote, cookie):
+    application = get_asgi_application()
+    portee = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': chemin, 'raw_path': chemin.encode(), 'query_string': requete.encode(), 'root_path': '',
+        'headers': [(b'host', hote.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000), 'server': (hote, 80),
+    }
+
+    async def une(limite):
+        statut = None
+
+        async def recevoir():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def envoyer(message):
+            nonlocal statut
+            if message['type'] == 'http.response.start':
+                statut = message['status']
+
+        async with limite:
+            await application(dict(portee), recevoir, envoyer)
+        return statut
+
+    async def toutes(nombre, concurrence):
+        limite = asyncio.Semaphore(concurrence)
+        return await asyncio.gather(*(une(limite) for _ in range(nombre)))
+
+    return lambda nombre, concurrence: asyncio.run(toutes(nombre, concurrence))
+
+
+def _appel_wsgi(chemin, requete, hote, cookie):
+    application = get_wsgi_application()
+
+    def une(_):
+        statut = []
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': chemin, 'QUERY_STRING': requete, 'SCRIPT_NAME': '',
+            'SERVER_NAME': hote, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': hote,
+            'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(b''),
+            'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+            'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        reponse = application(environ, lambda etat, entetes, *args: statut.append(int(etat.split()[0])))
+        try:
+            for _ in reponse:
+                pass
+        finally:
+            # Fin de requete : request_finished ferme ou rend les connexions comme sous un vrai serveur
+            reponse.close()
+        return statut[0]
+
+    def toutes(nombre, concurrence):
+        with ThreadPoolExecutor(concurrence) as executeur:
+            return list(executeur.map(une, range(nombre)))
+
+    return toutes
@@ -0,0 +1,133 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from djokalante.models import EtatTransfert, Motif, StatutObjet, Transfert, Utilisateur
+
+PREFIXE = 'BENCH'
+
+
+class Command(BaseCommand):
+    help = ("Remplit Transfert avec des lignes de test et mesure la latence des recherches avec et sans les index "
+            "de Transfert. A lancer sur une base de benchmark (SQLite ou MySQL) : les index sont supprimes puis "
+            "recrees pendant la mesure, ce que --detruire-index doit autoriser.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lignes', type=int, default=1_000_000)
+        parser.add_argument('--requetes', type=int, default=500, help="Nombre de recherches par scenario")
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--nettoyer', action='store_true', help="Supprime les lignes de test a la fin")
+        parser.add_argument('--detruire-index', action='store_true',
+                            help="Autorise la suppression des index de Transfert pendant la mesure : la base doit "
+                                 "etre une base de benchmark, jamais celle de production")
+
+    def handle(self, *args, **options):
+        self.base = options['database']
+        if not options['detruire_index']:
+            base = connections[self.base].settings_dict['NAME']
+            raise CommandError(f"Les index de Transfert de la base {self.base} ({base}) seraient supprimes puis "
+                               f"recrees : relancer avec --detruire-index sur une base de benchmark")
+        self.requetes = options['requetes']
+        existantes = Transfert.objects.using(self.base).filter(operation_number__startswith=PREFIXE).count()
+        if existantes < options['lignes']:
+            self.remplir(existantes, options['lignes'])
+
+        apres = self.mesurer()
+        with connections[self.base].schema_editor() as editeur:
+            self.retirer_index(editeur)
+        try:
+            avant = self.mesurer()
+        finally:
+            with connections[self.base].schema_editor() as editeur:
+                self.remettre_index(editeur)
+
+        self.stdout.write(f"{'scenario':<32}{'sans index (us)':>18}{'avec index (us)':>18}")
+        for scenario in apres:
+            self.stdout.write(f"{scenario:<32}{avant[scenario]:>18.0f}{apres[scenario]:>18.0f}")
+
+        if options['nettoyer']:
+            Transfert.objects.using(self.base).filter(operation_number__startswith=PREFIXE).delete()
+
+    def remplir(self, debut, total):
+        utilisateur = Utilisateur.objects.using(self.base).order_by('pk').first()
+        motif = Motif.objects.using(self.base).order_by('pk').first()
+        if utilisateur is None or motif is None:
+            raise CommandError("Il faut au moins un Utilisateur et un Motif dans la base de benchmark")
+
+        etats = [EtatTransfert.ENVOYE] * 6 + [EtatTransfert.PAYE] * 3 + [EtatTransfert.EN_ATTENTE]
+        aujourdhui = date.today()
+        maintenant = timezone.now()
+        depart = time.perf_counter()
+        for lot in range(debut, total, 10000):
+            transferts = []
+            for numero in range(lot, min(lot + 10000, total)):
+                transferts.append(Transfert(
+                    operation_code=f"{numero * 7919 % 100000000:08d}",
+                    operation_number=f"{PREFIXE}{numero:012d}",
+                    expeditor_first_name="Awa", expeditor_last_name=f"Diop{numero % 5000}",
+                    expeditor_phone=f"77{numero % 200000:07d}", expeditor_piece=f"P{numero % 200000}",
+                    account=Decimal(random.randint(1000, 99999)), commission_account=Decimal('100'),
+                    beneficiaire_first_name="Moussa", beneficiaire_last_name=f"Fall{numero % 7000}",
+                    beneficiaire_piece=f"B{numero}", beneficiaire_phone=f"78{numero % 300000:07d}",
+                    state=etats[numero % len(etats)], statut=StatutObjet.INSERT,
+                    motif=motif, user_creator=utilisateur, user_modificator=utilisateur,
+                    date_creation=maintenant, date_modification=maintenant))
+            with transaction.atomic(using=self.base):
+                Transfert.objects.using(self.base).bulk_create(transferts)
+            # send_date est en auto_now_add : on etale les dates apres insertion
+            Transfert.objects.using(self.base).filter(operation_number__gte=f"{PREFIXE}{lot:012d}",
+                                                      operation_number__lt=f"{PREFIXE}{lot + 10000:012d}") \
+                .update(send_date=aujourdhui - timedelta(days=(lot // 10000) % 365))
+            self.stdout.write(f"{min(lot + 10000, total)} lignes ({time.perf_counter() - depart:.0f} s)")
+
+    def scenarios(self):
+        jour = date.today() - timedelta(days=random.randrange(365))
+        numero = random.randrange(10000)
+        transferts = Transfert.objects.using(self.base).order_by()
+        return {
+            'operation_code + etat': lambda: list(transferts.filter(
+                operation_code=f"{numero * 7919 % 100000000:08d}", state=EtatTransfert.ENVOYE)
+                .values_list('id', 'send_date')),
+            'operation_number': lambda: list(transferts.filter(
+                operation_number=f"{PREFIXE}{numero:012d}").values_list('id')),
+            'etat en attente (100 premiers)': lambda: list(transferts.filter(
+                state=EtatTransfert.EN_ATTENTE).order_by('id').values_list('id')[:100]),
+            'send_date (1 jour, 100 lignes)': lambda: list(transferts.filter(
+                send_date=jour).order_by('id').values_list('id')[:100]),
+            'expediteur sur 1 jour': lambda: transferts.filter(
+                expeditor_phone=f"77{numero:07d}", send_date__gte=jour).count(),
+        }
+
+    def mesurer(self):
+        durees = {}
+        for _ in range(self.requetes):
+            for nom, requete in self.scenarios().items():
+                debut = time.perf_counter()
+                requete()
+                durees.setdefault(nom, []).append((time.perf_counter() - debut) * 1e6)
+        return {nom: statistics.median(valeurs) for nom, valeurs in durees.items()}
+
+    def numero_sans_unique(self):
+        champ = Transfert._meta.get_field('operation_number').clone()
+        champ.set_attributes_from_name('operation_number')
+        champ.model = Transfert
+        champ._unique = False
+        return champ
+
+    # Sur SQLite, alter_field reconstruit la table avec les index du modele : il passe donc avant la
+    # suppression des index et apres leur recreation.
+    def retirer_index(self, editeur):
+        editeur.alter_field(Transfert, Transfert._meta.get_field('operation_number'), self.numero_sans_unique())
+        for index in Transfert._meta.indexes:
+            editeur.remove_index(Transfert, index)
+
+    def remettre_index(self, editeur):
+        for index in Transfert._meta.indexes:
+            editeur.add_index(Transfert, index)
+        editeur.alter_field(Transfert, self.numero_sans_unique(), Transfert._meta.get_field('operation_number'))
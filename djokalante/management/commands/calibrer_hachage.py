@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from djokalante.hachage import PBKDF2AjustableHasher
+
+
+class Command(BaseCommand):
+    help = "Mesure le cout du hachage PBKDF2 et propose KHALISS_PBKDF2_ITERATIONS pour une duree cible"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cible-ms', type=float, default=150,
+                            help="Duree cible d'une verification de mot de passe, en millisecondes")
+        parser.add_argument('--essais', type=int, default=5)
+
+    def mesurer(self, hasher, iterations, essais):
+        durees = []
+        for _ in range(essais):
+            debut = time.perf_counter()
+            hasher.encode('mot-de-passe-de-calibrage', 'seldecalibrage', iterations)
+            durees.append(time.perf_counter() - debut)
+        return sorted(durees)[len(durees) // 2]
+
+    def handle(self, *args, **options):
+        hasher = PBKDF2AjustableHasher()
+        actuel = hasher.iterations
+        duree = self.mesurer(hasher, actuel, options['essais'])
+        self.stdout.write(f"Cout actuel : {actuel} iterations = {duree * 1000:.1f} ms")
+
+        propose = max(100000, int(actuel * options['cible_ms'] / 1000 / duree) // 10000 * 10000)
+        duree_proposee = self.mesurer(hasher, propose, options['essais'])
+        self.stdout.write(f"Propose : KHALISS_PBKDF2_ITERATIONS = {propose} ({duree_proposee * 1000:.1f} ms)")
+        if propose != getattr(settings, 'KHALISS_PBKDF2_ITERATIONS', None):
+            self.stdout.write("Les mots de passe existants seront rehaches a la prochaine connexion.")
@@ -0,0 +1,87 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Min, Q
+
+from djokalante.archives import EcrivainArchive, fichiers_partition, horodatage, repertoire_archives
+from djokalante.models import Journalisation
+
+
+def _mois_suivant(debut):
+    return debut.replace(year=debut.year + 1, month=1) if debut.month == 12 else debut.replace(month=debut.month + 1)
+
+
+class Command(BaseCommand):
+    help = ("Archive les mois de Journalisation plus anciens que la retention dans des fichiers compresses "
+            "(voir archives.py) puis les supprime de la table. Peut etre relance : les lignes arrivees en retard "
+            "sur un mois deja archive forment une nouvelle partie de l'archive du mois.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-mois', type=int,
+                            default=getattr(settings, 'KHALISS_RETENTION_JOURNAL_MOIS', 6),
+                            help="Nombre de mois, en plus du mois courant, gardes dans la table")
+        parser.add_argument('--lignes-par-bloc', type=int, default=2000)
+        parser.add_argument('--taille-suppression', type=int, default=5000)
+        parser.add_argument('--simulation', action='store_true', help="Affiche les mois a archiver sans rien faire")
+
+    def handle(self, *args, **options):
+        maintenant = datetime.now(dt_timezone.utc)
+        limite = maintenant.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(options['retention_mois']):
+            limite = (limite.replace(year=limite.year - 1, month=12) if limite.month == 1
+                      else limite.replace(month=limite.month - 1))
+
+        plus_ancien = Journalisation.objects.filter(date_event__lt=limite).aggregate(debut=Min('date_event'))['debut']
+        if plus_ancien is None:
+            self.stdout.write(f"Rien a archiver avant {limite:%Y-%m}")
+            return
+
+        repertoire = repertoire_archives()
+        repertoire.mkdir(parents=True, exist_ok=True)
+        debut = plus_ancien.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while debut < limite:
+            fin = _mois_suivant(debut)
+            if options['simulation']:
+                nombre = Journalisation.objects.filter(date_event__gte=debut, date_event__lt=fin).count()
+                self.stdout.write(f"{debut:%Y-%m} : {nombre} lignes")
+            else:
+                self.compacter(repertoire, debut, fin, options['lignes_par_bloc'], options['taille_suppression'])
+            debut = fin
+
+    def compacter(self, repertoire, debut, fin, lignes_par_bloc, taille_suppression):
+        depart = time.perf_counter()
+        mois = f"{debut:%Y-%m}"
+        lignes = Journalisation.objects.filter(date_event__gte=debut, date_event__lt=fin) \
+            .order_by('date_event', 'id').values_list('id', 'event', 'description', 'date_event')
+        chemin = repertoire / f"journal-{mois}.{len(fichiers_partition(mois, repertoire)) + 1:03d}.jka"
+        ecrivain = EcrivainArchive(chemin, lignes_par_bloc)
+        # Seules la derniere cle (date_event, id) et la plus grande cle archivees sont gardees, pas les cles
+        nombre, derniere, id_max = 0, None, 0
+        try:
+            for pk, event, description, date_event in lignes.iterator(chunk_size=lignes_par_bloc):
+                ecrivain.ecrire({'id': pk, 'event': event, 'description': description,
+                                 'date_event': horodatage(date_event)})
+                nombre, derniere, id_max = nombre + 1, (date_event, pk), max(id_max, pk)
+        except BaseException:
+            ecrivain.abandonner()
+            raise
+        if not nombre:
+            ecrivain.abandonner()
+            return
+        ecrivain.fermer()
+
+        # L'archive est sur disque (fsync) : on supprime l'intervalle archive, jusqu'a la derniere cle lue, par
+        # lots courts lus sur journal_date_idx. id <= id_max ecarte une ligne arrivee en retard pendant l'archivage
+        date_fin, id_fin = derniere
+        archivees = Journalisation.objects.filter(
+            Q(date_event__lt=date_fin) | Q(date_event=date_fin, id__lte=id_fin),
+            date_event__gte=debut, id__lte=id_max).order_by('date_event', 'id')
+        while True:
+            lot = list(archivees.values_list('id', flat=True)[:taille_suppression])
+            if not lot:
+                break
+            Journalisation.objects.filter(pk__in=lot).delete()
+        self.stdout.write(f"{mois} : {nombre} lignes archivees dans {chemin.name} "
+                          f"({chemin.stat().st_size // 1024} Kio, {time.perf_counter() - depart:.1f} s)")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djokalante.grand_livre import consolider
+
+
+class Command(BaseCommand):
+    help = "Reporte les ecritures differees du grand livre dans les soldes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--taille-lot', type=int, default=5000)
+        parser.add_argument('--intervalle', type=float, default=0,
+                            help="Tourne en boucle en attendant N secondes quand il n'y a plus rien a consolider")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            traitees = consolider(options['taille_lot'])
+            total += traitees
+            if traitees:
+                continue
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
+        self.stdout.write(f"{total} ecritures consolidees")
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djokalante.exports import FORMATS, MARGE, MODELES, ExportError, exporter
+
+
+class Command(BaseCommand):
+    help = ("Exporte Transfert ou Compte pour le rapprochement avec les banques partenaires : CSV, ou Arrow IPC et "
+            "Parquet si pyarrow est installe. Le code secret des comptes n'est jamais exporte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('modele', choices=sorted(MODELES))
+        parser.add_argument('repertoire', help="Repertoire de sortie, qui garde aussi l'etat des exports")
+        parser.add_argument('--format', dest='format_', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--processus', type=int, default=1,
+                            help="Nombre de processus, chacun exportant une tranche d'identifiants")
+        parser.add_argument('--taille-lot', type=int, default=5000)
+        parser.add_argument('--incremental', action='store_true',
+                            help="N'exporte que les lignes modifiees depuis le dernier export")
+        parser.add_argument('--marge-s', type=int, default=int(MARGE.total_seconds()),
+                            help="Recouvrement de deux exports incrementaux, en secondes : au moins la duree de la "
+                                 "plus longue transaction")
+
+    def handle(self, *args, **options):
+        if options['processus'] < 1:
+            raise CommandError("--processus doit etre au moins 1")
+        try:
+            fichiers, total, duree = exporter(options['modele'], options['repertoire'], options['format_'],
+                                              options['processus'], options['taille_lot'], options['incremental'],
+                                              timedelta(seconds=options['marge_s']))
+        except (ExportError, OSError) as erreur:
+            raise CommandError(str(erreur))
+
+        for fichier in fichiers:
+            self.stdout.write(str(fichier))
+        self.stdout.write(f"{total} lignes en {duree:.1f} s ({total / duree if duree else 0:.0f} lignes/s)")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from djokalante.models import HistoriqueFichierVirement
+from djokalante.virements import ImportVirementError, importer_fichier
+
+
+class Command(BaseCommand):
+    help = "Importe (ou reprend) un fichier de virement de salaires lie a un historique"
+
+    def add_arguments(self, parser):
+        parser.add_argument('historique', type=int, help="Identifiant de l'historique du fichier")
+        parser.add_argument('fichier', nargs='?', help="Chemin du fichier (par defaut le nom enregistre)")
+        parser.add_argument('--delimiteur', default=';')
+        parser.add_argument('--sans-entete', action='store_true', help="Le fichier n'a pas de ligne d'entete")
+
+    def handle(self, *args, **options):
+        try:
+            historique = HistoriqueFichierVirement.objects.get(pk=options['historique'])
+        except HistoriqueFichierVirement.DoesNotExist:
+            raise CommandError(f"Historique {options['historique']} introuvable")
+
+        try:
+            historique = importer_fichier(historique, options['fichier'] or historique.file_name,
+                                          delimiteur=options['delimiteur'], entete=not options['sans_entete'])
+        except (ImportVirementError, OSError) as erreur:
+            raise CommandError(str(erreur))
+
+        self.stdout.write(f"{historique.file_name} : {historique.lignes_traitees} lignes, "
+                          f"{historique.lignes_rejetees} rejetees, {historique.montant_total} debites")
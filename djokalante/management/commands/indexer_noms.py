@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from djokalante.models import NatureNom
+from djokalante.recherche import reconstruire
+
+
+class Command(BaseCommand):
+    help = ("Indexe pour la recherche approchee les noms des expediteurs, des beneficiaires et des titulaires de "
+            "compte deja en base. Seuls les noms absents ou modifies sont reecrits : la commande peut etre relancee.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nature', choices=NatureNom.values, action='append',
+                            help="Nature a indexer (toutes par defaut), peut etre repetee")
+        parser.add_argument('--taille-lot', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for nature in options['nature'] or NatureNom.values:
+            total = reconstruire(nature, options['taille_lot'], sortie=self.stdout.write)
+            self.stdout.write(f"{nature} : {total} noms indexes")
@@ -0,0 +1,64 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Execute dans un interpreteur neuf : chargement des reglages et des applications, gestionnaire ASGI, premiere
+# requete. Les durees sont mesurees depuis le debut du script ; le demarrage de l'interpreteur est mesure par
+# la commande.
+SCRIPT = """
+import json, time
+debut = time.perf_counter()
+import django
+django.setup()
+reglages = time.perf_counter()
+from khaliss.asgi import application
+from djokalante.management.commands.benchmark_connexions import _appel_asgi
+gestionnaire = time.perf_counter()
+statut = _appel_asgi({chemin!r}, '', 'localhost', '')(1, 1)[0]
+fin = time.perf_counter()
+print(json.dumps({{'reglages': reglages - debut, 'gestionnaire': gestionnaire - reglages,
+                  'premiere_requete': fin - gestionnaire, 'statut': statut}}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Mesure le demarrage a froid d'un worker ASGI par profil de reglages : chaque essai lance un "
+            "interpreteur neuf jusqu'a la reponse a sa premiere requete. Affiche les medianes en millisecondes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profils', default='dev,prod,bench')
+        parser.add_argument('--essais', type=int, default=5)
+        parser.add_argument('--chemin', default='/', help="Page demandee comme premiere requete")
+
+    def handle(self, *args, **options):
+        if options['essais'] < 1:
+            raise CommandError("--essais doit etre au moins 1")
+        colonnes = ('interpreteur', 'reglages', 'gestionnaire', 'premiere_requete', 'total')
+        self.stdout.write(f"{'profil':<10}" + ''.join(f"{colonne:>18}" for colonne in colonnes))
+        for profil in [profil.strip() for profil in options['profils'].split(',') if profil.strip()]:
+            essais = [self.essayer(profil, options['chemin']) for _ in range(options['essais'])]
+            medianes = {colonne: statistics.median(essai[colonne] for essai in essais) * 1000 for colonne in colonnes}
+            self.stdout.write(f"{profil:<10}" + ''.join(f"{medianes[colonne]:>18.0f}" for colonne in colonnes))
+
+    def essayer(self, profil, chemin):
+        environnement = {**os.environ, 'KHALISS_PROFIL': profil, 'DJANGO_SETTINGS_MODULE': 'khaliss.settings',
+                         'PYTHONDONTWRITEBYTECODE': '1'}
+        # Le profil prod exige une cle et des hotes ; des valeurs quelconques suffisent a la mesure
+        environnement.setdefault('KHALISS_SECRET_KEY', 'mesure-demarrage')
+        environnement.setdefault('KHALISS_ALLOWED_HOSTS', 'localhost')
+        depart = time.perf_counter()
+        execution = subprocess.run([sys.executable, '-c', SCRIPT.format(chemin=chemin)], env=environnement,
+                                   capture_output=True, text=True)
+        total = time.perf_counter() - depart
+        if execution.returncode:
+            raise CommandError(f"Demarrage du profil {profil} en echec :\n{execution.stderr}")
+        mesure = json.loads(execution.stdout.strip().splitlines()[-1])
+        if mesure['statut'] != 200:
+            raise CommandError(f"Profil {profil} : {chemin} a repondu {mesure['statut']}")
+        etapes = mesure['reglages'] + mesure['gestionnaire'] + mesure['premiere_requete']
+        return {**mesure, 'interpreteur': total - etapes, 'total': total}
@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djokalante.models import ReleveBancaire
+from djokalante.rapprochement import RapprochementError, rapprocher_releve
+
+
+class Command(BaseCommand):
+    help = "Rapproche un releve bancaire (date;montant;reference;libelle) des transferts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('releve', type=int, help="Identifiant du releve")
+        parser.add_argument('fichier', nargs='?', help="Chemin du fichier (par defaut le nom enregistre)")
+        parser.add_argument('--tolerance-montant', type=Decimal, default=Decimal('0'),
+                            help="Ecart de montant accepte pour un rapprochement approche")
+        parser.add_argument('--tolerance-jours', type=int, default=2,
+                            help="Ecart accepte entre la date du releve et la date d'envoi")
+        parser.add_argument('--delimiteur', default=';')
+        parser.add_argument('--sans-entete', action='store_true', help="Le fichier n'a pas de ligne d'entete")
+
+    def handle(self, *args, **options):
+        try:
+            releve = ReleveBancaire.objects.get(pk=options['releve'])
+        except ReleveBancaire.DoesNotExist:
+            raise CommandError(f"Releve {options['releve']} introuvable")
+
+        try:
+            releve = rapprocher_releve(releve, options['fichier'] or releve.file_name,
+                                       tolerance_montant=options['tolerance_montant'],
+                                       tolerance_jours=options['tolerance_jours'],
+                                       delimiteur=options['delimiteur'], entete=not options['sans_entete'])
+        except (RapprochementError, OSError) as erreur:
+            raise CommandError(str(erreur))
+
+        self.stdout.write(f"{releve.file_name} : {releve.lignes_traitees} lignes, {releve.lignes_rapprochees} "
+                          f"rapprochees, {releve.lignes_rejetees} rejetees")
@@ -0,0 +1,57 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from djokalante.mesures import BudgetDepasse, budget_requetes
+from djokalante.models import Utilisateur
+from djokalante.views import LOGIN_BACKEND
+
+# (methode, chemin, donnees, requetes SQL au plus, requetes en double au plus ou None), client connecte, dans un
+# processus neuf (caches vides). Un budget ne monte qu'avec la modification qui le justifie, dans le meme commit.
+BUDGETS = [
+    ('GET', '/', None, 0, 0),
+    ('GET', '/home', None, 0, 0),
+    ('POST', '/se_connecter', {'username': 'budget-inconnu', 'password': 'x'}, 1, 0),
+    # Premier appel : chargement du referentiel des motifs
+    ('GET', '/transferts?taille=20', None, 4, 0),
+    ('GET', '/comptes?taille=20', None, 3, 0),
+    ('GET', '/journalisation?taille=20', None, 3, 0),
+    # Une lecture de liste par trigramme rare et par nature, apres le comptage des frequences : repetitions voulues
+    ('GET', '/recherche?q=ndiaye', None, 40, None),
+]
+BUDGETS_ADMIN = [
+    ('GET', '/admin/', None, 3, 0),
+    ('GET', '/admin/djokalante/transfert/', None, 5, 0),
+    ('GET', '/admin/djokalante/compte/', None, 3, 0),
+    ('GET', '/admin/djokalante/journalisation/', None, 5, 0),
+    ('GET', '/admin/djokalante/utilisateur/', None, 5, 0),
+]
+
+
+class Command(BaseCommand):
+    help = ("Appelle les pages principales avec le client de test et echoue si l'une depasse son budget de "
+            "requetes SQL (voir BUDGETS). A lancer en integration continue sur une base de test remplie.")
+
+    def handle(self, *args, **options):
+        utilisateur = Utilisateur.objects.filter(is_active=True, is_superuser=True).order_by('pk').first()
+        if utilisateur is None:
+            raise CommandError("Il faut un Utilisateur actif superutilisateur dans la base")
+        pages = BUDGETS + (BUDGETS_ADMIN if apps.is_installed('django.contrib.admin') else [])
+
+        echecs = []
+        self.stdout.write(f"{'page':<40}{'requetes':>10}{'budget':>8}{'doublons':>10}{'budget':>8}")
+        for methode, chemin, donnees, maximum, doublons in pages:
+            client = Client()
+            client.force_login(utilisateur, backend=LOGIN_BACKEND)
+            try:
+                with budget_requetes(maximum, doublons) as mesure:
+                    reponse = client.post(chemin, donnees) if methode == 'POST' else client.get(chemin)
+            except BudgetDepasse as erreur:
+                echecs.append(f"{methode} {chemin} : {erreur}")
+            else:
+                if reponse.status_code >= 400:
+                    echecs.append(f"{methode} {chemin} : reponse {reponse.status_code}")
+            self.stdout.write(f"{methode + ' ' + chemin:<40}{mesure.nombre:>10}{maximum:>8}"
+                              f"{mesure.requetes_en_double():>10}{'-' if doublons is None else doublons:>8}")
+        if echecs:
+            raise CommandError("Budgets depasses :\n" + '\n'.join(echecs))
@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djokalante.cumuls import ecarts, reconstruire
+
+
+class Command(BaseCommand):
+    help = ("Compare les cumuls journaliers des transferts a la table Transfert, jour par jour, et les reconstruit "
+            "avec --reconstruire")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--du', type=date.fromisoformat, default=None, help="Premier jour (AAAA-MM-JJ)")
+        parser.add_argument('--au', type=date.fromisoformat, default=None, help="Dernier jour, aujourd'hui par defaut")
+        parser.add_argument('--reconstruire', action='store_true',
+                            help="Recalcule les jours en ecart au lieu de seulement les signaler")
+
+    def handle(self, *args, **options):
+        fin = options['au'] or date.today()
+        debut = options['du'] or fin - timedelta(days=7)
+        jours_en_ecart = set()
+        jour = debut
+        while jour <= fin:
+            for cle, (attendu, enregistre) in sorted(ecarts(jour, jour).items()):
+                jours_en_ecart.add(jour)
+                self.stdout.write(f"{cle} : attendu {attendu}, enregistre {enregistre}")
+            jour += timedelta(days=1)
+
+        if not jours_en_ecart:
+            self.stdout.write(f"Cumuls coherents du {debut} au {fin}")
+            return
+        if not options['reconstruire']:
+            raise CommandError(f"{len(jours_en_ecart)} jours en ecart")
+        for jour in sorted(jours_en_ecart):
+            reconstruire(jour, jour)
+        self.stdout.write(f"{len(jours_en_ecart)} jours reconstruits")
@@ -0,0 +1,388 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+PARAMETRES_PAR_DEFAUT = {
+    'actif': True,
+    # Requete journalisee dans khaliss.requetes_lentes au-dela de ce temps
+    'seuil_lent_ms': 500,
+    'bornes_duree_s': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    'bornes_sql': [1, 2, 5, 10, 20, 50, 100, 200, 500],
+    # Adresses autorisees a lire /metriques
+    'adresses': ['127.0.0.1', '::1'],
+    # Repertoire partage par les workers de la machine : chacun y ecrit ses series au plus toutes les ecriture_s
+    # secondes et /metriques additionne les fichiers. None : series du seul worker qui repond
+    'repertoire': None,
+    'ecriture_s': 1,
+}
+
+logger = logging.getLogger('khaliss.requetes_lentes')
+
+# Mesure en cours : requete HTTP (MesuresMiddleware) ou bloc budget_requetes. Une variable de contexte suit la
+# requete jusque dans les threads de sync_to_async, ou les vues asynchrones font leurs acces a la base.
+_mesure = ContextVar('khaliss_mesure', default=None)
+
+
+def configuration():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'KHALISS_MESURES', {})}
+
+
+class Mesure:
+    """Requetes SQL d'une requete HTTP : nombre, temps passe en base et executions par texte SQL."""
+
+    __slots__ = ('nombre', 'duree_sql', 'textes')
+
+    def __init__(self):
+        self.nombre = 0
+        self.duree_sql = 0.0
+        self.textes = Counter()
+
+    def ajouter(self, autre):
+        self.nombre += autre.nombre
+        self.duree_sql += autre.duree_sql
+        self.textes.update(autre.textes)
+
+    def doublons(self):
+        """
+        Textes SQL executes plusieurs fois, les plus repetes d'abord : [(sql, executions)]. Les parametres ne
+        font pas partie du texte, une boucle de requetes identiques a une ligne pres (N+1) y apparait donc.
+        """
+        return [(sql, nombre) for sql, nombre in self.textes.most_common() if nombre > 1]
+
+    def requetes_en_double(self):
+        return sum(nombre - 1 for nombre in self.textes.values() if nombre > 1)
+
+
+def _enregistrer(execute, sql, params, many, context):
+    mesure = _mesure.get()
+    if mesure is None:
+        return execute(sql, params, many, context)
+    debut = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        mesure.duree_sql += time.perf_counter() - debut
+        mesure.nombre += 1
+        mesure.textes[sql] += 1
+
+
+def _installer(sender, connection, **kwargs):
+    # En tete de liste : connection.execute_wrapper() retire le dernier element en sortie de bloc
+    if _enregistrer not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _enregistrer)
+
+
+connection_created.connect(_installer, dispatch_uid='mesures_installer')
+
+
+# Histogrammes
+
+class Histogramme:
+    """Histogramme cumulatif a la Prometheus, une serie par vue."""
+
+    def __init__(self, nom, aide, bornes):
+        self.nom = nom
+        self.aide = aide
+        self.bornes = list(bornes)
+        self._series = {}
+
+    def observer(self, vue, valeur):
+        serie = self._series.get(vue)
+        if serie is None:
+            serie = self._series[vue] = [[0] * (len(self.bornes) + 1), 0.0]
+        serie[0][bisect.bisect_left(self.bornes, valeur)] += 1
+        serie[1] += valeur
+
+    def etat(self):
+        return self._series
+
+    def fusionner(self, series):
+        for vue, (compteurs, somme) in series.items():
+            serie = self._series.get(vue)
+            if serie is None:
+                serie = self._series[vue] = [[0] * (len(self.bornes) + 1), 0.0]
+            serie[0] = [a + b for a, b in zip(serie[0], compteurs)]
+            serie[1] += somme
+
+    def lignes(self):
+        yield f"# HELP {self.nom} {self.aide}"
+        yield f"# TYPE {self.nom} histogram"
+        for vue, (compteurs, somme) in sorted(self._series.items()):
+            cumul = 0
+            for borne, nombre in zip([*self.bornes, '+Inf'], compteurs):
+                cumul += nombre
+                yield f'{self.nom}_bucket{{vue="{vue}",le="{borne}"}} {cumul}'
+            yield f'{self.nom}_sum{{vue="{vue}"}} {somme}'
+            yield f'{self.nom}_count{{vue="{vue}"}} {cumul}'
+
+
+class Compteur:
+    type = 'counter'
+
+    def __init__(self, nom, aide, etiquette='vue'):
+        self.nom = nom
+        self.aide = aide
+        # None : une seule serie, sans etiquette, sous la cle ''
+        self.etiquette = etiquette
+        self._valeurs = Counter()
+
+    def ajouter(self, vue, valeur):
+        self._valeurs[vue] += valeur
+
+    def fixer(self, cle, valeur):
+        self._valeurs[cle] = valeur
+
+    def etat(self):
+        return self._valeurs
+
+    def fusionner(self, valeurs):
+        self._valeurs.update(valeurs)
+
+    def lignes(self):
+        yield f"# HELP {self.nom} {self.aide}"
+        yield f"# TYPE {self.nom} {self.type}"
+        for cle, valeur in sorted(self._valeurs.items()):
+            yield f'{self.nom}{{{self.etiquette}="{cle}"}} {valeur}' if self.etiquette else f'{self.nom} {valeur}'
+
+
+class Jauge(Compteur):
+    """Valeur instantanee : entre workers, seuls ceux encore en vie s'additionnent."""
+
+    type = 'gauge'
+
+
+def _exposer(familles):
+    return '\n'.join(ligne for famille in familles for ligne in famille.lignes()) + '\n'
+
+
+class Metriques:
+    """
+    Metriques des requetes HTTP par nom de vue et du journal differe. Avec un repertoire, chaque worker y depose
+    ses series (fichier <pid>-<demarrage>.json remplace par os.replace) et texte() additionne celles de tous les
+    workers de la machine, y compris les workers arretes pour les compteurs : ils ne redescendent pas quand uvicorn
+    remplace un worker. Les jauges ne comptent que les workers en vie.
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._familles = None
+        self._fichier = None
+        self._pid = None
+        self._sauvegarde = 0.0
+
+    def _creer(self):
+        parametres = configuration()
+        self.repertoire = Path(parametres['repertoire']) if parametres['repertoire'] else None
+        self.ecriture_s = parametres['ecriture_s']
+        return (
+            Histogramme('khaliss_requete_duree_secondes', "Duree des requetes HTTP", parametres['bornes_duree_s']),
+            Histogramme('khaliss_requete_sql_secondes', "Temps passe en base par requete HTTP",
+                        parametres['bornes_duree_s']),
+            Histogramme('khaliss_requete_sql_nombre', "Requetes SQL par requete HTTP", parametres['bornes_sql']),
+            Compteur('khaliss_requete_sql_doublons_total', "Requetes SQL dont le texte a deja ete execute dans "
+                                                           "la meme requete HTTP"),
+            Compteur('khaliss_requetes_lentes_total', "Requetes HTTP au-dela du seuil de lenteur"),
+            # Journal differe (journal.py), releve a chaque sauvegarde ou lecture
+            Compteur('khaliss_journal_evenements_total', "Evenements du journal differe : recus, ecrits en base, "
+                                                         "gardes dans le seul WAL", etiquette='issue'),
+            Compteur('khaliss_journal_saturations_total', "Appels de journaliser ayant trouve le tampon plein",
+                     etiquette=None),
+            Compteur('khaliss_journal_attente_secondes_total', "Temps d'attente des appelants sur tampon plein",
+                     etiquette=None),
+            Compteur('khaliss_journal_echecs_total', "Ecritures du journal en base en echec", etiquette=None),
+            Jauge('khaliss_journal_profondeur', "Evenements du journal en memoire", etiquette=None),
+            Jauge('khaliss_journal_capacite', "Evenements du journal gardes en memoire au plus", etiquette=None),
+            Jauge('khaliss_journal_segments_en_attente', "Segments WAL a ecrire en base", etiquette=None),
+        )
+
+    def _relever_journal(self, familles):
+        from djokalante.journal import journal
+
+        etat = journal.metriques()
+        evenements, saturations, attente, echecs, profondeur, capacite, segments = familles[5:]
+        for issue in ('recus', 'ecrits', 'debordements'):
+            evenements.fixer(issue, etat[issue])
+        saturations.fixer('', etat['saturations'])
+        attente.fixer('', etat['attente_totale_s'])
+        echecs.fixer('', etat['echecs'])
+        profondeur.fixer('', etat['profondeur'])
+        capacite.fixer('', etat['capacite'] or 0)
+        segments.fixer('', etat['segments_en_attente'])
+
+    @property
+    def familles(self):
+        if self._familles is None:
+            with self._verrou:
+                if self._familles is None:
+                    self._familles = self._creer()
+        return self._familles
+
+    def observer(self, vue, duree, mesure, lente):
+        duree_h, sql_h, nombre_h, doublons_c, lentes_c = self.familles[:5]
+        doublons = mesure.requetes_en_double()
+        with self._verrou:
+            duree_h.observer(vue, duree)
+            sql_h.observer(vue, mesure.duree_sql)
+            nombre_h.observer(vue, mesure.nombre)
+            if doublons:
+                doublons_c.ajouter(vue, doublons)
+            if lente:
+                lentes_c.ajouter(vue, 1)
+        if self.repertoire is not None and time.monotonic() - self._sauvegarde >= self.ecriture_s:
+            self.sauver()
+
+    def sauver(self):
+        """Ecrit les series de ce worker dans le repertoire partage."""
+        if self._familles is None or self.repertoire is None:
+            return
+        with self._verrou:
+            self._sauvegarde = time.monotonic()
+            if self._pid != os.getpid():
+                # Premier enregistrement du worker (le processus maitre peut avoir cree l'objet avant le fork)
+                self._pid = os.getpid()
+                self._fichier = self.repertoire / f"{self._pid}-{time.time_ns()}.json"
+                self.repertoire.mkdir(parents=True, exist_ok=True)
+                atexit.register(self.sauver)
+            self._relever_journal(self._familles)
+            # Sous le verrou : deux threads du worker n'ecrivent pas le meme fichier temporaire en meme temps
+            temporaire = self._fichier.with_suffix('.tmp')
+            temporaire.write_text(json.dumps([famille.etat() for famille in self._familles]), encoding='utf-8')
+            os.replace(temporaire, self._fichier)
+
+    def _lire_workers(self):
+        from djokalante.journal import _processus_vivant
+
+        familles = self._creer()
+        for chemin in self.repertoire.glob('*.json'):
+            try:
+                etats = json.loads(chemin.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            vivant = _processus_vivant(int(chemin.name.split('-', 1)[0]))
+            for famille, etat in zip(familles, etats):
+                if vivant or not isinstance(famille, Jauge):
+                    famille.fusionner(etat)
+        return familles
+
+    def texte(self):
+        """Format texte d'exposition de Prometheus (version 0.0.4), tous workers confondus avec un repertoire."""
+        familles = self.familles
+        if self.repertoire is not None:
+            self.sauver()
+            # Familles neuves, propres a cet appel : pas de verrou
+            return _exposer(self._lire_workers())
+        with self._verrou:
+            self._relever_journal(familles)
+            return _exposer(familles)
+
+    def vider(self):
+        with self._verrou:
+            self._familles = None
+
+
+metriques = Metriques()
+
+
+class MesuresMiddleware:
+    """
+    Mesure chaque requete : duree totale, temps passe en base, nombre de requetes SQL et textes SQL repetes, par
+    nom de vue (request.resolver_match.view_name). Les mesures alimentent les histogrammes exposes par la vue
+    metriques ; une requete plus lente que seuil_lent_ms est journalisee avec ses requetes SQL repetees.
+    A placer en tete de MIDDLEWARE pour compter aussi les requetes des autres middlewares (session, utilisateur).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        parametres = configuration()
+        self.actif = parametres['actif']
+        self.seuil_lent_s = parametres['seuil_lent_ms'] / 1000
+        self.asynchrone = iscoroutinefunction(get_response)
+        if self.asynchrone:
+            # Marque l'instance comme coroutine pour le gestionnaire ASGI, comme MiddlewareMixin
+            markcoroutinefunction(self)
+
+    def _entrer(self):
+        mesure = Mesure()
+        return mesure, _mesure.set(mesure), time.perf_counter()
+
+    def _sortir(self, request, mesure, jeton, debut):
+        duree = time.perf_counter() - debut
+        _mesure.reset(jeton)
+        parent = _mesure.get()
+        if parent is not None:
+            # Requete faite dans un bloc budget_requetes : ses requetes SQL comptent aussi pour le bloc
+            parent.ajouter(mesure)
+        correspondance = getattr(request, 'resolver_match', None)
+        vue = correspondance.view_name if correspondance is not None else 'inconnue'
+        lente = duree >= self.seuil_lent_s
+        metriques.observer(vue, duree, mesure, lente)
+        if lente:
+            logger.warning("Requete lente %s %s (%s) : %.0f ms, %d requetes SQL en %.0f ms, doublons %s",
+                           request.method, request.path, vue, duree * 1000, mesure.nombre, mesure.duree_sql * 1000,
+                           [(sql[:200], nombre) for sql, nombre in mesure.doublons()[:3]])
+
+    def __call__(self, request):
+        if self.asynchrone:
+            return self.__acall__(request)
+        if not self.actif:
+            return self.get_response(request)
+        mesure, jeton, debut = self._entrer()
+        try:
+            return self.get_response(request)
+        finally:
+            self._sortir(request, mesure, jeton, debut)
+
+    async def __acall__(self, request):
+        if not self.actif:
+            return await self.get_response(request)
+        mesure, jeton, debut = self._entrer()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._sortir(request, mesure, jeton, debut)
+
+
+class BudgetDepasse(AssertionError):
+    pass
+
+
+@contextmanager
+def budget_requetes(maximum, doublons=None):
+    """
+    Echoue (BudgetDepasse, une AssertionError) si le bloc execute plus de maximum requetes SQL, ou plus de doublons
+    requetes dont le texte a deja ete execute. Compte aussi les requetes faites par le client de test :
+
+        with budget_requetes(6, doublons=0):
+            client.get('/transferts?taille=20')
+
+    Le bloc produit la Mesure, lisible apres coup.
+    """
+    mesure = Mesure()
+    jeton = _mesure.set(mesure)
+    try:
+        yield mesure
+    finally:
+        _mesure.reset(jeton)
+    erreurs = []
+    if mesure.nombre > maximum:
+        erreurs.append(f"{mesure.nombre} requetes SQL pour un budget de {maximum}")
+    if doublons is not None and mesure.requetes_en_double() > doublons:
+        erreurs.append(f"{mesure.requetes_en_double()} requetes en double pour un budget de {doublons}")
+    if erreurs:
+        detail = '\n'.join(f"  {nombre} x {sql}" for sql, nombre in mesure.doublons()[:5])
+        raise BudgetDepasse('; '.join(erreurs) + (f"\nRequetes repetees :\n{detail}" if detail else ''))
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='dernier_lot',
+            field=models.PositiveIntegerField(default=0, help_text='Nombre de lots valides'),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='etat',
+            field=models.CharField(choices=[('en_attente', 'EN ATTENTE'), ('en_cours', 'EN COURS'), ('termine', 'TERMINE'), ('echec', 'ECHEC')], default='en_attente', help_text="Etat de l'import du fichier", max_length=10),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='lignes_rejetees',
+            field=models.PositiveIntegerField(default=0, help_text='Nombre de lignes rejetees'),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='lignes_traitees',
+            field=models.PositiveIntegerField(default=0, help_text='Nombre de lignes traitees'),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='message_erreur',
+            field=models.TextField(blank=True, default='', help_text="Cause de l'echec de l'import"),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='montant_total',
+            field=models.DecimalField(decimal_places=2, default=0, help_text="Montant total debite a l'employeur", max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='taille_lot',
+            field=models.PositiveIntegerField(default=1000, help_text='Nombre de lignes par lot'),
+        ),
+        migrations.CreateModel(
+            name='LigneVirement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero_ligne', models.PositiveIntegerField(help_text='Numero de la ligne dans le fichier')),
+                ('phone', models.CharField(blank=True, help_text='Telephone du compte credite', max_length=20)),
+                ('montant', models.DecimalField(decimal_places=2, help_text='Montant du virement', max_digits=10, null=True)),
+                ('etat', models.CharField(choices=[('creditee', 'CREDITEE'), ('rejetee', 'REJETEE')], help_text='Etat de la ligne', max_length=10)),
+                ('motif_rejet', models.CharField(blank=True, default='', help_text='Motif du rejet', max_length=100)),
+                ('compte', models.ForeignKey(help_text='Compte credite', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='lignes_virement', to='djokalante.compte')),
+                ('historique', models.ForeignKey(help_text="Fichier de virement d'origine", on_delete=django.db.models.deletion.DO_NOTHING, related_name='lignes', to='djokalante.historiquefichiervirement')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lignevirement',
+            constraint=models.UniqueConstraint(fields=('historique', 'numero_ligne'), name='ligne_virement_unique'),
+        ),
+    ]
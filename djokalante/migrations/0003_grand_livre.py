@@ -0,0 +1,38 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:21
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0002_import_virements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ecriture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nature', models.CharField(choices=[('compte', 'COMPTE'), ('employeur', 'EMPLOYEUR'), ('guichet', 'GUICHET'), ('programme', 'PROGRAMME')], help_text='Nature du titulaire', max_length=10)),
+                ('titulaire_id', models.BigIntegerField(help_text='Identifiant du compte, guichet, employeur ou programme')),
+                ('montant', models.DecimalField(decimal_places=2, help_text='Montant signe (credit > 0, debit < 0)', max_digits=20)),
+                ('libelle', models.CharField(blank=True, default='', help_text="Libelle de l'ecriture", max_length=200)),
+                ('reference', models.CharField(blank=True, default='', help_text="Reference de l'operation", max_length=100)),
+                ('date_event', models.DateTimeField(default=django.utils.timezone.now, help_text="Date de l'ecriture")),
+                ('consolidee', models.BooleanField(default=False, help_text='Ecriture reportee dans le solde du titulaire')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ecriture',
+            index=models.Index(fields=['consolidee', 'id'], name='ecriture_consolidee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ecriture',
+            index=models.Index(fields=['nature', 'titulaire_id', 'consolidee'], name='ecriture_titulaire_idx'),
+        ),
+    ]
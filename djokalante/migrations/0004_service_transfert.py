@@ -0,0 +1,46 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0003_grand_livre'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CumulJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expeditor_phone', models.CharField(help_text="Telephone de l'expediteur", max_length=20)),
+                ('jour', models.DateField(help_text="Jour d'envoi")),
+                ('montant', models.DecimalField(decimal_places=2, default=0, help_text='Montant envoye ce jour', max_digits=20)),
+                ('nombre', models.PositiveIntegerField(default=0, help_text='Nombre de transferts envoyes ce jour')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='transfert',
+            name='guichet',
+            field=models.ForeignKey(help_text="Guichet d'envoi", null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='guichet_transfert', to='djokalante.guichet'),
+        ),
+        migrations.AlterField(
+            model_name='transfert',
+            name='propotion',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='promotion_transfert', to='djokalante.promotion'),
+        ),
+        migrations.AlterField(
+            model_name='transfert',
+            name='state',
+            field=models.CharField(choices=[('en_attente', 'EN ATTENTE'), ('envoye', 'ENVOYE'), ('paye', 'PAYE'), ('annule', 'ANNULE')], help_text='Etat de la transaction', max_length=50),
+        ),
+        migrations.AddConstraint(
+            model_name='cumuljournalier',
+            constraint=models.UniqueConstraint(fields=('expeditor_phone', 'jour'), name='cumul_journalier_unique'),
+        ),
+    ]
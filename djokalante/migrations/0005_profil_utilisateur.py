@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0004_service_transfert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='utilisateur',
+            name='profil',
+            field=models.ForeignKey(help_text="Profil de l'utilisateur", null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='utilisateurs', to='djokalante.profil'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0005_profil_utilisateur'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='commercant',
+            name='mercahnd_code',
+            field=models.CharField(help_text='Code du marchand', max_length=10, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='compte',
+            name='card_number',
+            field=models.CharField(help_text='Numero de la carte', max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='compte',
+            name='phone',
+            field=models.CharField(db_index=True, help_text='Telephone du compte', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='devise',
+            name='code',
+            field=models.CharField(max_length=3, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='pays',
+            name='code',
+            field=models.CharField(help_text='Le code du pays', max_length=3, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='transfert',
+            name='operation_number',
+            field=models.CharField(help_text="Numero de l'operation", max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(fields=['operation_code', 'state', 'send_date'], name='transfert_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(fields=['state', 'id'], name='transfert_etat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(fields=['send_date', 'id'], name='transfert_envoi_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(fields=['expeditor_phone', 'send_date'], name='transfert_expediteur_idx'),
+        ),
+    ]
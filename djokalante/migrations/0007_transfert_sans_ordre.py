@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:29
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0006_index_recherche'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transfert',
+            options={},
+        ),
+    ]
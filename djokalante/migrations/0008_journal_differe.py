@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0007_transfert_sans_ordre'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='journalisation',
+            name='date_event',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
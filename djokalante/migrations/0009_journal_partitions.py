@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0008_journal_differe'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='journalisation',
+            index=models.Index(fields=['date_event', 'id'], name='journal_date_idx'),
+        ),
+    ]
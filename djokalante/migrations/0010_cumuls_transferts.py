@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0009_journal_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CumulTransfertJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField(help_text="Jour d'envoi")),
+                ('guichet_id', models.PositiveIntegerField(default=0, help_text="Guichet d'envoi")),
+                ('pays_id', models.PositiveIntegerField(default=0, help_text='Pays du guichet')),
+                ('devise_id', models.PositiveIntegerField(default=0, help_text='Devise du pays du guichet')),
+                ('motif_id', models.PositiveIntegerField(help_text='Motif du transfert')),
+                ('state', models.CharField(choices=[('en_attente', 'EN ATTENTE'), ('envoye', 'ENVOYE'), ('paye', 'PAYE'), ('annule', 'ANNULE')], help_text='Etat des transferts', max_length=50)),
+                ('nombre', models.IntegerField(default=0, help_text='Nombre de transferts')),
+                ('montant', models.DecimalField(decimal_places=2, default=0, help_text='Somme des montants', max_digits=20)),
+                ('commission', models.DecimalField(decimal_places=2, default=0, help_text='Somme des commissions', max_digits=20)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ecriture',
+            index=models.Index(fields=['reference'], name='ecriture_reference_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cumultransfertjournalier',
+            constraint=models.UniqueConstraint(fields=('jour', 'guichet_id', 'pays_id', 'devise_id', 'motif_id', 'state'), name='cumul_transfert_unique'),
+        ),
+    ]
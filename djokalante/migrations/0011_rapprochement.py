@@ -0,0 +1,60 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0010_cumuls_transferts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleveBancaire',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_modification', models.DateTimeField(auto_now=True)),
+                ('statut', models.CharField(choices=[('insert', 'INSERT'), ('update', 'UPDATE'), ('delete', 'DELETE')], max_length=6)),
+                ('file_name', models.CharField(help_text='Nom du fichier', max_length=100)),
+                ('etat', models.CharField(choices=[('en_attente', 'EN ATTENTE'), ('en_cours', 'EN COURS'), ('termine', 'TERMINE'), ('echec', 'ECHEC')], default='en_attente', help_text='Etat du rapprochement', max_length=10)),
+                ('lignes_traitees', models.PositiveIntegerField(default=0, help_text='Nombre de lignes lues')),
+                ('lignes_rapprochees', models.PositiveIntegerField(default=0, help_text='Nombre de lignes rapprochees')),
+                ('lignes_rejetees', models.PositiveIntegerField(default=0, help_text='Nombre de lignes illisibles')),
+                ('message_erreur', models.TextField(blank=True, default='', help_text="Cause de l'echec du rapprochement")),
+                ('banque', models.ForeignKey(help_text='Banque emettrice du releve', on_delete=django.db.models.deletion.DO_NOTHING, related_name='releves', to='djokalante.banque')),
+                ('user_creator', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='user_releve_create', to=settings.AUTH_USER_MODEL)),
+                ('user_modificator', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='user_releve_modify', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='LigneReleve',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero_ligne', models.PositiveIntegerField(help_text='Numero de la ligne dans le fichier')),
+                ('date_operation', models.DateField(help_text="Date de l'operation chez la banque", null=True)),
+                ('montant', models.DecimalField(decimal_places=2, help_text="Montant de l'operation", max_digits=10, null=True)),
+                ('reference', models.CharField(blank=True, default='', help_text='Reference donnee par la banque', max_length=100)),
+                ('libelle', models.CharField(blank=True, default='', help_text="Libelle de l'operation", max_length=200)),
+                ('etat', models.CharField(choices=[('reference', 'REFERENCE'), ('montant_date', 'MONTANT ET DATE'), ('approche', 'APPROCHE'), ('non_rapprochee', 'NON RAPPROCHEE'), ('rejetee', 'REJETEE')], help_text='Resultat du rapprochement', max_length=15)),
+                ('ecart_montant', models.DecimalField(decimal_places=2, default=0, help_text='Montant de la ligne moins montant du transfert', max_digits=10)),
+                ('ecart_jours', models.IntegerField(default=0, help_text="Date de la ligne moins date d'envoi, en jours")),
+                ('motif_rejet', models.CharField(blank=True, default='', help_text='Motif du rejet', max_length=100)),
+                ('releve', models.ForeignKey(help_text="Releve d'origine", on_delete=django.db.models.deletion.DO_NOTHING, related_name='lignes', to='djokalante.relevebancaire')),
+                ('transfert', models.ForeignKey(help_text='Transfert rapproche', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='lignes_releve', to='djokalante.transfert')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lignereleve',
+            constraint=models.UniqueConstraint(fields=('releve', 'numero_ligne'), name='ligne_releve_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0011_rapprochement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(help_text='Nom de la sequence', max_length=50, unique=True)),
+                ('prochain', models.BigIntegerField(default=1, help_text='Premiere valeur du prochain bloc')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
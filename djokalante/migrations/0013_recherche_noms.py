@@ -0,0 +1,46 @@
+# Generated by Django 4.1.13 on 2026-10-18 15:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0012_sequences_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NomRecherche',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nature', models.CharField(choices=[('expediteur', 'EXPEDITEUR'), ('beneficiaire', 'BENEFICIAIRE'), ('compte', 'COMPTE')], help_text='Origine du nom', max_length=12)),
+                ('objet_id', models.BigIntegerField(help_text="Transfert ou compte d'origine")),
+                ('texte', models.CharField(help_text='Prenom et nom normalises', max_length=120)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TrigrammeNom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigramme', models.CharField(help_text='Trigramme du nom normalise', max_length=3)),
+                ('nature', models.CharField(choices=[('expediteur', 'EXPEDITEUR'), ('beneficiaire', 'BENEFICIAIRE'), ('compte', 'COMPTE')], help_text='Origine du nom', max_length=12)),
+                ('nom', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='trigrammes', to='djokalante.nomrecherche')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='nomrecherche',
+            constraint=models.UniqueConstraint(fields=('nature', 'objet_id'), name='nom_recherche_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='trigrammenom',
+            index=models.Index(fields=['trigramme', 'nature', 'nom'], name='trigramme_nom_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0013_recherche_noms'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transfert',
+            name='transfert_etat_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transfert',
+            name='transfert_envoi_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(condition=models.Q(('statut', 'delete'), _negated=True), fields=['state', 'id'], name='transfert_etat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(condition=models.Q(('statut', 'delete'), _negated=True), fields=['send_date', 'id'], name='transfert_envoi_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 16:29
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def renseigner_derniere_ligne(apps, schema_editor):
+    # Imports en cours : la derniere ligne validee est la plus grande ligne deja enregistree
+    HistoriqueFichierVirement = apps.get_model('djokalante', 'HistoriqueFichierVirement')
+    LigneVirement = apps.get_model('djokalante', 'LigneVirement')
+    derniere = LigneVirement.objects.filter(historique=OuterRef('pk')).order_by() \
+        .values('historique').annotate(numero=Max('numero_ligne')).values('numero')
+    HistoriqueFichierVirement._base_manager.filter(dernier_lot__gt=0).update(derniere_ligne=Subquery(derniere))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0015_manager_par_defaut'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historiquefichiervirement',
+            name='derniere_ligne',
+            field=models.PositiveIntegerField(default=0, help_text='Numero de la derniere ligne validee'),
+        ),
+        migrations.RunPython(renseigner_derniere_ligne, migrations.RunPython.noop),
+    ]
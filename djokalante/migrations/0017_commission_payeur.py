@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djokalante', '0016_reprise_par_ligne'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfert',
+            name='commission_payeur',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text="Part de commission du guichet payeur, fixee a l'envoi", max_digits=7, null=True),
+        ),
+    ]
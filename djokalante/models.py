@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator, MaxLengthValidator
 from django.db import models
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -11,15 +13,103 @@ class StatutObjet(models.TextChoices):
     DELETE = ("delete", _("DELETE"))
 
 
+class EtatImport(models.TextChoices):
+    EN_ATTENTE = ("en_attente", _("EN ATTENTE"))
+    EN_COURS = ("en_cours", _("EN COURS"))
+    TERMINE = ("termine", _("TERMINE"))
+    ECHEC = ("echec", _("ECHEC"))
+
+
+class EtatLigneVirement(models.TextChoices):
+    CREDITEE = ("creditee", _("CREDITEE"))
+    REJETEE = ("rejetee", _("REJETEE"))
+
+
+class NatureTitulaire(models.TextChoices):
+    COMPTE = ("compte", _("COMPTE"))
+    EMPLOYEUR = ("employeur", _("EMPLOYEUR"))
+    GUICHET = ("guichet", _("GUICHET"))
+    PROGRAMME = ("programme", _("PROGRAMME"))
+
+
+class EtatTransfert(models.TextChoices):
+    EN_ATTENTE = ("en_attente", _("EN ATTENTE"))
+    ENVOYE = ("envoye", _("ENVOYE"))
+    PAYE = ("paye", _("PAYE"))
+    ANNULE = ("annule", _("ANNULE"))
+
+
+class EtatRapprochement(models.TextChoices):
+    REFERENCE = ("reference", _("REFERENCE"))
+    MONTANT_DATE = ("montant_date", _("MONTANT ET DATE"))
+    APPROCHE = ("approche", _("APPROCHE"))
+    NON_RAPPROCHEE = ("non_rapprochee", _("NON RAPPROCHEE"))
+    REJETEE = ("rejetee", _("REJETEE"))
+
+
+class NatureNom(models.TextChoices):
+    EXPEDITEUR = ("expediteur", _("EXPEDITEUR"))
+    BENEFICIAIRE = ("beneficiaire", _("BENEFICIAIRE"))
+    COMPTE = ("compte", _("COMPTE"))
+
+
+# Envoye par soft_delete (sender=modele, pks=cles des lignes passees a DELETE) : l'UPDATE ne declenche ni post_save
+# ni post_delete, les caches et index qui suivent ces signaux s'abonnent aussi a celui-ci.
+lignes_supprimees = Signal()
+
+
+class BaseQuerySet(models.QuerySet):
+    def with_audit(self):
+        """Createur et modificateur lus avec les lignes, par jointure, au lieu d'une requete par ligne."""
+        return self.select_related('user_creator', 'user_modificator')
+
+    def soft_delete(self, utilisateur=None):
+        """
+        Passe les lignes a DELETE en un seul UPDATE et retourne leur nombre. Les cles ne sont lues que si un
+        recepteur de lignes_supprimees attend ce modele.
+        """
+        if not self.model.suppression_logique:
+            raise TypeError(f"{self.model.__name__} n'accepte pas la suppression logique")
+        valeurs = {'statut': StatutObjet.DELETE, 'date_modification': timezone.now()}
+        if utilisateur is not None:
+            valeurs['user_modificator'] = utilisateur
+        if not lignes_supprimees.has_listeners(self.model):
+            return self.update(**valeurs)
+        pks = list(self.values_list('pk', flat=True))
+        nombre = self.model.all_objects.filter(pk__in=pks).update(**valeurs)
+        lignes_supprimees.send(sender=self.model, pks=pks)
+        return nombre
+
+
+class ActifsManager(models.Manager.from_queryset(BaseQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().exclude(statut=StatutObjet.DELETE)
+
+
 class BaseModel(models.Model):
     class Meta:
         abstract = True
         managed = False
 
+    # all_objects, declare en premier, reste le manager par defaut de Django : controles d'unicite, admin, dumpdata
+    # et cles etrangeres voient les lignes supprimees (statut DELETE). objects les cache, pour les listes et
+    # recherches de l'application.
+    all_objects = BaseQuerySet.as_manager()
+    objects = ActifsManager()
+
+    # Faux pour les modeles dont la suppression a des effets (soldes, cumuls) : soft_delete leve TypeError
+    suppression_logique = True
+
     date_creation = models.DateTimeField(name='date_creation', auto_now_add=True)
     date_modification = models.DateTimeField(name='date_modification', auto_now=True)
     statut = models.CharField(name='statut', max_length=6, choices=StatutObjet.choices, null=False, blank=False)
 
+    def soft_delete(self, utilisateur=None):
+        type(self).all_objects.filter(pk=self.pk).soft_delete(utilisateur)
+        self.statut = StatutObjet.DELETE
+        if utilisateur is not None:
+            self.user_modificator = utilisateur
+
 
 class Action(models.Model):
     class Meta:
@@ -75,7 +165,7 @@ class Commercant(BaseModel):
     phone = models.CharField(max_length=50, blank=False, help_text="Telephone du commercant")
     address = models.TextField(max_length="255", blank=False, help_text="Adresse du commercant")
     status = models.CharField(max_length=10, blank=True, help_text="STatus du commercant")
-    mercahnd_code = models.CharField(max_length=10, blank=False, help_text="Code du marchand")
+    mercahnd_code = models.CharField(max_length=10, blank=False, unique=True, help_text="Code du marchand")
 
     user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
                                      related_name='user_commercant_create')
@@ -88,7 +178,7 @@ class Compte(BaseModel):
         abstract = False
         ordering = ['last_name', 'first_name', 'email']
 
-    phone = models.CharField(max_length=20, blank=False, help_text="Telephone du compte")
+    phone = models.CharField(max_length=20, blank=False, db_index=True, help_text="Telephone du compte")
     last_name = models.CharField(max_length=20, blank=False, help_text="Nom lie au compte")
     first_name = models.CharField(max_length=50, blank=False, help_text="Nom lie au compte")
     address = models.TextField(max_length=255, blank=False, help_text="Adresse du compte")
@@ -96,7 +186,7 @@ class Compte(BaseModel):
     piece_type = models.ForeignKey("TypePiece", null=False, related_name="compte_type_piece",
                                    on_delete=models.DO_NOTHING)
     piece_number = models.CharField(max_length=50, blank=False, help_text="Numero de la piece")
-    card_number = models.CharField(max_length=50, blank=False, help_text="Numero de la carte")
+    card_number = models.CharField(max_length=50, blank=False, unique=True, help_text="Numero de la carte")
     expiration_date = models.DateTimeField(null=False, help_text="Date d'expiration")
     secret_code = models.CharField(max_length=255, blank=False, help_text="Code secret")
     solde = models.DecimalField(decimal_places=2, max_digits=10, help_text="Solde du compte")
@@ -109,13 +199,47 @@ class Compte(BaseModel):
                                          related_name='user_compte_modify')
 
 
+class CumulJournalier(models.Model):
+    class Meta:
+        abstract = False
+        constraints = [
+            models.UniqueConstraint(fields=['expeditor_phone', 'jour'], name='cumul_journalier_unique'),
+        ]
+
+    expeditor_phone = models.CharField(max_length=20, blank=False, help_text="Telephone de l'expediteur")
+    jour = models.DateField(help_text="Jour d'envoi")
+    montant = models.DecimalField(max_digits=20, decimal_places=2, default=0, help_text="Montant envoye ce jour")
+    nombre = models.PositiveIntegerField(default=0, help_text="Nombre de transferts envoyes ce jour")
+
+
+# Totaux journaliers des transferts pour les rapports, tenus a jour par cumuls.py
+class CumulTransfertJournalier(models.Model):
+    class Meta:
+        abstract = False
+        constraints = [
+            models.UniqueConstraint(fields=['jour', 'guichet_id', 'pays_id', 'devise_id', 'motif_id', 'state'],
+                                    name='cumul_transfert_unique'),
+        ]
+
+    jour = models.DateField(help_text="Jour d'envoi")
+    # Identifiants et non cles etrangeres : 0 quand le transfert n'a pas de guichet (l'unicite ignore les NULL)
+    guichet_id = models.PositiveIntegerField(default=0, help_text="Guichet d'envoi")
+    pays_id = models.PositiveIntegerField(default=0, help_text="Pays du guichet")
+    devise_id = models.PositiveIntegerField(default=0, help_text="Devise du pays du guichet")
+    motif_id = models.PositiveIntegerField(help_text="Motif du transfert")
+    state = models.CharField(max_length=50, choices=EtatTransfert.choices, help_text="Etat des transferts")
+    nombre = models.IntegerField(default=0, help_text="Nombre de transferts")
+    montant = models.DecimalField(max_digits=20, decimal_places=2, default=0, help_text="Somme des montants")
+    commission = models.DecimalField(max_digits=20, decimal_places=2, default=0, help_text="Somme des commissions")
+
+
 class Devise(BaseModel):
     class Meta:
         abstract = False
         ordering = ['name']
 
     name = models.CharField(max_length=50, blank=False)
-    code = models.CharField(max_length=3, blank=False)
+    code = models.CharField(max_length=3, blank=False, unique=True)
 
     user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
                                      related_name='user_devise_create')
@@ -140,11 +264,35 @@ class Employeur(BaseModel):
                                          related_name='user_employeur_modify')
 
 
+class Ecriture(models.Model):
+    class Meta:
+        abstract = False
+        indexes = [
+            models.Index(fields=['consolidee', 'id'], name='ecriture_consolidee_idx'),
+            models.Index(fields=['nature', 'titulaire_id', 'consolidee'], name='ecriture_titulaire_idx'),
+            # Annulation : ecritures d'une operation
+            models.Index(fields=['reference'], name='ecriture_reference_idx'),
+        ]
+
+    nature = models.CharField(max_length=10, choices=NatureTitulaire.choices, help_text="Nature du titulaire")
+    titulaire_id = models.BigIntegerField(help_text="Identifiant du compte, guichet, employeur ou programme")
+    montant = models.DecimalField(max_digits=20, decimal_places=2, help_text="Montant signe (credit > 0, debit < 0)")
+    libelle = models.CharField(max_length=200, blank=True, default="", help_text="Libelle de l'ecriture")
+    reference = models.CharField(max_length=100, blank=True, default="", help_text="Reference de l'operation")
+    date_event = models.DateTimeField(default=timezone.now, help_text="Date de l'ecriture")
+    consolidee = models.BooleanField(default=False, help_text="Ecriture reportee dans le solde du titulaire")
+
+
 class Journalisation(models.Model):
+    class Meta:
+        # Partition logique par mois : les mois anciens sont archives par compacter_journal (voir archives.py)
+        indexes = [models.Index(fields=['date_event', 'id'], name='journal_date_idx')]
+
     event = models.CharField(max_length=200, blank=False,
                              help_text="Colonne d'information sur la ligne de journalisation")
     description = models.TextField(max_length=1000, blank=False, help_text='Description de la journalisation')
-    date_event = models.DateTimeField(auto_now_add=True)
+    # Date de l'evenement et non de l'insertion : le journal est ecrit en differe (voir journal.py)
+    date_event = models.DateTimeField(default=timezone.now)
 
 
 class Guichet(BaseModel):
@@ -174,6 +322,16 @@ class HistoriqueFichierVirement(BaseModel):
     account = models.CharField(max_length=30, blank=False, help_text="Numero de compte")
     employe = models.ForeignKey('Employeur', null=False, help_text="Numero de l'employeur",
                                 related_name="hfv_employeur", on_delete=models.DO_NOTHING)
+    etat = models.CharField(max_length=10, choices=EtatImport.choices, default=EtatImport.EN_ATTENTE,
+                            help_text="Etat de l'import du fichier")
+    taille_lot = models.PositiveIntegerField(default=1000, help_text="Nombre de lignes par lot")
+    dernier_lot = models.PositiveIntegerField(default=0, help_text="Nombre de lots valides")
+    derniere_ligne = models.PositiveIntegerField(default=0, help_text="Numero de la derniere ligne validee")
+    lignes_traitees = models.PositiveIntegerField(default=0, help_text="Nombre de lignes traitees")
+    lignes_rejetees = models.PositiveIntegerField(default=0, help_text="Nombre de lignes rejetees")
+    montant_total = models.DecimalField(max_digits=20, decimal_places=2, default=0,
+                                        help_text="Montant total debite a l'employeur")
+    message_erreur = models.TextField(blank=True, default="", help_text="Cause de l'echec de l'import")
 
     user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
                                      related_name='user_hfv_create')
@@ -181,6 +339,47 @@ class HistoriqueFichierVirement(BaseModel):
                                          related_name='user_hfv_modify')
 
 
+class LigneVirement(models.Model):
+    class Meta:
+        abstract = False
+        constraints = [
+            models.UniqueConstraint(fields=['historique', 'numero_ligne'], name='ligne_virement_unique'),
+        ]
+
+    historique = models.ForeignKey('HistoriqueFichierVirement', null=False, on_delete=models.DO_NOTHING,
+                                   related_name='lignes', help_text="Fichier de virement d'origine")
+    numero_ligne = models.PositiveIntegerField(help_text="Numero de la ligne dans le fichier")
+    phone = models.CharField(max_length=20, blank=True, help_text="Telephone du compte credite")
+    montant = models.DecimalField(max_digits=10, decimal_places=2, null=True, help_text="Montant du virement")
+    compte = models.ForeignKey('Compte', null=True, on_delete=models.DO_NOTHING, related_name='lignes_virement',
+                               help_text="Compte credite")
+    etat = models.CharField(max_length=10, choices=EtatLigneVirement.choices, help_text="Etat de la ligne")
+    motif_rejet = models.CharField(max_length=100, blank=True, default="", help_text="Motif du rejet")
+
+
+class LigneReleve(models.Model):
+    class Meta:
+        abstract = False
+        constraints = [
+            models.UniqueConstraint(fields=['releve', 'numero_ligne'], name='ligne_releve_unique'),
+        ]
+
+    releve = models.ForeignKey('ReleveBancaire', null=False, on_delete=models.DO_NOTHING, related_name='lignes',
+                               help_text="Releve d'origine")
+    numero_ligne = models.PositiveIntegerField(help_text="Numero de la ligne dans le fichier")
+    date_operation = models.DateField(null=True, help_text="Date de l'operation chez la banque")
+    montant = models.DecimalField(max_digits=10, decimal_places=2, null=True, help_text="Montant de l'operation")
+    reference = models.CharField(max_length=100, blank=True, default="", help_text="Reference donnee par la banque")
+    libelle = models.CharField(max_length=200, blank=True, default="", help_text="Libelle de l'operation")
+    transfert = models.ForeignKey('Transfert', null=True, on_delete=models.DO_NOTHING, related_name='lignes_releve',
+                                  help_text="Transfert rapproche")
+    etat = models.CharField(max_length=15, choices=EtatRapprochement.choices, help_text="Resultat du rapprochement")
+    ecart_montant = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                        help_text="Montant de la ligne moins montant du transfert")
+    ecart_jours = models.IntegerField(default=0, help_text="Date de la ligne moins date d'envoi, en jours")
+    motif_rejet = models.CharField(max_length=100, blank=True, default="", help_text="Motif du rejet")
+
+
 class Motif(BaseModel):
     class Meta:
         abstract = False
@@ -194,6 +393,19 @@ class Motif(BaseModel):
                                          related_name='user_motif_modify')
 
 
+# Nom normalise d'un expediteur, d'un beneficiaire ou d'un titulaire de compte, indexe par trigrammes (recherche.py)
+class NomRecherche(models.Model):
+    class Meta:
+        abstract = False
+        constraints = [
+            models.UniqueConstraint(fields=['nature', 'objet_id'], name='nom_recherche_unique'),
+        ]
+
+    nature = models.CharField(max_length=12, choices=NatureNom.choices, help_text="Origine du nom")
+    objet_id = models.BigIntegerField(help_text="Transfert ou compte d'origine")
+    texte = models.CharField(max_length=120, help_text="Prenom et nom normalises")
+
+
 class ParametreApplication(BaseModel):
     class Meta:
         abstract = False
@@ -221,7 +433,7 @@ class Pays(BaseModel):
         ordering = ['name']
 
     name = models.CharField(max_length=50, null=False, unique=True, help_text="Le nom du pays")
-    code = models.CharField(max_length=3, null=False, help_text="Le code du pays")
+    code = models.CharField(max_length=3, null=False, unique=True, help_text="Le code du pays")
     devise_pays = models.ForeignKey('Devise', null=False, on_delete=models.DO_NOTHING, related_name="devise")
 
     user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
@@ -283,13 +495,56 @@ class Promotion(BaseModel):
                                          related_name='user_promotion_modify')
 
 
+class ReleveBancaire(BaseModel):
+    class Meta:
+        abstract = False
+
+    banque = models.ForeignKey('Banque', null=False, on_delete=models.DO_NOTHING, related_name='releves',
+                               help_text="Banque emettrice du releve")
+    file_name = models.CharField(max_length=100, blank=False, help_text="Nom du fichier")
+    etat = models.CharField(max_length=10, choices=EtatImport.choices, default=EtatImport.EN_ATTENTE,
+                            help_text="Etat du rapprochement")
+    lignes_traitees = models.PositiveIntegerField(default=0, help_text="Nombre de lignes lues")
+    lignes_rapprochees = models.PositiveIntegerField(default=0, help_text="Nombre de lignes rapprochees")
+    lignes_rejetees = models.PositiveIntegerField(default=0, help_text="Nombre de lignes illisibles")
+    message_erreur = models.TextField(blank=True, default="", help_text="Cause de l'echec du rapprochement")
+
+    user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
+                                     related_name='user_releve_create')
+    user_modificator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
+                                         related_name='user_releve_modify')
+
+
+# Sequences des codes et numeros de transfert, reservees par blocs (voir codes.py)
+class SequenceCode(models.Model):
+    class Meta:
+        abstract = False
+
+    nom = models.CharField(max_length=50, unique=True, help_text="Nom de la sequence")
+    prochain = models.BigIntegerField(default=1, help_text="Premiere valeur du prochain bloc")
+
+
 class Transfert(BaseModel):
     class Meta:
         abstract = False
-        ordering = ['expeditor_last_name', 'expeditor_first_name', 'beneficiaire_last_name', 'beneficiaire_first_name']
+        # Pas d'ordre par defaut : les listes paginent par curseur sur (send_date, id), voir pagination.py
+        indexes = [
+            # Retrait : recherche par code avec controle de l'etat et de la validite sans lire la ligne
+            models.Index(fields=['operation_code', 'state', 'send_date'], name='transfert_code_idx'),
+            # Listes : index partiels sans les transferts supprimes, que le manager par defaut ecarte toujours.
+            # MySQL ignore la condition et cree un index complet (avertissement models.W037 masque dans les reglages)
+            models.Index(fields=['state', 'id'], condition=~models.Q(statut=StatutObjet.DELETE),
+                         name='transfert_etat_idx'),
+            models.Index(fields=['send_date', 'id'], condition=~models.Q(statut=StatutObjet.DELETE),
+                         name='transfert_envoi_idx'),
+            models.Index(fields=['expeditor_phone', 'send_date'], name='transfert_expediteur_idx'),
+        ]
+
+    # Un transfert s'annule (transferts.annuler_transfert : solde du guichet, cumuls, compteurs de velocite)
+    suppression_logique = False
 
     operation_code = models.CharField(max_length=100, blank=False, help_text="Code de l'operation")
-    operation_number = models.CharField(max_length=100, blank=False, help_text="Numero de l'operation")
+    operation_number = models.CharField(max_length=100, blank=False, unique=True, help_text="Numero de l'operation")
     expeditor_first_name = models.CharField(max_length=50, blank=False, help_text="Nom de l'expediteur")
     expeditor_last_name = models.CharField(max_length=50, blank=False, help_text="prenom de l'expediteur")
     expeditor_phone = models.CharField(max_length=20, blank=False, help_text="telephone de l'expediteur")
@@ -297,18 +552,24 @@ class Transfert(BaseModel):
     send_date = models.DateField(auto_now_add=True, blank=False, help_text="Date d'envoie")
     account = models.DecimalField(max_digits=7, decimal_places=2, blank=False, help_text="Date d'envoie")
     commission_account = models.DecimalField(max_digits=7, decimal_places=2, blank=False, help_text="Date d'envoie")
+    # Vide pour les transferts envoyes avant son ajout : la part est alors recalculee au paiement
+    commission_payeur = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True,
+                                            help_text="Part de commission du guichet payeur, fixee a l'envoi")
     beneficiaire_first_name = models.CharField(max_length=50, blank=False, help_text="Nom du bénéficiaire")
     beneficiaire_last_name = models.CharField(max_length=50, blank=False, help_text="prenom du beneficiaire")
     beneficiaire_piece = models.CharField(max_length=50, blank=False, help_text="Piece du beneficiaire")
     beneficiaire_phone = models.CharField(max_length=20, blank=False, help_text="telephone de l'expediteur")
-    state = models.CharField(max_length=50, blank=False, help_text="Etat de la transaction")
+    state = models.CharField(max_length=50, blank=False, choices=EtatTransfert.choices,
+                             help_text="Etat de la transaction")
     reception_date = models.DateField(auto_now_add=True, blank=False, help_text="Date de reception")
     cancel_date = models.DateField(auto_now_add=True, blank=False, help_text="Date d'annulation")
 
     motif = models.ForeignKey('Motif', null=False, on_delete=models.DO_NOTHING,
                               related_name='motif_transfert')
-    propotion = models.ForeignKey('Promotion', null=False, on_delete=models.DO_NOTHING,
+    propotion = models.ForeignKey('Promotion', null=True, on_delete=models.DO_NOTHING,
                                   related_name='promotion_transfert')
+    guichet = models.ForeignKey('Guichet', null=True, on_delete=models.DO_NOTHING, related_name='guichet_transfert',
+                                help_text="Guichet d'envoi")
 
     user_creator = models.ForeignKey('Utilisateur', null=False, on_delete=models.DO_NOTHING,
                                      related_name='user_transfert_create')
@@ -316,6 +577,19 @@ class Transfert(BaseModel):
                                          related_name='user_transfert_modify')
 
 
+class TrigrammeNom(models.Model):
+    class Meta:
+        abstract = False
+        indexes = [
+            # Liste des noms d'un trigramme pour une nature, lue sans acceder a la table
+            models.Index(fields=['trigramme', 'nature', 'nom'], name='trigramme_nom_idx'),
+        ]
+
+    trigramme = models.CharField(max_length=3, help_text="Trigramme du nom normalise")
+    nature = models.CharField(max_length=12, choices=NatureNom.choices, help_text="Origine du nom")
+    nom = models.ForeignKey('NomRecherche', on_delete=models.DO_NOTHING, related_name='trigrammes')
+
+
 class TypePiece(BaseModel):
     class Meta:
         abstract = False
@@ -342,6 +616,8 @@ class Utilisateur(AbstractUser):
     statut = models.CharField(name='statut', max_length=6, choices=StatutObjet.choices, null=False, blank=False)
 
     user_pays = models.ForeignKey('Pays', null=True, help_text="Pays de l'utilisateur", on_delete=models.DO_NOTHING)
+    profil = models.ForeignKey('Profil', null=True, help_text="Profil de l'utilisateur", on_delete=models.DO_NOTHING,
+                               related_name='utilisateurs')
 
     user_creator = models.ForeignKey('Utilisateur', null=True, on_delete=models.DO_NOTHING,
                                      related_name='user_create')
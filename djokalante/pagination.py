@@ -0,0 +1,215 @@
+import base64
+import datetime
+import json
+from functools import reduce
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections
+from django.db.models import DateTimeField, Max, Min, Q
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+
+CURSEUR_VAR = 'apres'
+
+
+class CurseurInvalide(ValueError):
+    pass
+
+
+class PageCurseur:
+    def __init__(self, object_list, suivant):
+        self.object_list = object_list
+        self.suivant = suivant
+
+    def has_next(self):
+        return self.suivant is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Pagination par curseur sur une cle ordonnee et indexee, par exemple ('-send_date', '-id').
+
+    La page suivante est lue avec un WHERE sur les valeurs de la derniere ligne de la page courante au lieu d'un
+    OFFSET : la page N coute autant que la premiere. La derniere cle doit etre unique (en general l'id).
+    """
+
+    def __init__(self, queryset, cles=('-id',), par_page=50):
+        self.queryset = queryset
+        self.cles = [(cle.lstrip('-'), cle.startswith('-')) for cle in cles]
+        self.par_page = par_page
+
+    def _champ(self, nom):
+        return self.queryset.model._meta.pk if nom == 'pk' else self.queryset.model._meta.get_field(nom)
+
+    def encoder(self, objet):
+        valeurs = []
+        for nom, _ in self.cles:
+            valeur = objet[nom] if isinstance(objet, dict) else getattr(objet, self._champ(nom).attname)
+            valeurs.append(valeur.isoformat() if hasattr(valeur, 'isoformat') else str(valeur))
+        return base64.urlsafe_b64encode(json.dumps(valeurs).encode()).decode().rstrip('=')
+
+    def decoder(self, curseur):
+        try:
+            brut = json.loads(base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)))
+            if not isinstance(brut, list) or len(brut) != len(self.cles):
+                raise ValueError
+            return [self._champ(nom).to_python(valeur) for (nom, _), valeur in zip(self.cles, brut)]
+        except (ValueError, TypeError, ValidationError):
+            raise CurseurInvalide(curseur) from None
+
+    def filtrer(self, curseur=None):
+        queryset = self.queryset.order_by(*(f"-{nom}" if desc else nom for nom, desc in self.cles))
+        if not curseur:
+            return queryset
+        valeurs = self.decoder(curseur)
+        # (a, b) apres (va, vb) : a apres va, ou a = va et b apres vb
+        conditions = []
+        for rang, (nom, desc) in enumerate(self.cles):
+            egalites = {cle: valeur for (cle, _), valeur in zip(self.cles[:rang], valeurs)}
+            conditions.append(Q(**egalites, **{f"{nom}__{'lt' if desc else 'gt'}": valeurs[rang]}))
+        return queryset.filter(reduce(lambda gauche, droite: gauche | droite, conditions))
+
+    def _page(self, lignes):
+        if len(lignes) > self.par_page:
+            lignes = lignes[:self.par_page]
+            return PageCurseur(lignes, self.encoder(lignes[-1]))
+        return PageCurseur(lignes, None)
+
+    def page(self, curseur=None):
+        return self._page(list(self.filtrer(curseur)[:self.par_page + 1]))
+
+    async def apage(self, curseur=None):
+        return self._page([objet async for objet in self.filtrer(curseur)[:self.par_page + 1]])
+
+
+# Nombre de lignes d'une table d'apres les statistiques du moteur, sans parcourir la table
+ESTIMATIONS = {
+    'mysql': "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+    # Premier entier de stat : nombre de lignes lors du dernier ANALYZE
+    'sqlite': "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+}
+
+
+def estimer_lignes(modele, alias):
+    """Nombre approche de lignes de la table du modele, ou None si le moteur n'en tient pas."""
+    connexion = connections[alias]
+    requete = ESTIMATIONS.get(connexion.vendor)
+    if requete is None:
+        return None
+    try:
+        with connexion.cursor() as curseur:
+            curseur.execute(requete, [modele._meta.db_table])
+            ligne = curseur.fetchone()
+    except DatabaseError:
+        # sqlite_stat1 n'existe qu'apres un premier ANALYZE
+        return None
+    if ligne is None or ligne[0] is None:
+        return None
+    return int(str(ligne[0]).split()[0])
+
+
+class KeysetChangeList(ChangeList):
+    """Liste de l'admin paginee par curseur (?apres=...) : ni COUNT(*) ni OFFSET."""
+
+    def __init__(self, request, *args, **kwargs):
+        self.curseur = request.GET.get(CURSEUR_VAR)
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSEUR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        paginator = KeysetPaginator(self.queryset, self.model_admin.cles_pagination, self.list_per_page)
+        try:
+            page = paginator.page(self.curseur)
+        except CurseurInvalide:
+            raise IncorrectLookupParameters
+        self.result_list = page.object_list
+        self.result_count = len(page)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = paginator
+        self.lien_suivant = self.get_query_string({CURSEUR_VAR: page.suivant}) if page.has_next() else None
+        self.lien_premiere_page = self.get_query_string(remove=[CURSEUR_VAR]) if self.curseur else None
+        # Total estime de la liste non filtree seulement : un filtre demanderait un COUNT(*)
+        self.estimation = None
+        if self.model_admin.estimer_total and not self.query and not self.get_filters_params():
+            self.estimation = estimer_lignes(self.model, self.queryset.db)
+
+    def hierarchie_dates(self):
+        """
+        Contexte de admin/date_hierarchy.html sans les SELECT DISTINCT de l'admin : les annees, mois ou jours
+        proposes vont du Min au Max de la date dans la liste filtree, lus aux deux bouts de l'index de la date.
+        """
+        nom = self.date_hierarchy
+        annee, mois, jour = (self.params.get(f"{nom}__{partie}") for partie in ('year', 'month', 'day'))
+
+        def lien(filtres):
+            return self.get_query_string(filtres, [f"{nom}__", CURSEUR_VAR])
+
+        if annee and mois and jour:
+            date = datetime.date(int(annee), int(mois), int(jour))
+            return {
+                'show': True,
+                'back': {'link': lien({f"{nom}__year": annee, f"{nom}__month": mois}),
+                         'title': capfirst(formats.date_format(date, 'YEAR_MONTH_FORMAT'))},
+                'choices': [{'title': capfirst(formats.date_format(date, 'MONTH_DAY_FORMAT'))}],
+            }
+        bornes = self.queryset.aggregate(premiere=Min(nom), derniere=Max(nom))
+        premiere, derniere = bornes['premiere'], bornes['derniere']
+        if premiere is None:
+            return {'show': False}
+        if isinstance(get_fields_from_path(self.model, nom)[-1], DateTimeField):
+            premiere, derniere = (timezone.localtime(valeur) if timezone.is_aware(valeur) else valeur
+                                  for valeur in (premiere, derniere))
+        # Comme l'admin : une seule annee ou un seul mois dans la liste ouvre directement le niveau suivant
+        if not annee and premiere.year == derniere.year:
+            annee = premiere.year
+            if premiere.month == derniere.month:
+                mois = premiere.month
+        if annee and mois:
+            jours = [datetime.date(int(annee), int(mois), numero) for numero in range(premiere.day, derniere.day + 1)]
+            return {
+                'show': True,
+                'back': {'link': lien({f"{nom}__year": annee}), 'title': str(annee)},
+                'choices': [{'link': lien({f"{nom}__year": annee, f"{nom}__month": mois, f"{nom}__day": date.day}),
+                             'title': capfirst(formats.date_format(date, 'MONTH_DAY_FORMAT'))} for date in jours],
+            }
+        if annee:
+            debuts = [datetime.date(int(annee), numero, 1) for numero in range(premiere.month, derniere.month + 1)]
+            return {
+                'show': True,
+                'back': {'link': lien({}), 'title': "Toutes les dates"},
+                'choices': [{'link': lien({f"{nom}__year": annee, f"{nom}__month": date.month}),
+                             'title': capfirst(formats.date_format(date, 'YEAR_MONTH_FORMAT'))} for date in debuts],
+            }
+        return {
+            'show': True,
+            'choices': [{'link': lien({f"{nom}__year": numero}), 'title': str(numero)}
+                        for numero in range(premiere.year, derniere.year + 1)],
+        }
+
+
+class KeysetAdminMixin:
+    cles_pagination = ('-id',)
+    estimer_total = False
+    change_list_template = 'admin/change_list_keyset.html'
+    show_full_result_count = False
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
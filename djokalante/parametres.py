@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+
+from djokalante.estampille import CacheLocal, valeur_cache
+from djokalante.models import ParametreApplication, lignes_supprimees
+
+
+@dataclass(frozen=True)
+class Parametres:
+    id: int
+    name: str
+    version_number: str
+    licence: str
+    seuil_solde: Decimal
+    opeartor_part: Decimal
+    expeditor_part: Decimal
+    payer_part: Decimal
+    plafond_journalier: Decimal
+    duree_validite_code: Decimal
+
+
+class ParametresCache(CacheLocal):
+    """
+    Copie immuable des parametres d'application, chargee une fois par worker.
+
+    La lecture de parametres.courant est une simple recherche d'attribut une fois la copie chargee. Un
+    enregistrement de ParametreApplication incremente l'estampille partagee : chaque worker la compare au debut
+    de ses requetes et recharge sa copie au besoin.
+    """
+
+    nom = 'parametres'
+    caches = ('courant',)
+
+    @valeur_cache
+    def courant(self):
+        ligne = (ParametreApplication.objects.order_by('-pk')
+                 .values('id', 'name', 'version_number', 'licence', 'seuil_solde', 'opeartor_part',
+                         'expeditor_part', 'payer_part', 'plafond_journalier', 'duree_validite_code').first())
+        return Parametres(**ligne) if ligne else None
+
+
+parametres = ParametresCache()
+
+request_started.connect(parametres.verifier, dispatch_uid='parametres_verifier')
+post_save.connect(parametres.publier, sender=ParametreApplication, dispatch_uid='parametres_publier_save')
+post_delete.connect(parametres.publier, sender=ParametreApplication, dispatch_uid='parametres_publier_delete')
+lignes_supprimees.connect(parametres.publier, sender=ParametreApplication,
+                          dispatch_uid='parametres_publier_suppression')
@@ -0,0 +1,73 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.utils import timezone
+
+from djokalante.referentiel import referentiel
+
+
+class IndexPromotions:
+    """
+    Meilleure promotion de chaque jour, precalculee par intervalles.
+
+    Les dates de debut et de lendemain de fin decoupent le calendrier en intervalles sur lesquels les promotions
+    en cours ne changent pas ; on garde pour chacun la promotion au plus fort pourcentage (a egalite, la plus
+    ancienne). Trouver la promotion d'un jour est alors une recherche dichotomique.
+    """
+
+    def __init__(self, promotions):
+        promotions = [promotion for promotion in promotions if promotion.date_debut <= promotion.date_fin]
+        self.bornes = sorted({promotion.date_debut for promotion in promotions}
+                             | {promotion.date_fin + timedelta(days=1) for promotion in promotions})
+        self.meilleures = []
+        for debut in self.bornes:
+            en_cours = [promotion for promotion in promotions if promotion.date_debut <= debut <= promotion.date_fin]
+            self.meilleures.append(max(en_cours, key=lambda promotion: (promotion.porcentage, -promotion.id),
+                                       default=None))
+
+    def _rang(self, jour):
+        return bisect_right(self.bornes, jour) - 1
+
+    def meilleure(self, jour):
+        rang = self._rang(jour)
+        return self.meilleures[rang] if rang >= 0 else None
+
+    def attribuer(self, transferts, jour=None):
+        """
+        Renseigne propotion_id sur chaque transfert d'apres sa date d'envoi (ou jour) et retourne la liste.
+
+        Les transferts sont parcourus par date croissante en avancant dans les intervalles : une seule passe,
+        sans recherche par transfert.
+        """
+        aujourdhui = jour or timezone.now().date()
+        tries = sorted(transferts, key=lambda transfert: transfert.send_date or aujourdhui)
+        rang = -1
+        for transfert in tries:
+            date_envoi = transfert.send_date or aujourdhui
+            while rang + 1 < len(self.bornes) and self.bornes[rang + 1] <= date_envoi:
+                rang += 1
+            promotion = self.meilleures[rang] if rang >= 0 else None
+            transfert.propotion_id = promotion.id if promotion else None
+        return transferts
+
+
+_index = (None, None)
+
+
+def index():
+    """Index des promotions, reconstruit quand la table du referentiel est rechargee."""
+    global _index
+    table, courant = _index
+    promotions = referentiel.promotions
+    if table is not promotions:
+        courant = IndexPromotions(promotions)
+        _index = (promotions, courant)
+    return courant
+
+
+def meilleure_promotion(jour=None):
+    return index().meilleure(jour or timezone.now().date())
+
+
+def attribuer_promotions(transferts, jour=None):
+    return index().attribuer(transferts, jour)
@@ -0,0 +1,174 @@
+import csv
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from djokalante.fichiers import montant_max, ouvrir
+from djokalante.models import EtatImport, EtatRapprochement, EtatTransfert, LigneReleve, ReleveBancaire, Transfert
+
+Rapprochement = namedtuple('Rapprochement', ['transfert_id', 'etat', 'ecart_montant', 'ecart_jours'])
+MONTANT_MAX = montant_max(LigneReleve)
+
+
+class RapprochementError(Exception):
+    pass
+
+
+def lire_releve(flux, delimiteur=';', entete=True):
+    """Genere les lignes du releve : (numero_ligne, date_brute, montant_brut, reference, libelle)."""
+    lecteur = csv.reader(flux, delimiter=delimiteur)
+    if entete:
+        next(lecteur, None)
+    for numero, ligne in enumerate(lecteur, start=1):
+        if not ligne or not any(champ.strip() for champ in ligne):
+            continue
+        champs = [champ.strip() for champ in ligne] + [""] * (4 - len(ligne))
+        yield numero, champs[0], champs[1], champs[2], champs[3]
+
+
+def _lire_date(brute):
+    for format_ in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(brute, format_).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _lire_montant(brut):
+    try:
+        montant = Decimal(brut.replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    # Au-dela de MONTANT_MAX, LigneReleve.montant ne peut pas l'enregistrer : la ligne est rejetee
+    return montant.quantize(Decimal('0.01')) if montant.is_finite() and 0 < montant < MONTANT_MAX else None
+
+
+class IndexTransferts:
+    """
+    Transferts d'une fenetre de dates, indexes en memoire pour rapprocher un releve en une passe.
+
+    Trois index : numero d'operation, couple (montant, jour), et la liste triee des montants pour les
+    recherches avec tolerance (bisect). Un transfert n'est rapproche qu'une fois.
+    """
+
+    def __init__(self, transferts, deja_rapproches=()):
+        self.details = {}
+        self.par_numero = {}
+        self.par_montant_jour = defaultdict(list)
+        for pk, numero, montant, jour in transferts:
+            self.details[pk] = (montant, jour)
+            self.par_numero[numero] = pk
+            self.par_montant_jour[montant, jour].append(pk)
+        tries = sorted((montant, pk) for pk, (montant, _) in self.details.items())
+        self.montants = [montant for montant, _ in tries]
+        self.ids = [pk for _, pk in tries]
+        self.utilises = set(deja_rapproches)
+
+    def _resultat(self, pk, etat, montant, jour):
+        self.utilises.add(pk)
+        montant_transfert, jour_transfert = self.details[pk]
+        return Rapprochement(pk, etat, montant - montant_transfert, (jour - jour_transfert).days)
+
+    def rapprocher(self, montant, jour, reference="", tolerance_montant=Decimal('0'), tolerance_jours=0):
+        pk = self.par_numero.get(reference)
+        if pk is not None and pk not in self.utilises:
+            return self._resultat(pk, EtatRapprochement.REFERENCE, montant, jour)
+
+        # Meme montant, jour le plus proche d'abord
+        for decalage in range(tolerance_jours + 1):
+            for sens in ((0,) if decalage == 0 else (-decalage, decalage)):
+                for pk in self.par_montant_jour.get((montant, jour - timedelta(days=sens)), ()):
+                    if pk not in self.utilises:
+                        return self._resultat(pk, EtatRapprochement.MONTANT_DATE, montant, jour)
+
+        if not tolerance_montant:
+            return None
+        meilleur = None
+        for rang in range(bisect_left(self.montants, montant - tolerance_montant),
+                          bisect_right(self.montants, montant + tolerance_montant)):
+            pk = self.ids[rang]
+            if pk in self.utilises:
+                continue
+            ecart_jours = abs((jour - self.details[pk][1]).days)
+            if ecart_jours > tolerance_jours:
+                continue
+            score = (abs(montant - self.montants[rang]), ecart_jours, pk)
+            if meilleur is None or score < meilleur:
+                meilleur = score
+        return None if meilleur is None else self._resultat(meilleur[2], EtatRapprochement.APPROCHE, montant, jour)
+
+
+def charger_index(debut, fin, tolerance_jours, releve=None):
+    """
+    Charge les transferts non annules envoyes entre debut et fin, elargis de la tolerance, en ecartant ceux deja
+    rapproches par un autre releve.
+    """
+    debut, fin = debut - timedelta(days=tolerance_jours), fin + timedelta(days=tolerance_jours)
+    transferts = Transfert.objects.filter(send_date__gte=debut, send_date__lte=fin) \
+        .exclude(state=EtatTransfert.ANNULE).order_by().values_list('pk', 'operation_number', 'account', 'send_date')
+    deja_rapproches = LigneReleve.objects.filter(transfert__send_date__gte=debut, transfert__send_date__lte=fin) \
+        .exclude(releve=releve).values_list('transfert_id', flat=True)
+    return IndexTransferts(transferts.iterator(chunk_size=5000), deja_rapproches)
+
+
+def rapprocher_releve(releve, fichier, tolerance_montant=Decimal('0'), tolerance_jours=2, delimiteur=';',
+                      entete=True, encodage='utf-8-sig'):
+    """
+    Rapproche un releve bancaire des transferts et enregistre le resultat de chaque ligne.
+
+    Les transferts de la periode du releve sont lus en une requete ; les lignes sont ensuite rapprochees en
+    memoire, par numero d'operation, puis montant et date, puis montant approche, et enregistrees par
+    bulk_create. En cas d'erreur, le releve passe a l'etat echec avec sa cause.
+    """
+    if releve.etat == EtatImport.TERMINE:
+        raise RapprochementError(f"Le releve {releve.file_name} est deja rapproche")
+
+    try:
+        _rapprocher(releve, fichier, tolerance_montant, tolerance_jours, delimiteur, entete, encodage)
+    except Exception as erreur:
+        ReleveBancaire.objects.filter(pk=releve.pk).update(
+            etat=EtatImport.ECHEC, message_erreur=str(erreur), date_modification=timezone.now())
+        raise
+    return releve
+
+
+def _rapprocher(releve, fichier, tolerance_montant, tolerance_jours, delimiteur, entete, encodage):
+    lignes = []
+    with ouvrir(fichier, encodage) as flux:
+        for numero, date_brute, montant_brut, reference, libelle in lire_releve(flux, delimiteur, entete):
+            ligne = LigneReleve(releve=releve, numero_ligne=numero, date_operation=_lire_date(date_brute),
+                                montant=_lire_montant(montant_brut), reference=reference[:100], libelle=libelle[:200],
+                                etat=EtatRapprochement.NON_RAPPROCHEE)
+            if ligne.date_operation is None:
+                ligne.etat, ligne.motif_rejet = EtatRapprochement.REJETEE, f"Date invalide : {date_brute[:50]}"
+            elif ligne.montant is None:
+                ligne.etat, ligne.motif_rejet = EtatRapprochement.REJETEE, f"Montant invalide : {montant_brut[:50]}"
+            lignes.append(ligne)
+
+    valides = [ligne for ligne in lignes if ligne.etat != EtatRapprochement.REJETEE]
+    if valides:
+        index = charger_index(min(ligne.date_operation for ligne in valides),
+                              max(ligne.date_operation for ligne in valides), tolerance_jours, releve)
+        for ligne in valides:
+            resultat = index.rapprocher(ligne.montant, ligne.date_operation, ligne.reference, tolerance_montant,
+                                        tolerance_jours)
+            if resultat is not None:
+                ligne.transfert_id, ligne.etat, ligne.ecart_montant, ligne.ecart_jours = resultat
+
+    with transaction.atomic():
+        LigneReleve.objects.filter(releve=releve).delete()
+        LigneReleve.objects.bulk_create(lignes, batch_size=1000)
+        releve.etat = EtatImport.TERMINE
+        releve.lignes_traitees = len(lignes)
+        releve.lignes_rapprochees = sum(1 for ligne in lignes if ligne.transfert_id)
+        releve.lignes_rejetees = len(lignes) - len(valides)
+        releve.message_erreur = ""
+        releve.date_modification = timezone.now()
+        ReleveBancaire.objects.filter(pk=releve.pk).update(
+            etat=releve.etat, lignes_traitees=releve.lignes_traitees, lignes_rapprochees=releve.lignes_rapprochees,
+            lignes_rejetees=releve.lignes_rejetees, message_erreur="", date_modification=releve.date_modification)
@@ -0,0 +1,245 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, namedtuple
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from djokalante.models import Compte, NatureNom, NomRecherche, StatutObjet, Transfert, TrigrammeNom, lignes_supprimees
+
+# Noms indexes par nature : champs (prenom, nom) du modele d'origine
+SOURCES = {
+    NatureNom.EXPEDITEUR: (Transfert, ('expeditor_first_name', 'expeditor_last_name')),
+    NatureNom.BENEFICIAIRE: (Transfert, ('beneficiaire_first_name', 'beneficiaire_last_name')),
+    NatureNom.COMPTE: (Compte, ('first_name', 'last_name')),
+}
+# Graphies equivalentes des noms francais et wolof, appliquees apres retrait des accents
+EQUIVALENCES = [
+    (re.compile(r'ou'), 'u'),
+    (re.compile(r'dj'), 'j'),
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'y'), 'i'),
+    (re.compile(r'([a-z])\1+'), r'\1'),
+]
+SEPARATEURS = re.compile(r'[^a-z0-9]+')
+# Apostrophes droite et typographique (U+2019, saisie des claviers mobiles) : N'Diaye et N’Diaye donnent ndiaie
+APOSTROPHES = str.maketrans('', '', "'\u2019")
+
+# Recherche : trigrammes lus par nature, entrees lues au plus par trigramme, candidats notes, duree des frequences,
+# pages de LISTE_MAX entrees lues au plus par l'intersection des trigrammes d'un nom tres courant
+TRIGRAMMES_LUS = 6
+LISTE_MAX = 1000
+CANDIDATS = 200
+DUREE_FREQUENCES_S = 3600
+PAGES_INTERSECTION = 100
+
+Resultat = namedtuple('Resultat', ['nature', 'objet_id', 'texte', 'score'])
+
+
+def normaliser(texte):
+    """Minuscules sans accents, graphies rapprochees (Ndiaye et N'Diaye donnent ndiaie), un espace entre mots."""
+    texte = unicodedata.normalize('NFKD', (texte or '').lower().replace('ŋ', 'ng'))
+    texte = ''.join(caractere for caractere in texte if not unicodedata.combining(caractere))
+    texte = SEPARATEURS.sub(' ', texte.translate(APOSTROPHES)).strip()
+    for motif, remplacement in EQUIVALENCES:
+        texte = motif.sub(remplacement, texte)
+    return texte
+
+
+def trigrammes(texte):
+    """Trigrammes d'un texte normalise, chaque mot borde de deux espaces devant et d'un derriere (comme pg_trgm)."""
+    resultat = set()
+    for mot in texte.split():
+        borde = f"  {mot} "
+        resultat.update(borde[rang:rang + 3] for rang in range(len(borde) - 2))
+    return resultat
+
+
+def texte_de(instance, nature):
+    return normaliser(' '.join(getattr(instance, champ) or '' for champ in SOURCES[nature][1]))[:120]
+
+
+# Index
+
+def indexer(instances, nature, cree=False):
+    """
+    Met a jour les noms de nature des instances et leurs trigrammes. Seuls les noms dont le texte normalise a
+    change sont reecrits ; cree evite la lecture des noms existants pour des instances nouvelles.
+    """
+    textes = {instance.pk: texte_de(instance, nature) for instance in instances}
+    existants = {} if cree else {nom.objet_id: nom for nom in
+                                 NomRecherche.objects.filter(nature=nature, objet_id__in=list(textes))}
+    modifies = [nom for nom in existants.values() if nom.texte != textes[nom.objet_id]]
+    with transaction.atomic():
+        if modifies:
+            TrigrammeNom.objects.filter(nom__in=modifies).delete()
+            for nom in modifies:
+                nom.texte = textes[nom.objet_id]
+            NomRecherche.objects.bulk_update(modifies, ['texte'], batch_size=1000)
+        nouveaux = NomRecherche.objects.bulk_create(
+            [NomRecherche(nature=nature, objet_id=pk, texte=texte) for pk, texte in textes.items()
+             if pk not in existants], batch_size=1000)
+        # Les cles des noms crees ne reviennent pas de bulk_create avec MySQL : relecture par objet
+        if nouveaux and nouveaux[0].pk is None:
+            nouveaux = list(NomRecherche.objects.filter(nature=nature,
+                                                        objet_id__in=[nom.objet_id for nom in nouveaux]))
+        TrigrammeNom.objects.bulk_create(
+            [TrigrammeNom(trigramme=trigramme, nature=nature, nom=nom)
+             for nom in [*modifies, *nouveaux] for trigramme in trigrammes(nom.texte)], batch_size=5000)
+
+
+def retirer(pks, nature):
+    noms = NomRecherche.objects.filter(nature=nature, objet_id__in=list(pks))
+    with transaction.atomic():
+        TrigrammeNom.objects.filter(nom__in=noms).delete()
+        noms.delete()
+
+
+def _natures(modele):
+    return [nature for nature, (source, _) in SOURCES.items() if source is modele]
+
+
+def _apres_enregistrement(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if instance.statut == StatutObjet.DELETE:
+        _apres_suppression(sender, instance)
+        return
+    for nature in _natures(sender):
+        if update_fields is not None and not set(SOURCES[nature][1]) & set(update_fields):
+            continue
+        indexer([instance], nature, cree=created)
+
+
+def _apres_suppression(sender, instance, **kwargs):
+    for nature in _natures(sender):
+        retirer([instance.pk], nature)
+
+
+def _apres_suppression_logique(sender, pks, **kwargs):
+    for nature in _natures(sender):
+        retirer(pks, nature)
+
+
+for _modele in (Transfert, Compte):
+    post_save.connect(_apres_enregistrement, sender=_modele, dispatch_uid=f'recherche_{_modele.__name__}')
+    post_delete.connect(_apres_suppression, sender=_modele, dispatch_uid=f'recherche_suppression_{_modele.__name__}')
+    lignes_supprimees.connect(_apres_suppression_logique, sender=_modele,
+                              dispatch_uid=f'recherche_suppression_logique_{_modele.__name__}')
+
+
+# Recherche
+
+class Frequences:
+    """
+    Nombre de noms par trigramme et nature, borne a LISTE_MAX et garde DUREE_FREQUENCES_S secondes par worker :
+    sert a choisir les trigrammes les plus discriminants d'une recherche.
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._valeurs = {}
+
+    def lire(self, trigramme, nature):
+        cle = (trigramme, nature)
+        valeur = self._valeurs.get(cle)
+        if valeur is not None and time.monotonic() < valeur[1]:
+            return valeur[0]
+        # Comptage borne : parcours d'une plage de l'index trigramme_nom_idx arrete a LISTE_MAX entrees
+        nombre = TrigrammeNom.objects.filter(trigramme=trigramme, nature=nature).values('nom_id')[:LISTE_MAX].count()
+        with self._verrou:
+            self._valeurs[cle] = (nombre, time.monotonic() + DUREE_FREQUENCES_S)
+        return nombre
+
+
+frequences = Frequences()
+
+
+def _intersection(lus, nature):
+    """
+    Noms de nature qui ont tous les trigrammes lus, des plus recents aux plus anciens : la liste du premier est
+    parcourue par pages de LISTE_MAX entrees, chaque page filtree par les listes des autres sur l'index.
+    """
+    premier, *autres = lus
+    complets = []
+    dernier = None
+    for _ in range(PAGES_INTERSECTION):
+        page = TrigrammeNom.objects.filter(trigramme=premier, nature=nature)
+        if dernier is not None:
+            page = page.filter(nom_id__lt=dernier)
+        page = list(page.order_by('-nom_id').values_list('nom_id', flat=True)[:LISTE_MAX])
+        if not page:
+            break
+        dernier = page[-1]
+        restants = set(page)
+        for trigramme in autres:
+            if not restants:
+                break
+            restants = set(TrigrammeNom.objects.filter(trigramme=trigramme, nature=nature, nom_id__in=restants)
+                           .values_list('nom_id', flat=True))
+        complets.extend(sorted(restants, reverse=True))
+        if len(complets) >= CANDIDATS:
+            break
+    return complets[:CANDIDATS]
+
+
+def _candidats(requete, nature):
+    """
+    Noms de nature partageant le plus de trigrammes avec la requete, parmi les listes de ses TRIGRAMMES_LUS
+    trigrammes les plus rares. Chaque liste est lue par l'index, des noms les plus recents aux plus anciens, et
+    arretee a LISTE_MAX : une recherche sur un nom tres courant ne parcourt pas toute la table. Quand toutes les
+    listes lues sont tronquees, les noms anciens qui ont tous ces trigrammes viennent de leur intersection.
+    """
+    rares = sorted((frequences.lire(trigramme, nature), trigramme) for trigramme in requete)
+    lus = [(nombre, trigramme) for nombre, trigramme in rares[:TRIGRAMMES_LUS] if nombre]
+    complets = []
+    if lus and all(nombre >= LISTE_MAX for nombre, _ in lus):
+        complets = _intersection([trigramme for _, trigramme in lus], nature)
+    communs = Counter()
+    if len(complets) < CANDIDATS:
+        for _, trigramme in lus:
+            communs.update(TrigrammeNom.objects.filter(trigramme=trigramme, nature=nature).order_by('-nom_id')
+                           .values_list('nom_id', flat=True)[:LISTE_MAX])
+    deja = set(complets)
+    return [*complets, *(nom_id for nom_id, _ in communs.most_common(CANDIDATS) if nom_id not in deja)][:CANDIDATS]
+
+
+def rechercher(texte, natures=None, limite=20, seuil=0.3):
+    """
+    Noms les plus proches de texte, meilleurs d'abord.
+
+    Le score est la part des trigrammes de la recherche presents dans le nom, departagee par la similarite de
+    Jaccard : un debut de nom ("ndi") remonte les noms qui le contiennent, une faute d'orthographe ne fait perdre
+    que les trigrammes qui la touchent.
+    """
+    requete = trigrammes(normaliser(texte))
+    if not requete:
+        return []
+    candidats = [nom_id for nature in sorted(natures or SOURCES) for nom_id in _candidats(requete, nature)]
+    resultats = []
+    for nom in NomRecherche.objects.filter(pk__in=candidats):
+        trigrammes_nom = trigrammes(nom.texte)
+        communs = len(requete & trigrammes_nom)
+        couverture = communs / len(requete)
+        if couverture >= seuil:
+            jaccard = communs / len(requete | trigrammes_nom)
+            resultats.append(Resultat(nom.nature, nom.objet_id, nom.texte, round(couverture * 0.7 + jaccard * 0.3, 4)))
+    resultats.sort(key=lambda resultat: (-resultat.score, resultat.texte, resultat.objet_id))
+    return resultats[:limite]
+
+
+def reconstruire(nature, taille_lot=5000, sortie=None):
+    """Indexe tous les noms d'une nature par lots de cles primaires et retourne le nombre d'objets lus."""
+    modele, champs = SOURCES[nature]
+    total, dernier = 0, 0
+    while True:
+        lot = list(modele.objects.filter(pk__gt=dernier).order_by('pk').only('pk', *champs)[:taille_lot])
+        if not lot:
+            return total
+        indexer(lot, nature)
+        total += len(lot)
+        dernier = lot[-1].pk
+        if sortie is not None:
+            sortie(f"{nature} : {total} noms")
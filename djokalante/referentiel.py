@@ -0,0 +1,134 @@
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from djokalante.estampille import CacheLocal, valeur_cache
+from djokalante.models import Devise, Motif, Pays, Promotion, TypePiece, lignes_supprimees
+
+
+class Table:
+    """Lignes d'une table de reference, indexees par id et, si la table en a un, par code."""
+
+    def __init__(self, lignes, libelle, code=None):
+        self.lignes = tuple(lignes)
+        self.par_id = {ligne.id: ligne for ligne in self.lignes}
+        self.par_code = {getattr(ligne, code): ligne for ligne in self.lignes} if code else {}
+        self.libelle = libelle
+
+    def __iter__(self):
+        return iter(self.lignes)
+
+    def __len__(self):
+        return len(self.lignes)
+
+    def get(self, pk):
+        return self.par_id.get(pk)
+
+    def code(self, code):
+        return self.par_code.get(code)
+
+    def choix(self):
+        """Choix d'un ChoiceField : (id, libelle), dans l'ordre de la table."""
+        return [(ligne.id, getattr(ligne, self.libelle)) for ligne in self.lignes]
+
+
+class CacheReference(CacheLocal):
+    """
+    Copie d'une table de reference propre au worker, rechargee quand l'estampille de la table change.
+
+    Avec KHALISS_REFERENTIEL_PARTAGE, le premier worker qui recharge une version ecrit la table dans un fichier
+    local a cote de l'estampille ; les autres workers de la machine le lisent au lieu d'interroger la base.
+    """
+
+    caches = ('table',)
+
+    def __init__(self, nom, modele, champs, libelle, code=None):
+        self.nom = f"referentiel-{nom}"
+        self.modele = modele
+        self.champs = champs
+        self.ligne = namedtuple(modele.__name__, champs)
+        self.libelle = libelle
+        self.code = code
+        super().__init__()
+
+    def _fichier(self, version):
+        return Path(settings.KHALISS_ESTAMPILLES_DIR) / f"{self.nom}-{version}.json"
+
+    def _lire_base(self):
+        return list(self.modele.objects.values_list(*self.champs))
+
+    def _lire_partage(self):
+        if transaction.get_connection().in_atomic_block:
+            # La transaction peut avoir modifie la table (publier a vide le cache) : ses lignes non validees ne
+            # vont pas dans le fichier partage sous l'ancienne version, et le fichier n'est pas a jour pour elle
+            return self._lire_base()
+        version = self.version
+        fichier = self._fichier(version)
+        try:
+            brutes = json.loads(fichier.read_text(encoding='utf-8'))
+            champs = [self.modele._meta.get_field(champ) for champ in self.champs]
+            return [[champ.to_python(valeur) for champ, valeur in zip(champs, brute)] for brute in brutes]
+        except (FileNotFoundError, ValueError):
+            pass
+        valeurs = self._lire_base()
+        fichier.parent.mkdir(parents=True, exist_ok=True)
+        temporaire = fichier.with_name(f"{fichier.name}.{os.getpid()}")
+        temporaire.write_text(json.dumps(valeurs, cls=DjangoJSONEncoder), encoding='utf-8')
+        os.replace(temporaire, fichier)
+        for ancien in fichier.parent.glob(f"{self.nom}-*.json"):
+            if ancien != fichier:
+                ancien.unlink(missing_ok=True)
+        return valeurs
+
+    @valeur_cache
+    def table(self):
+        partage = getattr(settings, 'KHALISS_REFERENTIEL_PARTAGE', False)
+        valeurs = self._lire_partage() if partage else self._lire_base()
+        return Table((self.ligne(*ligne) for ligne in valeurs), self.libelle, self.code)
+
+
+class Referentiel:
+    """
+    Tables de reference (pays, devises, types de piece, motifs, promotions) servies sans requete.
+
+    referentiel.pays.get(pk), referentiel.devises.code('XOF'), referentiel.types_piece.choix()...
+    """
+
+    def __init__(self):
+        self.caches = {
+            'pays': CacheReference('pays', Pays, ('id', 'name', 'code', 'devise_pays_id'), 'name', 'code'),
+            'devises': CacheReference('devises', Devise, ('id', 'name', 'code'), 'name', 'code'),
+            'types_piece': CacheReference('types_piece', TypePiece, ('id', 'name'), 'name'),
+            'motifs': CacheReference('motifs', Motif, ('id', 'libelle'), 'libelle'),
+            'promotions': CacheReference('promotions', Promotion,
+                                         ('id', 'libelle', 'date_debut', 'date_fin', 'porcentage'), 'libelle'),
+        }
+
+    def __getattr__(self, nom):
+        try:
+            return self.__dict__['caches'][nom].table
+        except KeyError:
+            raise AttributeError(nom) from None
+
+    def promotions_actives(self, jour):
+        return [promotion for promotion in self.promotions if promotion.date_debut <= jour <= promotion.date_fin]
+
+    def verifier(self, **kwargs):
+        for cache in self.caches.values():
+            cache.verifier()
+
+
+referentiel = Referentiel()
+
+request_started.connect(referentiel.verifier, dispatch_uid='referentiel_verifier')
+for _nom, _cache in referentiel.caches.items():
+    post_save.connect(_cache.publier, sender=_cache.modele, dispatch_uid=f'referentiel_{_nom}_save')
+    post_delete.connect(_cache.publier, sender=_cache.modele, dispatch_uid=f'referentiel_{_nom}_delete')
+    lignes_supprimees.connect(_cache.publier, sender=_cache.modele, dispatch_uid=f'referentiel_{_nom}_suppression')
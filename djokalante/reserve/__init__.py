@@ -0,0 +1,150 @@
+"""
+Reserve de connexions par processus pour les workers ASGI.
+
+Sous ASGI, chaque requete fait ses acces a la base dans son propre thread (ThreadSensitiveContext) : une connexion
+persistante (CONN_MAX_AGE) reste attachee a un thread qui ne sert plus, et chaque requete en ouvre une nouvelle.
+Les moteurs djokalante.reserve.mysql et djokalante.reserve.sqlite3 gardent a la place les connexions fermees par
+Django dans une reserve partagee par les threads du worker, et les redonnent a la requete suivante.
+
+Reglages dans l'entree 'RESERVE' de la base (DATABASES), avec CONN_MAX_AGE a 0 pour rendre la connexion a la
+reserve a la fin de chaque requete :
+
+    'RESERVE': {'taille': 10, 'attente_s': 5, 'verification_s': 30, 'duree_vie_s': 3600}
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+PARAMETRES_PAR_DEFAUT = {
+    # Connexions ouvertes au plus par worker ; au-dela, une requete attend qu'une connexion soit rendue
+    'taille': 10,
+    'attente_s': 5,
+    # Une connexion restee libre plus longtemps est verifiee (SELECT 1) avant d'etre redonnee
+    'verification_s': 30,
+    # Une connexion plus ancienne est fermee au retour, avant le wait_timeout du serveur
+    'duree_vie_s': 3600,
+}
+
+
+class Reserve:
+    """
+    Connexions DB-API ouvertes d'un alias. Un semaphore borne le nombre de connexions sorties ; les connexions
+    libres sont redonnees de la plus recemment rendue a la plus ancienne, pour que les autres expirent.
+    """
+
+    def __init__(self, alias, taille, attente_s, verification_s, duree_vie_s):
+        self.alias = alias
+        self.taille = taille
+        self.attente_s = attente_s
+        self.verification_s = verification_s
+        self.duree_vie_s = duree_vie_s
+        self._places = threading.BoundedSemaphore(taille)
+        self._verrou = threading.Lock()
+        self._libres = deque()
+        self._ouvertes = {}
+
+    def prendre(self, ouvrir, valide):
+        """Retourne (connexion, reprise) : une connexion libre encore valide, sinon une nouvelle (ouvrir())."""
+        if not self._places.acquire(timeout=self.attente_s):
+            raise OperationalError(f"Reserve de connexions '{self.alias}' epuisee ({self.taille} connexions)")
+        try:
+            while True:
+                with self._verrou:
+                    if not self._libres:
+                        break
+                    brute, rendue = self._libres.pop()
+                if time.monotonic() - rendue < self.verification_s or valide(brute):
+                    return brute, True
+                self._fermer(brute)
+            brute = ouvrir()
+            self._ouvertes[id(brute)] = time.monotonic()
+            return brute, False
+        except BaseException:
+            self._places.release()
+            raise
+
+    def rendre(self, brute, reutilisable=True):
+        try:
+            ouverte = self._ouvertes.get(id(brute), 0)
+            if reutilisable and time.monotonic() - ouverte < self.duree_vie_s:
+                with self._verrou:
+                    self._libres.append((brute, time.monotonic()))
+            else:
+                self._fermer(brute)
+        finally:
+            self._places.release()
+
+    def _fermer(self, brute):
+        self._ouvertes.pop(id(brute), None)
+        try:
+            brute.close()
+        except Exception:
+            pass
+
+    def vider(self):
+        with self._verrou:
+            libres, self._libres = list(self._libres), deque()
+        for brute, _ in libres:
+            self._fermer(brute)
+
+    def etat(self):
+        return {'ouvertes': len(self._ouvertes), 'libres': len(self._libres), 'taille': self.taille}
+
+
+_reserves = {}
+_verrou = threading.Lock()
+
+
+def reserve(alias, reglages=None):
+    """Reserve de l'alias pour le processus courant : un worker issu d'un fork ne reprend pas celle du parent."""
+    cle = (alias, os.getpid())
+    courante = _reserves.get(cle)
+    if courante is None:
+        with _verrou:
+            courante = _reserves.get(cle)
+            if courante is None:
+                courante = _reserves[cle] = Reserve(alias, **{**PARAMETRES_PAR_DEFAUT, **(reglages or {})})
+    return courante
+
+
+class ReserveMixin:
+    """
+    A placer avant le DatabaseWrapper d'un moteur Django : l'ouverture prend une connexion dans la reserve et la
+    fermeture l'y rend, sauf si la connexion a eu une erreur ou est restee au milieu d'une transaction.
+    """
+
+    _reprise = False
+
+    def _reserve(self):
+        return reserve(self.alias, self.settings_dict.get('RESERVE'))
+
+    def _brute_valide(self, brute):
+        try:
+            curseur = brute.cursor()
+            try:
+                curseur.execute('SELECT 1')
+            finally:
+                curseur.close()
+            return True
+        except self.Database.Error:
+            return False
+
+    def get_new_connection(self, conn_params):
+        brute, self._reprise = self._reserve().prendre(
+            lambda: super(ReserveMixin, self).get_new_connection(conn_params), self._brute_valide)
+        return brute
+
+    def init_connection_state(self):
+        # Les reglages de session d'une connexion reprise sont deja en place
+        if not self._reprise:
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        reutilisable = (not self.errors_occurred and not self.in_atomic_block
+                        and self.get_autocommit() == self.settings_dict['AUTOCOMMIT'])
+        self._reserve().rendre(self.connection, reutilisable)
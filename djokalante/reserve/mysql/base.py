@@ -0,0 +1,7 @@
+from django.db.backends.mysql import base
+
+from djokalante.reserve import ReserveMixin
+
+
+class DatabaseWrapper(ReserveMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,163 @@
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PARAMETRES_PAR_DEFAUT = {
+    'repliques': [],
+    'applications': ['djokalante'],
+    'chemins': [],
+    'epinglage_s': 5,
+    'verification_s': 10,
+}
+COOKIE_PRIMAIRE = 'khaliss_primaire'
+
+# Lectures de la requete (ou du bloc lecture_replique) autorisees sur une replique
+_lecture_replique = ContextVar('khaliss_lecture_replique', default=False)
+# La requete a ecrit : ses lectures suivantes restent sur la base principale
+_epingle = ContextVar('khaliss_epingle', default=False)
+
+
+def configuration():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'KHALISS_ROUTAGE', {})}
+
+
+class SanteRepliques:
+    """
+    Etat des repliques, verifie au plus toutes les verification_s secondes par alias.
+
+    Une replique dont la connexion echoue est ecartee jusqu'a la verification suivante ; sans replique
+    disponible, les lectures restent sur la base principale.
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._etats = {}
+        self._tour = itertools.count()
+
+    def _verifier(self, alias):
+        connexion = connections[alias]
+        try:
+            connexion.ensure_connection()
+            if connexion.is_usable():
+                return True
+        except DatabaseError:
+            pass
+        connexion.close()
+        return False
+
+    def disponible(self, alias):
+        maintenant = time.monotonic()
+        etat = self._etats.get(alias)
+        if etat is not None and maintenant - etat[1] < configuration()['verification_s']:
+            return etat[0]
+        with self._verrou:
+            etat = self._etats.get(alias)
+            if etat is None or maintenant - etat[1] >= configuration()['verification_s']:
+                etat = self._etats[alias] = (self._verifier(alias), maintenant)
+        return etat[0]
+
+    def choisir(self):
+        repliques = configuration()['repliques']
+        if not repliques:
+            return None
+        depart = next(self._tour)
+        for rang in range(len(repliques)):
+            alias = repliques[(depart + rang) % len(repliques)]
+            if self.disponible(alias):
+                return alias
+        return None
+
+    def etats(self):
+        return {alias: self.disponible(alias) for alias in configuration()['repliques']}
+
+
+sante = SanteRepliques()
+
+
+@contextmanager
+def lecture_replique():
+    """Autorise les lectures sur une replique dans le bloc (rapports, commandes de consultation)."""
+    jeton = _lecture_replique.set(True)
+    try:
+        yield
+    finally:
+        _lecture_replique.reset(jeton)
+
+
+def epingler():
+    _epingle.set(True)
+
+
+class RouteurRepliques:
+    """
+    Envoie les lectures autorisees (lecture_replique, chemins de KHALISS_ROUTAGE) des applications listees vers
+    une replique disponible, tout le reste vers la base principale. Une ecriture epingle le contexte courant
+    sur la base principale : la requete relit ce qu'elle vient d'ecrire.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _epingle.get() or not _lecture_replique.get():
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label not in configuration()['applications']:
+            return DEFAULT_DB_ALIAS
+        return sante.choisir() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        epingler()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Les repliques portent les memes donnees que la base principale
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in configuration()['repliques']
+
+
+class RoutageMiddleware:
+    """
+    Ouvre les lectures sur replique pour les GET des chemins de KHALISS_ROUTAGE['chemins'] (listes de l'admin,
+    listes JSON). Apres une ecriture, un cookie garde le client sur la base principale pendant epinglage_s
+    secondes, le temps que les repliques rattrapent leur retard.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.chemins = [re.compile(chemin) for chemin in configuration()['chemins']]
+        self.asynchrone = iscoroutinefunction(get_response)
+        if self.asynchrone:
+            # Marque l'instance comme coroutine pour le gestionnaire ASGI, comme MiddlewareMixin
+            markcoroutinefunction(self)
+
+    def _entrer(self, request):
+        replique = (request.method in ('GET', 'HEAD') and COOKIE_PRIMAIRE not in request.COOKIES
+                    and any(chemin.search(request.path_info) for chemin in self.chemins))
+        return _lecture_replique.set(replique), _epingle.set(False)
+
+    def _sortir(self, jetons, response):
+        if _epingle.get():
+            response.set_cookie(COOKIE_PRIMAIRE, '1', max_age=configuration()['epinglage_s'], httponly=True,
+                                samesite='Lax')
+        _lecture_replique.reset(jetons[0])
+        _epingle.reset(jetons[1])
+        return response
+
+    def __call__(self, request):
+        if self.asynchrone:
+            return self.__acall__(request)
+        jetons = self._entrer(request)
+        return self._sortir(jetons, self.get_response(request))
+
+    async def __acall__(self, request):
+        jetons = self._entrer(request)
+        return self._sortir(jetons, await self.get_response(request))
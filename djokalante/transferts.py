@@ -0,0 +1,272 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from djokalante import codes, cumuls, velocite
+from djokalante.grand_livre import Mouvement, appliquer
+from djokalante.journal import journaliser
+from djokalante.models import (CumulJournalier, Ecriture, EtatTransfert, Guichet, NatureTitulaire, Promotion,
+                               StatutObjet, Transfert)
+from djokalante.parametres import parametres
+from djokalante.promotions import attribuer_promotions, meilleure_promotion
+from djokalante.referentiel import referentiel
+
+CENTIME = Decimal('0.01')
+CENT = Decimal('100')
+
+Commission = namedtuple('Commission', ['total', 'operateur', 'expediteur', 'payeur', 'remise'])
+
+
+class TransfertError(Exception):
+    pass
+
+
+class PlafondDepasse(TransfertError):
+    pass
+
+
+class VelociteDepassee(TransfertError):
+    def __init__(self, alertes):
+        self.alertes = alertes
+        # Ni telephone ni numero de piece dans le message, repris tel quel par le journal
+        super().__init__("; ".join(velocite.decrire(alerte) for alerte in alertes))
+
+
+def parametres_application():
+    courant = parametres.courant
+    if courant is None:
+        raise TransfertError("Aucun parametre d'application n'est configure")
+    return courant
+
+
+class Tarif:
+    """
+    Bareme precalcule a partir des parametres : les parts sont des pourcentages du montant envoye et la
+    promotion retranche son pourcentage de la commission.
+    """
+
+    def __init__(self, parametres):
+        self.taux_operateur = parametres.opeartor_part / CENT
+        self.taux_expediteur = parametres.expeditor_part / CENT
+        self.taux_payeur = parametres.payer_part / CENT
+        self.taux = self.taux_operateur + self.taux_expediteur + self.taux_payeur
+        self._remises = {}
+
+    def remise(self, promotion):
+        if promotion is None:
+            return Decimal('0')
+        taux = self._remises.get(promotion.id)
+        if taux is None:
+            taux = self._remises[promotion.id] = min(promotion.porcentage, CENT) / CENT
+        return taux
+
+    def commission(self, montant, promotion=None):
+        brute = (montant * self.taux).quantize(CENTIME, ROUND_HALF_UP)
+        remise = (brute * self.remise(promotion)).quantize(CENTIME, ROUND_HALF_UP)
+        total = brute - remise
+        if not self.taux:
+            return Commission(total, total, Decimal('0'), Decimal('0'), remise)
+        expediteur = (total * self.taux_expediteur / self.taux).quantize(CENTIME, ROUND_HALF_UP)
+        payeur = (total * self.taux_payeur / self.taux).quantize(CENTIME, ROUND_HALF_UP)
+        return Commission(total, total - expediteur - payeur, expediteur, payeur, remise)
+
+
+def calculer_commission(montant, promotion=None, parametres=None):
+    return Tarif(parametres or parametres_application()).commission(montant, promotion)
+
+
+def _reserver_plafond(telephone, jour, montant, plafond):
+    # Le cumul du jour est tenu a jour par expediteur : le controle du plafond est une seule mise a jour
+    # conditionnelle, sans SUM() sur les transferts du jour.
+    for _ in range(2):
+        if CumulJournalier.objects.filter(expeditor_phone=telephone, jour=jour, montant__lte=plafond - montant) \
+                .update(montant=F('montant') + montant, nombre=F('nombre') + 1):
+            return
+        if montant > plafond or CumulJournalier.objects.filter(expeditor_phone=telephone, jour=jour).exists():
+            raise PlafondDepasse(_plafond_depasse(telephone, plafond))
+        try:
+            with transaction.atomic():
+                CumulJournalier.objects.create(expeditor_phone=telephone, jour=jour, montant=montant, nombre=1)
+            return
+        except IntegrityError:
+            # Un autre envoi du meme expediteur vient de creer la ligne du jour : on repasse par la mise a jour
+            continue
+    raise PlafondDepasse(_plafond_depasse(telephone, plafond))
+
+
+def _plafond_depasse(telephone, plafond):
+    # Empreinte et non telephone : le message finit dans le journal
+    return f"Plafond journalier de {plafond} depasse pour l'expediteur {velocite.empreinte(telephone)}"
+
+
+def envoyer_transfert(guichet, utilisateur, montant, motif, promotion=None, operation_code=None,
+                      operation_number=None, parametres=None, **identites):
+    """
+    Enregistre un transfert envoye depuis un guichet.
+
+    identites porte les champs expeditor_* et beneficiaire_* du transfert. Le controle du plafond, la creation
+    du transfert et le debit du guichet (montant et parts de commission qui ne lui reviennent pas) sont faits
+    dans une seule transaction ; l'evenement est confie au journal differe apres validation. Sans promotion
+    donnee, la meilleure promotion du jour est appliquee. Les regles de velocite (velocite.py) sont evaluees
+    avant toute ecriture : une regle a refuser leve VelociteDepassee, une regle a signaler est journalisee.
+    """
+    parametres = parametres or parametres_application()
+    if promotion is None:
+        promotion = meilleure_promotion()
+    commission = Tarif(parametres).commission(montant, promotion)
+    maintenant = timezone.now()
+
+    transfert = Transfert(
+        operation_code=operation_code or codes.nouveau_code(),
+        operation_number=operation_number or codes.nouveau_numero(),
+        account=montant,
+        commission_account=commission.total,
+        commission_payeur=commission.payeur,
+        state=EtatTransfert.ENVOYE,
+        statut=StatutObjet.INSERT,
+        motif=motif,
+        propotion_id=promotion.id if promotion else None,
+        guichet=guichet,
+        user_creator=utilisateur,
+        user_modificator=utilisateur,
+        **identites,
+    )
+    transfert.clean_fields(exclude=['motif', 'propotion', 'guichet', 'user_creator', 'user_modificator'])
+
+    alertes = velocite.evaluer(transfert)
+    refus = [alerte for alerte in alertes if alerte.action == velocite.REFUSER]
+    if refus:
+        erreur = VelociteDepassee(refus)
+        journaliser("REFUS_VELOCITE", f"Transfert refuse au guichet {guichet.pk} : {erreur}")
+        raise erreur
+
+    with transaction.atomic():
+        _reserver_plafond(transfert.expeditor_phone, maintenant.date(), montant, parametres.plafond_journalier)
+        transfert.save(force_insert=True)
+        cumuls.enregistrer([transfert])
+        appliquer([Mouvement(guichet, -(montant + commission.total - commission.expediteur),
+                             f"Envoi du transfert {transfert.operation_number}")],
+                  reference=transfert.operation_number, plancher=parametres.seuil_solde)
+        description = (f"Transfert {transfert.operation_number} de {montant} envoye par le guichet {guichet.pk} "
+                       f"(commission {commission.total})")
+        transaction.on_commit(lambda: journaliser("ENVOI_TRANSFERT", description))
+        transaction.on_commit(lambda: velocite.enregistrer(transfert))
+        for alerte in alertes:
+            signalement = f"Transfert {transfert.operation_number} : {velocite.decrire(alerte)}"
+            transaction.on_commit(lambda signalement=signalement: journaliser("ALERTE_VELOCITE", signalement))
+    return transfert
+
+
+def annuler_transfert(transfert, utilisateur):
+    """
+    Annule un transfert envoye et pas encore paye.
+
+    Le guichet est recredite de ce que l'envoi lui avait debite (ecritures du grand livre de l'operation), le
+    plafond journalier de l'expediteur est libere et les cumuls passent a l'etat annule.
+    """
+    with transaction.atomic():
+        transfert = Transfert.objects.select_for_update().get(pk=transfert.pk)
+        if transfert.state != EtatTransfert.ENVOYE:
+            raise TransfertError(f"Le transfert {transfert.operation_number} est {transfert.get_state_display()}")
+        ancien_etat = transfert.state
+        transfert.state = EtatTransfert.ANNULE
+        transfert.cancel_date = timezone.now().date()
+        transfert.statut = StatutObjet.UPDATE
+        transfert.user_modificator = utilisateur
+        transfert.save(update_fields=['state', 'cancel_date', 'statut', 'user_modificator', 'date_modification'])
+        cumuls.enregistrer([transfert], ancien_etat=ancien_etat)
+
+        CumulJournalier.objects.filter(expeditor_phone=transfert.expeditor_phone, jour=transfert.send_date) \
+            .update(montant=F('montant') - transfert.account, nombre=F('nombre') - 1)
+        if transfert.guichet_id:
+            verse = Ecriture.objects.filter(reference=transfert.operation_number, nature=NatureTitulaire.GUICHET,
+                                            titulaire_id=transfert.guichet_id).aggregate(total=Sum('montant'))['total']
+            if verse:
+                appliquer([Mouvement(Guichet(pk=transfert.guichet_id), -verse,
+                                     f"Annulation du transfert {transfert.operation_number}")],
+                          reference=transfert.operation_number)
+        description = f"Transfert {transfert.operation_number} annule par l'utilisateur {utilisateur.pk}"
+        transaction.on_commit(lambda: journaliser("ANNULATION_TRANSFERT", description))
+    return transfert
+
+
+def payer_transfert(code, guichet, utilisateur, parametres=None):
+    """
+    Paie au guichet le transfert dont le code de retrait est code.
+
+    Le code est verifie (chiffre de controle, etat, validite) par une seule lecture, puis le transfert est
+    verrouille et passe a l'etat paye ; le guichet payeur est credite du montant et de la part de commission
+    fixee a l'envoi, quels que soient les parametres du jour.
+    """
+    parametres = parametres or parametres_application()
+    trouve = codes.verifier_code(code, parametres.duree_validite_code)
+    with transaction.atomic():
+        transfert = Transfert.objects.select_for_update().get(pk=trouve.pk)
+        if transfert.state != EtatTransfert.ENVOYE:
+            raise codes.CodeInvalide(f"Le transfert {transfert.operation_number} est {transfert.get_state_display()}")
+        part_payeur = transfert.commission_payeur
+        if part_payeur is None:
+            # Transfert envoye avant commission_payeur : part recalculee. La promotion fixee a l'envoi s'applique
+            # meme supprimee depuis
+            promotion = None
+            if transfert.propotion_id:
+                promotion = (referentiel.promotions.get(transfert.propotion_id)
+                             or Promotion.all_objects.filter(pk=transfert.propotion_id).first())
+            part_payeur = Tarif(parametres).commission(transfert.account, promotion).payeur
+        transfert.state = EtatTransfert.PAYE
+        transfert.reception_date = timezone.now().date()
+        transfert.statut = StatutObjet.UPDATE
+        transfert.user_modificator = utilisateur
+        transfert.save(update_fields=['state', 'reception_date', 'statut', 'user_modificator', 'date_modification'])
+        cumuls.enregistrer([transfert], ancien_etat=EtatTransfert.ENVOYE)
+        appliquer([Mouvement(guichet, transfert.account + part_payeur,
+                             f"Paiement du transfert {transfert.operation_number}")],
+                  reference=transfert.operation_number)
+        description = (f"Transfert {transfert.operation_number} de {transfert.account} paye par le guichet "
+                       f"{guichet.pk}")
+        transaction.on_commit(lambda: journaliser("PAIEMENT_TRANSFERT", description))
+    return transfert
+
+
+def tarifer_lot(transferts, parametres=None):
+    """
+    Calcule la commission d'une liste de transferts en une seule passe et les enregistre par bulk_update.
+
+    Le bareme et les taux de remise des promotions ne sont calcules qu'une fois pour tout le lot. Les transferts
+    sans promotion recoivent celle de leur date d'envoi. L'ecart de commission est reporte dans les cumuls.
+    """
+    tarif = Tarif(parametres or parametres_application())
+    attribuer_promotions([transfert for transfert in transferts if transfert.propotion_id is None])
+    promotions = Promotion.all_objects.in_bulk({t.propotion_id for t in transferts if t.propotion_id})
+    anciennes = {transfert.pk: transfert.commission_account for transfert in transferts}
+    maintenant = timezone.now()
+    for transfert in transferts:
+        commission = tarif.commission(transfert.account, promotions.get(transfert.propotion_id))
+        transfert.commission_account = commission.total
+        transfert.commission_payeur = commission.payeur
+        transfert.date_modification = maintenant
+    with transaction.atomic():
+        Transfert.objects.bulk_update(transferts, ['commission_account', 'commission_payeur', 'propotion',
+                                                   'date_modification'], batch_size=1000)
+        cumuls.enregistrer(transferts, anciennes_commissions=anciennes)
+    return transferts
+
+
+def tarifer_en_attente(taille_lot=5000, parametres=None):
+    """Tarife tous les transferts en attente, par lots, et retourne le nombre de transferts tarifes."""
+    parametres = parametres or parametres_application()
+    total = 0
+    dernier = 0
+    while True:
+        lot = list(Transfert.objects.filter(state=EtatTransfert.EN_ATTENTE, pk__gt=dernier).order_by('pk')
+                   .only('id', 'account', 'commission_account', 'commission_payeur', 'propotion_id', 'state',
+                         'send_date', 'guichet_id', 'motif_id')[:taille_lot])
+        if not lot:
+            return total
+        with transaction.atomic():
+            tarifer_lot(lot, parametres)
+        total += len(lot)
+        dernier = lot[-1].pk
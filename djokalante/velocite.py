@@ -0,0 +1,312 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from djokalante.models import Transfert
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('expeditor_phone', 'expeditor_piece', 'beneficiaire_piece')
+REFUSER = 'refuser'
+SIGNALER = 'signaler'
+
+PARAMETRES_PAR_DEFAUT = {
+    # Fenetre : (duree en secondes, nombre de seaux). Le compte d'une fenetre couvre ses seaux entiers plus le
+    # seau en cours : il peut inclure jusqu'a une largeur de seau de plus que la duree.
+    'fenetres': {'heure': (3600, 12), 'jour': (86400, 24)},
+    # Regles evaluees avant chaque envoi : plus de max transferts pour la meme valeur de dimension sur la fenetre
+    # (transfert en cours compris) declenche l'action (refuser ou signaler).
+    'regles': [
+        {'nom': 'expediteur_heure', 'dimension': 'expeditor_phone', 'fenetre': 'heure', 'max': 10,
+         'action': REFUSER},
+        {'nom': 'expediteur_jour', 'dimension': 'expeditor_phone', 'fenetre': 'jour', 'max': 30, 'action': REFUSER},
+        {'nom': 'piece_expediteur_jour', 'dimension': 'expeditor_piece', 'fenetre': 'jour', 'max': 30,
+         'action': SIGNALER},
+        {'nom': 'piece_beneficiaire_jour', 'dimension': 'beneficiaire_piece', 'fenetre': 'jour', 'max': 20,
+         'action': SIGNALER},
+    ],
+    # Les transferts des autres workers sont relus par cle primaire au plus toutes les rattrapage_s secondes ;
+    # les recouvrement dernieres cles deja lues sont relues pour ne pas manquer un commit tardif.
+    'rattrapage_s': 1,
+    'recouvrement': 100,
+    'purge_s': 600,
+    # Instantane des compteurs pour redemarrer sans relire 24 h de transferts (None : pas d'instantane). Les
+    # compteurs, comme le fichier, sont indexes par empreinte et non par telephone ou numero de piece
+    'instantane': None,
+    'sauvegarde_s': 300,
+}
+
+Alerte = namedtuple('Alerte', ['regle', 'dimension', 'valeur', 'compte', 'max', 'action'])
+Regle = namedtuple('Regle', ['nom', 'dimension', 'fenetre', 'max', 'action'])
+
+
+def empreinte(valeur):
+    """
+    Empreinte courte d'un telephone ou d'un numero de piece, pour le journal : les alertes d'une meme valeur se
+    rapprochent sans que le journal ne la contienne (HMAC cle par SECRET_KEY, pas de table de correspondance).
+    """
+    return salted_hmac('khaliss.velocite', str(valeur), algorithm='sha256').hexdigest()[:12]
+
+
+def decrire(alerte):
+    return (f"{alerte.regle} : {alerte.compte} transferts pour {alerte.dimension} #{empreinte(alerte.valeur)} "
+            f"(maximum {alerte.max})")
+
+
+class Anneau:
+    """
+    Compteur glissant d'une fenetre : seaux de largeur fixe dans un tableau circulaire, et total tenu a jour.
+    Avancer jusqu'au seau courant remet a zero les seaux sortis de la fenetre.
+    """
+
+    __slots__ = ('seaux', 'dernier', 'total')
+
+    def __init__(self, taille, dernier=0, seaux=None):
+        self.seaux = seaux if seaux is not None else array('I', bytes(4 * taille))
+        self.dernier = dernier
+        self.total = sum(self.seaux)
+
+    def _avancer(self, seau):
+        taille = len(self.seaux)
+        if seau - self.dernier >= taille:
+            for rang in range(taille):
+                self.seaux[rang] = 0
+            self.total = 0
+        else:
+            for ancien in range(self.dernier + 1, seau + 1):
+                rang = ancien % taille
+                self.total -= self.seaux[rang]
+                self.seaux[rang] = 0
+        self.dernier = seau
+
+    def ajouter(self, seau, nombre=1):
+        if seau > self.dernier:
+            self._avancer(seau)
+        elif self.dernier - seau >= len(self.seaux):
+            # Evenement plus ancien que la fenetre
+            return
+        self.seaux[seau % len(self.seaux)] += nombre
+        self.total += nombre
+
+    def compter(self, seau):
+        if seau > self.dernier:
+            self._avancer(seau)
+        return self.total
+
+
+class Velocite:
+    """
+    Nombre de transferts par expediteur (telephone, piece) et par piece du beneficiaire sur des fenetres
+    glissantes, tenu en memoire par worker.
+
+    Les compteurs sont rechauffes au premier usage depuis l'instantane local s'il est recent, sinon depuis les
+    transferts des dernieres 24 h. Chaque controle relit ensuite, au plus toutes les rattrapage_s secondes, les
+    transferts enregistres depuis par les autres workers (une lecture par cle primaire) : evaluer les regles ne
+    coute que quelques acces a un dictionnaire.
+    """
+
+    def __init__(self, **parametres):
+        self.parametres = parametres
+        self._verrou = threading.RLock()
+        self._pret = False
+        self._anneaux = {}
+        self._vus = set()
+        self.dernier_id = 0
+        self._rattrape = 0.0
+        self._purge = 0.0
+        self._sauvegarde = 0.0
+        self._sauvegarde_en_cours = False
+
+    def _configurer(self):
+        configuration = {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'KHALISS_VELOCITE', {}), **self.parametres}
+        self.noms_fenetres = list(configuration['fenetres'])
+        self.largeurs = [configuration['fenetres'][nom][0] // configuration['fenetres'][nom][1]
+                         for nom in self.noms_fenetres]
+        self.tailles = [configuration['fenetres'][nom][1] for nom in self.noms_fenetres]
+        self.duree_max = max(configuration['fenetres'][nom][0] for nom in self.noms_fenetres)
+        self.regles = [Regle(regle['nom'], regle['dimension'], self.noms_fenetres.index(regle['fenetre']),
+                             regle['max'], regle.get('action', REFUSER))
+                       for regle in configuration['regles']]
+        self.rattrapage_s = configuration['rattrapage_s']
+        self.recouvrement = configuration['recouvrement']
+        self.purge_s = configuration['purge_s']
+        self.instantane = Path(configuration['instantane']) if configuration['instantane'] else None
+        self.sauvegarde_s = configuration['sauvegarde_s']
+
+    def _demarrer(self):
+        self._configurer()
+        if not self._charger():
+            self._rechauffer()
+        self._rattraper(time.time())
+        self._pret = True
+        if self.instantane is not None:
+            atexit.register(self.sauvegarder)
+
+    def _signature(self):
+        return [[nom, largeur, taille] for nom, largeur, taille in zip(self.noms_fenetres, self.largeurs, self.tailles)]
+
+    # Compteurs
+
+    def _ajouter(self, pk, instant, valeurs):
+        if pk in self._vus:
+            return
+        self._vus.add(pk)
+        self.dernier_id = max(self.dernier_id, pk)
+        for dimension, valeur in zip(DIMENSIONS, valeurs):
+            if not valeur:
+                continue
+            cle = (dimension, empreinte(valeur))
+            anneaux = self._anneaux.get(cle)
+            if anneaux is None:
+                anneaux = self._anneaux[cle] = [Anneau(taille) for taille in self.tailles]
+            for anneau, largeur in zip(anneaux, self.largeurs):
+                anneau.ajouter(int(instant // largeur))
+
+    def _lignes(self, queryset):
+        return queryset.values_list('pk', 'date_creation', *DIMENSIONS).order_by('pk').iterator(chunk_size=5000)
+
+    def _rechauffer(self):
+        limite = timezone.now() - timedelta(seconds=self.duree_max)
+        # Point de depart du rattrapage, meme sans transfert dans la fenetre
+        self.dernier_id = Transfert.objects.aggregate(dernier=Max('pk'))['dernier'] or 0
+        # send_date est indexe : on lit les jours couverts puis on ecarte ce qui sort de la fenetre
+        for pk, creation, *valeurs in self._lignes(Transfert.objects.filter(send_date__gte=limite.date())):
+            if creation is not None and creation >= limite:
+                self._ajouter(pk, creation.timestamp(), valeurs)
+
+    def _rattraper(self, maintenant):
+        self._rattrape = maintenant
+        depuis = max(self.dernier_id - self.recouvrement, 0)
+        for pk, creation, *valeurs in self._lignes(Transfert.objects.filter(pk__gt=depuis)):
+            self._ajouter(pk, creation.timestamp() if creation else maintenant, valeurs)
+        plancher = self.dernier_id - self.recouvrement
+        self._vus = {pk for pk in self._vus if pk > plancher}
+        if maintenant - self._purge >= self.purge_s:
+            self._purger(maintenant)
+        if self.instantane is not None and maintenant - self._sauvegarde >= self.sauvegarde_s:
+            self._sauvegarde = maintenant
+            if not self._sauvegarde_en_cours:
+                self._sauvegarde_en_cours = True
+                threading.Thread(target=self.sauvegarder, name='velocite', daemon=True).start()
+
+    def _purger(self, maintenant):
+        self._purge = maintenant
+        seaux = [int(maintenant // largeur) for largeur in self.largeurs]
+        vides = [cle for cle, anneaux in self._anneaux.items()
+                 if not any(anneau.compter(seau) for anneau, seau in zip(anneaux, seaux))]
+        for cle in vides:
+            del self._anneaux[cle]
+
+    def _preparer(self):
+        maintenant = time.time()
+        if not self._pret:
+            self._demarrer()
+        elif maintenant - self._rattrape >= self.rattrapage_s:
+            self._rattraper(maintenant)
+        return maintenant
+
+    def enregistrer(self, transfert):
+        """Compte un transfert accepte par ce worker, sans attendre le prochain rattrapage."""
+        with self._verrou:
+            if not self._pret:
+                self._demarrer()
+            instant = transfert.date_creation.timestamp() if transfert.date_creation else time.time()
+            self._ajouter(transfert.pk, instant, [getattr(transfert, dimension) for dimension in DIMENSIONS])
+
+    def compter(self, dimension, valeur, fenetre):
+        with self._verrou:
+            maintenant = self._preparer()
+            rang = self.noms_fenetres.index(fenetre)
+            anneaux = self._anneaux.get((dimension, empreinte(valeur)))
+            return anneaux[rang].compter(int(maintenant // self.largeurs[rang])) if anneaux else 0
+
+    def evaluer(self, transfert):
+        """Alertes des regles que depasserait transfert (objet ou dictionnaire des dimensions) s'il etait accepte."""
+        lire = transfert.get if isinstance(transfert, dict) else lambda nom: getattr(transfert, nom, None)
+        alertes = []
+        valeurs = {dimension: lire(dimension) for dimension in DIMENSIONS}
+        empreintes = {dimension: empreinte(valeur) for dimension, valeur in valeurs.items() if valeur}
+        with self._verrou:
+            maintenant = self._preparer()
+            for regle in self.regles:
+                valeur = valeurs[regle.dimension]
+                anneaux = self._anneaux.get((regle.dimension, empreintes[regle.dimension])) if valeur else None
+                if anneaux is None:
+                    compte = 1
+                else:
+                    compte = anneaux[regle.fenetre].compter(int(maintenant // self.largeurs[regle.fenetre])) + 1
+                if compte > regle.max:
+                    alertes.append(Alerte(regle.nom, regle.dimension, valeur, compte, regle.max, regle.action))
+        return alertes
+
+    # Instantane
+
+    def sauvegarder(self):
+        """Ecrit l'instantane des compteurs (fichier temporaire puis remplacement)."""
+        try:
+            if self.instantane is None or not self._pret:
+                return
+            with self._verrou:
+                anneaux = [[dimension, cle, [[anneau.dernier, anneau.seaux.tobytes()] for anneau in liste]]
+                           for (dimension, cle), liste in self._anneaux.items()]
+                entete = {'version': 2, 'instant': time.time(), 'dernier_id': self.dernier_id,
+                          'vus': sorted(self._vus), 'fenetres': self._signature()}
+            for ligne in anneaux:
+                ligne[2] = [[dernier, array('I', seaux).tolist()] for dernier, seaux in ligne[2]]
+            contenu = zlib.compress(json.dumps({**entete, 'anneaux': anneaux}, separators=(',', ':')).encode(), 3)
+            self.instantane.parent.mkdir(parents=True, exist_ok=True)
+            temporaire = self.instantane.with_name(f"{self.instantane.name}.{os.getpid()}.tmp")
+            # Lisible du seul compte du service
+            with open(temporaire, 'wb', opener=lambda chemin, drapeaux: os.open(chemin, drapeaux, 0o600)) as fichier:
+                fichier.write(contenu)
+                fichier.flush()
+                os.fsync(fichier.fileno())
+            os.replace(temporaire, self.instantane)
+        except Exception:
+            logger.exception("Instantane des compteurs de velocite impossible")
+        finally:
+            self._sauvegarde_en_cours = False
+
+    def _charger(self):
+        if self.instantane is None or not self.instantane.exists():
+            return False
+        try:
+            donnees = json.loads(zlib.decompress(self.instantane.read_bytes()))
+        except (OSError, ValueError, zlib.error):
+            logger.warning("Instantane de velocite illisible : %s", self.instantane)
+            return False
+        if donnees.get('version') != 2 or donnees['fenetres'] != self._signature() \
+                or time.time() - donnees['instant'] >= self.duree_max:
+            return False
+        self._anneaux = {(dimension, cle): [Anneau(len(seaux), dernier, array('I', seaux)) for dernier, seaux in liste]
+                         for dimension, cle, liste in donnees['anneaux']}
+        self._vus = set(donnees['vus'])
+        self.dernier_id = donnees['dernier_id']
+        return True
+
+    def metriques(self):
+        return {'cles': len(self._anneaux), 'dernier_id': self.dernier_id, 'pret': self._pret}
+
+
+velocite = Velocite()
+
+
+def evaluer(transfert):
+    return velocite.evaluer(transfert)
+
+
+def enregistrer(transfert):
+    velocite.enregistrer(transfert)
@@ -1,35 +1,112 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import login, logout
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect,
+                         JsonResponse)
 from django.shortcuts import render
 from django.urls import reverse
 
+from djokalante import mesures
+from djokalante.journal import ajournaliser
 from djokalante.LoginBackend import LoginBackend
+from djokalante.models import Compte, Journalisation, NatureNom, Transfert
+from djokalante.pagination import CurseurInvalide, KeysetPaginator
+from djokalante.recherche import rechercher
+from djokalante.referentiel import referentiel
 
+LOGIN_BACKEND = 'djokalante.LoginBackend.LoginBackend'
+# Code d'action (Action.action_code) du profil, verifie par ProfilBackend
+ACTION_RECHERCHE_NOMS = 'RECH_NOMS'
 
-def page_de_connexion(request):
+
+async def page_de_connexion(request):
     return render(request, 'login.html')
 
 
-def home(request):
+async def home(request):
     return render(request, 'home.html')
 
 
-def se_connecter(request):
+async def se_connecter(request):
     if request.method != "POST":
         return HttpResponse("<h2>Methode non autorisee</h2>")
     else:
-        user = LoginBackend.authenticate(request, username=request.POST.get("username"),
-                                         password=request.POST.get("password"))
-        print(f"{user}")
+        user = await LoginBackend().aauthenticate(request, username=request.POST.get("username"),
+                                                  password=request.POST.get("password"))
         if user is not None:
-            login(request, user)
+            user.backend = LOGIN_BACKEND
+            await sync_to_async(login)(request, user)
+            await ajournaliser("CONNEXION", f"Connexion de {user.username}")
             return HttpResponseRedirect(reverse("home"))
         else:
+            await ajournaliser("ECHEC_CONNEXION", f"Echec de connexion pour {request.POST.get('username', '')[:150]}")
             messages.error(request, "Informations d'identification invalides")
             return HttpResponseRedirect("/")
 
 
-def se_deconnecter(request):
-    logout(request)
+async def se_deconnecter(request):
+    await sync_to_async(logout)(request)
     return HttpResponseRedirect("/")
+
+
+async def _page_json(request, queryset, cles, champs, completer=None):
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return HttpResponseRedirect("/")
+    try:
+        taille = min(int(request.GET.get("taille", 50)), 200)
+        paginator = KeysetPaginator(queryset.values(*champs), cles, par_page=max(taille, 1))
+        page = await paginator.apage(request.GET.get("apres"))
+    except (ValueError, CurseurInvalide):
+        return HttpResponseBadRequest("<h2>Parametres de pagination invalides</h2>")
+    resultats = page.object_list
+    if completer is not None:
+        # Le referentiel peut avoir a se recharger : lecture en base hors de la boucle d'evenements
+        resultats = await sync_to_async(lambda: [completer(ligne) for ligne in page.object_list])()
+    return JsonResponse({"resultats": resultats, "suivant": page.suivant})
+
+
+def _libelle_motif(ligne):
+    motif = referentiel.motifs.get(ligne["motif_id"])
+    return {**ligne, "motif": motif.libelle if motif else None}
+
+
+async def liste_transferts(request):
+    return await _page_json(request, Transfert.objects.all(), ('-send_date', '-id'), (
+        'id', 'operation_number', 'send_date', 'expeditor_last_name', 'expeditor_first_name',
+        'beneficiaire_last_name', 'beneficiaire_first_name', 'account', 'commission_account', 'state', 'motif_id'),
+        completer=_libelle_motif)
+
+
+async def liste_comptes(request):
+    return await _page_json(request, Compte.objects.all(), ('-id',), (
+        'id', 'card_number', 'phone', 'last_name', 'first_name', 'solde', 'account_status'))
+
+
+async def liste_journalisation(request):
+    return await _page_json(request, Journalisation.objects.all(), ('-id',), (
+        'id', 'event', 'description', 'date_event'))
+
+
+async def recherche_noms(request):
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return HttpResponseRedirect("/")
+    # Noms et identifiants des clients : reserve aux profils habilites
+    if not await sync_to_async(request.user.has_perm)(ACTION_RECHERCHE_NOMS):
+        return HttpResponseForbidden("<h2>Action non autorisee</h2>")
+    natures = request.GET.getlist("nature")
+    if any(nature not in NatureNom.values for nature in natures):
+        return HttpResponseBadRequest("<h2>Nature inconnue</h2>")
+    try:
+        limite = min(max(int(request.GET.get("limite", 20)), 1), 100)
+    except ValueError:
+        return HttpResponseBadRequest("<h2>Limite invalide</h2>")
+    resultats = await sync_to_async(rechercher)(request.GET.get("q", "")[:120], natures or None, limite)
+    return JsonResponse({"resultats": [resultat._asdict() for resultat in resultats]})
+
+
+async def metriques(request):
+    # Lue par l'agent Prometheus de la machine : une requete passee par un proxy n'est pas locale
+    if (request.META.get("REMOTE_ADDR") not in mesures.configuration()["adresses"]
+            or "HTTP_X_FORWARDED_FOR" in request.META):
+        raise Http404
+    return HttpResponse(mesures.metriques.texte(), content_type="text/plain; version=0.0.4; charset=utf-8")
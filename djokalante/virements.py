@@ -0,0 +1,136 @@
+import csv
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from djokalante.fichiers import montant_max, ouvrir
+from djokalante.grand_livre import Mouvement, SoldeInsuffisant, appliquer
+from djokalante.models import Compte, Employeur, EtatImport, EtatLigneVirement, HistoriqueFichierVirement, \
+    LigneVirement
+
+
+MONTANT_MAX = montant_max(LigneVirement)
+
+
+class ImportVirementError(Exception):
+    pass
+
+
+def lire_lignes(flux, delimiteur=';', entete=True):
+    """Genere les lignes du fichier sous la forme (numero_ligne, telephone, montant_brut)."""
+    lecteur = csv.reader(flux, delimiter=delimiteur)
+    if entete:
+        next(lecteur, None)
+    for numero, ligne in enumerate(lecteur, start=1):
+        if not ligne or not any(champ.strip() for champ in ligne):
+            continue
+        telephone = ligne[0].strip()
+        montant = ligne[1].strip() if len(ligne) > 1 else ""
+        yield numero, telephone, montant
+
+
+def decouper(lignes, taille):
+    iterateur = iter(lignes)
+    while True:
+        lot = list(islice(iterateur, taille))
+        if not lot:
+            return
+        yield lot
+
+
+def _lire_montant(brut):
+    try:
+        montant = Decimal(brut.replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    # Au-dela de MONTANT_MAX, LigneVirement.montant ne peut pas l'enregistrer
+    if not montant.is_finite() or not 0 < montant < MONTANT_MAX or montant.as_tuple().exponent < -2:
+        return None
+    return montant
+
+
+def _valider_lot(historique, lot):
+    lignes = []
+    for numero, telephone, brut in lot:
+        montant = _lire_montant(brut)
+        ligne = LigneVirement(historique=historique, numero_ligne=numero, phone=telephone[:20], montant=montant,
+                              etat=EtatLigneVirement.CREDITEE)
+        if not telephone:
+            ligne.etat, ligne.motif_rejet = EtatLigneVirement.REJETEE, "Telephone absent"
+        elif montant is None:
+            ligne.etat, ligne.motif_rejet = EtatLigneVirement.REJETEE, f"Montant invalide : {brut[:50]}"
+        lignes.append(ligne)
+    return lignes
+
+
+def _traiter_lot(historique, lignes):
+    telephones = {ligne.phone for ligne in lignes if ligne.etat == EtatLigneVirement.CREDITEE}
+    comptes = {}
+    for compte in Compte.objects.filter(phone__in=telephones).only('id', 'phone').order_by('pk'):
+        comptes.setdefault(compte.phone, compte)
+
+    total = Decimal('0')
+    mouvements = []
+    for ligne in lignes:
+        if ligne.etat != EtatLigneVirement.CREDITEE:
+            continue
+        compte = comptes.get(ligne.phone)
+        if compte is None:
+            ligne.etat, ligne.motif_rejet = EtatLigneVirement.REJETEE, "Compte introuvable"
+            continue
+        ligne.compte = compte
+        mouvements.append(Mouvement(compte, ligne.montant, f"Virement {historique.file_name}"[:200]))
+        total += ligne.montant
+    if total:
+        mouvements.append(Mouvement(Employeur(pk=historique.employe_id), -total,
+                                    f"Virement {historique.file_name}"[:200]))
+
+    with transaction.atomic():
+        try:
+            appliquer(mouvements, reference=f"HFV-{historique.pk}")
+        except SoldeInsuffisant:
+            raise ImportVirementError(f"Solde de l'employeur insuffisant pour debiter {total}")
+        LigneVirement.objects.bulk_create(lignes)
+
+        rejetees = sum(1 for ligne in lignes if ligne.etat == EtatLigneVirement.REJETEE)
+        HistoriqueFichierVirement.objects.filter(pk=historique.pk).update(
+            etat=EtatImport.EN_COURS,
+            dernier_lot=F('dernier_lot') + 1,
+            derniere_ligne=lignes[-1].numero_ligne,
+            lignes_traitees=F('lignes_traitees') + len(lignes),
+            lignes_rejetees=F('lignes_rejetees') + rejetees,
+            montant_total=F('montant_total') + total,
+            date_modification=timezone.now(),
+        )
+
+
+def importer_fichier(historique, fichier, delimiteur=';', entete=True, encodage='utf-8-sig'):
+    """
+    Importe un fichier de virement de salaires (telephone;montant) par lots.
+
+    Chaque lot est valide puis ecrit dans sa propre transaction : les comptes sont credites par le grand livre
+    (un bulk_update par lot), l'employeur est debite une seule fois pour le lot et l'avancement est enregistre
+    sur l'historique.
+    Un import interrompu reprend apres la derniere ligne validee, meme si taille_lot a change depuis.
+    """
+    historique = HistoriqueFichierVirement.objects.get(pk=historique.pk)
+    if historique.etat == EtatImport.TERMINE:
+        return historique
+
+    try:
+        with ouvrir(fichier, encodage) as flux:
+            lignes = (ligne for ligne in lire_lignes(flux, delimiteur, entete) if ligne[0] > historique.derniere_ligne)
+            for lot in decouper(lignes, historique.taille_lot):
+                _traiter_lot(historique, _valider_lot(historique, lot))
+    except Exception as erreur:
+        HistoriqueFichierVirement.objects.filter(pk=historique.pk).update(
+            etat=EtatImport.ECHEC, message_erreur=str(erreur), date_modification=timezone.now())
+        raise
+
+    HistoriqueFichierVirement.objects.filter(pk=historique.pk).update(
+        etat=EtatImport.TERMINE, message_erreur="", date_modification=timezone.now())
+    historique.refresh_from_db()
+    return historique
@@ -0,0 +1,20 @@
+"""
+Reglages de khaliss, par profil : base.py (commun), dev.py, prod.py et bench.py.
+
+Le profil est choisi par la variable KHALISS_PROFIL (dev par defaut), avec DJANGO_SETTINGS_MODULE=khaliss.settings ;
+DJANGO_SETTINGS_MODULE=khaliss.settings.prod charge aussi directement un profil.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+PROFIL = os.environ.get('KHALISS_PROFIL', 'dev').strip() or 'dev'
+
+if PROFIL == 'dev':
+    from khaliss.settings.dev import *  # noqa: F401,F403
+elif PROFIL == 'prod':
+    from khaliss.settings.prod import *  # noqa: F401,F403
+elif PROFIL == 'bench':
+    from khaliss.settings.bench import *  # noqa: F401,F403
+else:
+    raise ImproperlyConfigured(f"KHALISS_PROFIL inconnu : {PROFIL} (dev, prod ou bench)")
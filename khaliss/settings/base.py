@@ -0,0 +1,276 @@
+"""
+Reglages communs a tous les profils (dev, prod, bench), completes par l'environnement.
+
+Le profil est choisi par KHALISS_PROFIL (voir khaliss/settings/__init__.py) ; chaque profil importe ce module et
+ne redefinit que ce qui lui est propre.
+
+https://docs.djangoproject.com/en/4.1/ref/settings/
+"""
+import os
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def env(nom, defaut=None):
+    valeur = os.environ.get(nom, '').strip()
+    return valeur if valeur else defaut
+
+
+def env_booleen(nom, defaut=False):
+    valeur = env(nom)
+    return defaut if valeur is None else valeur.lower() in ('1', 'true', 'oui', 'yes', 'on')
+
+
+def env_entier(nom, defaut):
+    valeur = env(nom)
+    try:
+        return defaut if valeur is None else int(valeur)
+    except ValueError:
+        raise ImproperlyConfigured(f"{nom} doit etre un entier, pas {valeur!r}")
+
+
+def env_liste(nom, defaut=()):
+    valeur = env(nom)
+    return list(defaut) if valeur is None else [element.strip() for element in valeur.split(',') if element.strip()]
+
+
+def base_de_donnees(moteur=None, **defauts):
+    """
+    Base 'default' decrite par les variables KHALISS_DB_* (voir le profil prod), defauts donnant les valeurs
+    utilisees quand une variable est absente.
+    """
+    moteur = env('KHALISS_DB_MOTEUR', moteur or 'mysql')
+    if moteur not in ('mysql', 'sqlite3'):
+        raise ImproperlyConfigured(f"KHALISS_DB_MOTEUR inconnu : {moteur}")
+    reserve = env_booleen('KHALISS_DB_RESERVE', defauts.get('reserve', False))
+    mysql = moteur == 'mysql'
+    return {
+        'ENGINE': f"djokalante.reserve.{moteur}" if reserve else f"django.db.backends.{moteur}",
+        'NAME': env('KHALISS_DB_NAME', defauts.get('name', 'khaliss')),
+        'USER': env('KHALISS_DB_USER', defauts.get('user', '')) if mysql else '',
+        'PASSWORD': env('KHALISS_DB_PASSWORD', defauts.get('password', '')) if mysql else '',
+        'HOST': env('KHALISS_DB_HOST', 'localhost') if mysql else '',
+        'PORT': env('KHALISS_DB_PORT', '3306') if mysql else '',
+        # Avec la reserve, Django rend la connexion a la fin de chaque requete et la reserve la garde ouverte
+        'CONN_MAX_AGE': 0 if reserve else env_entier('KHALISS_DB_CONN_MAX_AGE', defauts.get('conn_max_age', 0)),
+        # Une connexion persistante est verifiee au debut de la requete qui la reprend
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'connect_timeout': 5, 'charset': 'utf8mb4'} if mysql else {},
+        'RESERVE': {
+            'taille': env_entier('KHALISS_DB_RESERVE_TAILLE', 10),
+            'attente_s': env_entier('KHALISS_DB_RESERVE_ATTENTE_S', 5),
+        },
+    }
+
+
+# Cle, mode debug et hotes : fixes par le profil
+SECRET_KEY = env('KHALISS_SECRET_KEY')
+DEBUG = False
+ALLOWED_HOSTS = env_liste('KHALISS_ALLOWED_HOSTS')
+
+AUTH_USER_MODEL = "djokalante.Utilisateur"
+
+AUTHENTICATION_BACKENDS = [
+    'djokalante.ProfilBackend.ProfilBackend',
+    'djokalante.LoginBackend.LoginBackend',
+]
+
+# Application definition
+
+# Applications chargees par tous les profils. L'admin (KHALISS_ADMIN) peut etre retire des workers qui ne servent
+# que l'application ; staticfiles n'est utile qu'au serveur de developpement et a collectstatic.
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'djokalante',
+]
+ADMIN = env_booleen('KHALISS_ADMIN', True)
+if ADMIN:
+    INSTALLED_APPS.insert(0, 'django.contrib.admin')
+
+MIDDLEWARE = [
+    'djokalante.mesures.MesuresMiddleware',
+    'djokalante.routage.RoutageMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'khaliss.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'OPTIONS': {
+            # Gabarits compiles une fois par worker
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'khaliss.wsgi.application'
+ASGI_APPLICATION = 'khaliss.asgi.application'
+
+# Les vues sont asynchrones : les messages sont gardes dans un cookie pour ne pas charger la session en base
+# depuis la boucle d'evenements.
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
+# Database : chaque profil appelle base_de_donnees() avec ses valeurs par defaut
+# https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+
+DATABASES = {'default': base_de_donnees()}
+
+# Repliques en lecture : un alias par replique dans DATABASES, liste dans KHALISS_ROUTAGE['repliques'], par exemple
+#     DATABASES['replique'] = {**DATABASES['default'], 'HOST': 'replique.local',
+#                              'OPTIONS': {'connect_timeout': 2}, 'TEST': {'MIRROR': 'default'}}
+# Les lectures des chemins ci-dessous (GET uniquement) et des blocs lecture_replique() vont sur une replique
+# disponible ; une requete qui ecrit, et le client pendant epinglage_s secondes ensuite, restent sur 'default'.
+DATABASE_ROUTERS = ['djokalante.routage.RouteurRepliques']
+KHALISS_ROUTAGE = {
+    'repliques': [],
+    'applications': ['djokalante'],
+    'chemins': [r'^/admin/[^/]+/[^/]+/$', r'^/(transferts|comptes|journalisation|recherche)$'],
+    'epinglage_s': 5,
+    'verification_s': 10,
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
+
+PASSWORD_HASHERS = [
+    'djokalante.hachage.PBKDF2AjustableHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Cout du hachage des mots de passe, a ajuster avec "manage.py calibrer_hachage"
+KHALISS_PBKDF2_ITERATIONS = 390000
+
+# Limitation des tentatives de connexion : (tentatives maximum, fenetre en secondes)
+KHALISS_LIMITES_CONNEXION = {
+    'ip': (30, 300),
+    'username': (5, 300),
+}
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.0/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.0/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Index partiels (lignes non supprimees) : MySQL ne sait pas les creer et les cree complets, comme voulu
+
+SILENCED_SYSTEM_CHECKS = ['models.W037']
+
+# Fichiers d'estampille partages par les workers pour invalider leurs caches locaux
+
+KHALISS_ESTAMPILLES_DIR = BASE_DIR / 'var' / 'estampilles'
+
+# Journal differe (Journalisation) : tampon borne, ecriture par lots et segments WAL locaux
+
+KHALISS_JOURNAL = {
+    'repertoire': BASE_DIR / 'var' / 'journal',
+    'taille_max': 10000,
+    'taille_lot': 500,
+    'delai_ms': 200,
+    'attente_max_ms': 50,
+}
+
+# Archives mensuelles du journal (compacter_journal) et nombre de mois gardes dans la table Journalisation
+KHALISS_ARCHIVES_JOURNAL = BASE_DIR / 'var' / 'archives'
+KHALISS_RETENTION_JOURNAL_MOIS = 6
+
+# Tables de reference (referentiel.py) : avec True, un worker qui recharge une table la partage avec les autres
+# workers de la machine par un fichier a cote des estampilles
+KHALISS_REFERENTIEL_PARTAGE = False
+
+# Codes de retrait : sequence reservee par blocs de taille_bloc par processus, puis chiffres aleatoires et
+# chiffre de controle (voir codes.py)
+KHALISS_CODES = {
+    'taille_bloc': 1000,
+    'chiffres_sequence': 8,
+    'chiffres_aleatoires': 4,
+}
+
+# Compteurs de velocite (velocite.py) : fenetres glissantes, regles evaluees avant chaque envoi et instantane
+# local relu au redemarrage d'un worker
+KHALISS_VELOCITE = {
+    'fenetres': {'heure': (3600, 12), 'jour': (86400, 24)},
+    'regles': [
+        {'nom': 'expediteur_heure', 'dimension': 'expeditor_phone', 'fenetre': 'heure', 'max': 10,
+         'action': 'refuser'},
+        {'nom': 'expediteur_jour', 'dimension': 'expeditor_phone', 'fenetre': 'jour', 'max': 30, 'action': 'refuser'},
+        {'nom': 'piece_expediteur_jour', 'dimension': 'expeditor_piece', 'fenetre': 'jour', 'max': 30,
+         'action': 'signaler'},
+        {'nom': 'piece_beneficiaire_jour', 'dimension': 'beneficiaire_piece', 'fenetre': 'jour', 'max': 20,
+         'action': 'signaler'},
+    ],
+    'instantane': BASE_DIR / 'var' / 'velocite.instantane',
+    'sauvegarde_s': 300,
+}
+
+# Mesures des requetes HTTP (mesures.py) : histogrammes par vue lus sur /metriques depuis la machine, requetes
+# lentes journalisees dans le logger khaliss.requetes_lentes. Les workers additionnent leurs series par le
+# repertoire, a vider au demarrage du service
+KHALISS_MESURES = {
+    'actif': env_booleen('KHALISS_MESURES', True),
+    'seuil_lent_ms': env_entier('KHALISS_MESURES_SEUIL_LENT_MS', 500),
+    'repertoire': env('KHALISS_MESURES_REPERTOIRE', BASE_DIR / 'var' / 'metriques'),
+}
@@ -0,0 +1,16 @@
+"""
+Profil de mesure (KHALISS_PROFIL=bench) : reglages de production sans secret obligatoire, sur une base SQLite
+locale par defaut et sans admin, pour benchmark_connexions et mesurer_demarrage.
+"""
+from khaliss.settings.base import *  # noqa: F401,F403
+from khaliss.settings.base import base_de_donnees, env, env_liste
+
+SECRET_KEY = env('KHALISS_SECRET_KEY', 'khaliss-bench-non-secret')
+
+INSTALLED_APPS = [application for application in INSTALLED_APPS  # noqa: F405
+                  if application != 'django.contrib.admin']
+
+ALLOWED_HOSTS = env_liste('KHALISS_ALLOWED_HOSTS', ['localhost'])
+
+DATABASES = {'default': base_de_donnees('sqlite3', name=str(BASE_DIR / 'var' / 'bench.sqlite3'),  # noqa: F405
+                                        conn_max_age=60)}
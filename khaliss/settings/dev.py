@@ -0,0 +1,24 @@
+"""
+Profil de developpement (KHALISS_PROFIL=dev, par defaut) : DEBUG actif, MySQL local, fichiers statiques servis
+par runserver.
+"""
+from khaliss.settings.base import *  # noqa: F401,F403
+from khaliss.settings.base import base_de_donnees, env, env_booleen, env_liste
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = env('KHALISS_SECRET_KEY', 'django-insecure-)w4aq8ve(wg@y=#2sa4r!4o=f0g=trntlc7leo5qnn(b!$_b9=')
+
+# Chaque requete SQL est gardee en memoire avec DEBUG : a ne jamais activer sur un worker de production
+DEBUG = env_booleen('KHALISS_DEBUG', True)
+
+ALLOWED_HOSTS = env_liste('KHALISS_ALLOWED_HOSTS', ['localhost', '127.0.0.1', '[::1]'])
+
+INSTALLED_APPS = [*INSTALLED_APPS, 'django.contrib.staticfiles']  # noqa: F405
+
+TEMPLATES = [{**TEMPLATES[0], 'OPTIONS': {  # noqa: F405
+    **TEMPLATES[0]['OPTIONS'],  # noqa: F405
+    'context_processors': ['django.template.context_processors.debug',
+                           *TEMPLATES[0]['OPTIONS']['context_processors']],  # noqa: F405
+}}]
+
+DATABASES = {'default': base_de_donnees(user='root', password='root')}
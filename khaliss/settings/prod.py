@@ -0,0 +1,26 @@
+"""
+Profil de production (KHALISS_PROFIL=prod) : DEBUG coupe, configuration lue dans l'environnement.
+
+Variables lues (valeur par defaut entre parentheses) :
+    KHALISS_SECRET_KEY (obligatoire), KHALISS_DEBUG (0), KHALISS_ALLOWED_HOSTS (liste separee par des virgules)
+    KHALISS_ADMIN (1) : 0 retire l'admin des workers qui ne servent que l'application
+    KHALISS_STATICFILES (0) : 1 pour lancer collectstatic avec ce profil
+    KHALISS_DB_MOTEUR (mysql, ou sqlite3 pour une base locale de remplacement), KHALISS_DB_NAME (khaliss),
+    KHALISS_DB_USER, KHALISS_DB_PASSWORD, KHALISS_DB_HOST (localhost), KHALISS_DB_PORT (3306)
+    KHALISS_DB_CONN_MAX_AGE (60) : duree de vie d'une connexion persistante, 0 pour une connexion par requete
+    KHALISS_DB_RESERVE (0) : 1 pour la reserve de connexions par worker (djokalante.reserve), conseillee sous ASGI
+    KHALISS_DB_RESERVE_TAILLE (10), KHALISS_DB_RESERVE_ATTENTE_S (5)
+"""
+from khaliss.settings.base import *  # noqa: F401,F403
+from khaliss.settings.base import ImproperlyConfigured, base_de_donnees, env_booleen
+
+if SECRET_KEY is None:  # noqa: F405
+    raise ImproperlyConfigured("KHALISS_SECRET_KEY est obligatoire en production")
+
+DEBUG = env_booleen('KHALISS_DEBUG')
+
+if env_booleen('KHALISS_STATICFILES'):
+    INSTALLED_APPS = [*INSTALLED_APPS, 'django.contrib.staticfiles']  # noqa: F405
+STATIC_ROOT = BASE_DIR / 'var' / 'static'  # noqa: F405
+
+DATABASES = {'default': base_de_donnees(conn_max_age=60)}
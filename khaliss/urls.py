@@ -13,14 +13,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path
 
 from djokalante import views
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', views.page_de_connexion, name="page_de_connexion"),
     path('home', views.home, name="home"),
     path('se_connecter', views.se_connecter, name="se_connecter"),
+    path('transferts', views.liste_transferts, name="liste_transferts"),
+    path('comptes', views.liste_comptes, name="liste_comptes"),
+    path('journalisation', views.liste_journalisation, name="liste_journalisation"),
+    path('recherche', views.recherche_noms, name="recherche_noms"),
+    path('metriques', views.metriques, name="metriques"),
 ]
+
+# L'admin n'est pas installe sur les workers de production lances avec KHALISS_ADMIN=0
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))